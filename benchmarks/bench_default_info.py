@@ -0,0 +1,41 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Benchmark the cost of the default revision info on updates.
+
+`__im_before_update__` falls back to the default creator and comment when
+they are not passed explicitly. Run with::
+
+  python benchmarks/bench_default_info.py
+"""
+import timeit
+
+from shoobx.immutable import revisioned
+
+NUMBER = 500000
+REPEAT = 5
+
+
+def bench(label, stmt, setup):
+    timer = timeit.Timer(stmt, setup=setup, globals=globals())
+    best = min(timer.repeat(repeat=REPEAT, number=NUMBER))
+    print(f'{label:<40} {best / NUMBER * 1e9:8.1f} ns')
+
+
+def main():
+    setup = (
+        'with revisioned.RevisionedImmutable.__im_create__() as factory:\n'
+        '    rim = factory()\n'
+        'clone = rim.__im_clone__()\n'
+        'before = rim.__im_before_update__')
+    bench('default lookup', 'revisioned.DEFAULT_REVISION_INFO.get()', '')
+    bench('explicit info', 'before(clone, "arthur", "answer")', setup)
+    bench('default info', 'before(clone)', setup)
+    with revisioned.defaultInfo('arthur', 'answer'):
+        bench('default info, set', 'before(clone)', setup)
+
+
+if __name__ == '__main__':
+    main()
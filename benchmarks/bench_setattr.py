@@ -0,0 +1,68 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Benchmark the per-assignment cost of `ImmutableBase.__setattr__`.
+
+Run with::
+
+  python benchmarks/bench_setattr.py
+"""
+import timeit
+
+from shoobx.immutable import immutable, revisioned
+
+try:
+    from shoobx.immutable import pjpersist
+except ImportError:  # pragma: no cover
+    pjpersist = None
+
+NUMBER = 200000
+REPEAT = 5
+
+
+class Person(immutable.Immutable):
+    pass
+
+
+class RevisionedPerson(revisioned.RevisionedImmutable):
+    pass
+
+
+def bench(label, stmt, setup):
+    timer = timeit.Timer(stmt, setup=setup, globals=globals())
+    best = min(timer.repeat(repeat=REPEAT, number=NUMBER))
+    print(f'{label:<40} {best / NUMBER * 1e9:8.1f} ns')
+
+
+def main():
+    setup = (
+        'with Person.__im_create__(finalize=False) as factory:\n'
+        '    person = factory()')
+    bench('user attribute', 'person.name = "Stephan"', setup)
+    bench('internal attribute', 'person.__name__ = "Stephan"', setup)
+    setup = (
+        'with RevisionedPerson.__im_create__(finalize=False) as factory:\n'
+        '    person = factory()')
+    bench('revisioned user attribute', 'person.name = "Stephan"', setup)
+    bench('revisioned internal attribute',
+          'person.__im_version__ = 1', setup)
+    setup = (
+        'with immutable.ImmutableList.__im_create__() as factory:\n'
+        '    im_list = factory()')
+    bench('locked list internal attribute',
+          'im_list.__name__ = "answers"', setup)
+
+    if pjpersist is None:
+        return
+    setup = (
+        'with pjpersist.Immutable.__im_create__(finalize=False) as factory:\n'
+        '    person = factory()')
+    bench('pjpersist user attribute', 'person.title = "Mr."', setup)
+    bench('pjpersist _v_ attribute', 'person._v_cache = None', setup)
+    bench('pjpersist name attribute', 'person.name = "stephan"', setup)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,18 @@
 # Re-export.
 # flake8: noqa
 
-from .immutable import ImmutableBase, Immutable, create, update
+from .immutable import ImmutableBase, Immutable, create, update, checks
+from .immutable import aupdate
 from .immutable import ImmutableList, ImmutableSet, ImmutableDict
+from .immutable import ImmutableShapedDict, SlottedImmutableBase
+from .immutable import im_cached_property, im_memoize
+from .memoize import lruMemoize
 from .revisioned import RevisionedImmutableBase, RevisionedImmutable
 from .revisioned import SimpleRevisionedImmutableManager, RevisionedMapping
+from .revisioned import DeltaRevisionedImmutableManager
+from .revisioned import RevisionConflictError, RevisionStub
+from .revisioned import AsyncRevisionedImmutableManager, asyncManager
+from .filestore import FileRevisionedImmutableContainer
+from .sqlite import SQLiteRevisionedImmutableContainer
+from .feed import ChangeFeed, BatchSubscriber, QueueSubscriber
+from .feed import AsyncQueueSubscriber
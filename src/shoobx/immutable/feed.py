@@ -0,0 +1,216 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Revision Change Feed.
+
+Revision managers with a `changeFeed` publish a `ChangeRecord` for every
+added revision. Subscribers consume the records in batches, so that caches
+and indexers process many updates at once::
+
+  feed = ChangeFeed()
+  indexer = feed.subscribe(BatchSubscriber(reindex, batchSize=1000))
+  manager.changeFeed = feed
+  ...
+  indexer.flush()
+
+`QueueSubscriber` and `AsyncQueueSubscriber` buffer the records in a bounded
+queue for a consumer thread or task. While the queue is full, writers adding
+revisions block (backpressure) for up to `timeout` seconds. Then the
+`overflow` policy applies: `OVERFLOW_RAISE` rejects the record with an
+error, `OVERFLOW_DROP` drops it and counts it in `dropped`.
+
+Records are published after the revision is committed and the writer
+released its locks. A subscriber failing to receive a record is logged and
+does not keep the other subscribers from receiving it, nor fail the write.
+Concurrent writers may publish their records out of order.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import queue
+import threading
+import zope.interface
+
+from shoobx.immutable import interfaces
+
+log = logging.getLogger(__name__)
+
+OVERFLOW_RAISE = 'raise'
+OVERFLOW_DROP = 'drop'
+
+ChangeRecord = collections.namedtuple(
+    'ChangeRecord', ['name', 'oldVersion', 'newVersion', 'creator',
+                     'timestamp'])
+
+
+def createRecord(new, old=None):
+    """Return the change record of adding revision `new` after `old`."""
+    return ChangeRecord(
+        getattr(new, '__name__', None),
+        old.__im_version__ if old is not None else None,
+        new.__im_version__,
+        new.__im_creator__,
+        new.__im_start_on__)
+
+
+@zope.interface.implementer(interfaces.IChangeFeed)
+class ChangeFeed:
+    """Publishes change records to all subscribers."""
+
+    def __init__(self):
+        self.subscribers = ()
+        self.__lock__ = threading.Lock()
+
+    def subscribe(self, subscriber):
+        with self.__lock__:
+            self.subscribers += (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.__lock__:
+            self.subscribers = tuple(
+                sub for sub in self.subscribers if sub is not subscriber)
+
+    def publish(self, record):
+        for subscriber in self.subscribers:
+            try:
+                subscriber.receive(record)
+            except Exception:
+                # The revision is committed already, so the error must not
+                # propagate to the writer.
+                log.exception(
+                    'Subscriber %r failed to receive %r.', subscriber, record)
+
+    def publishRevision(self, new, old=None):
+        if self.subscribers:
+            self.publish(createRecord(new, old))
+
+
+@zope.interface.implementer(interfaces.IChangeFeedSubscriber)
+class BatchSubscriber:
+    """Calls `callback(records)` with every `batchSize` records.
+
+    Call `flush()` to deliver the remaining records.
+    """
+
+    def __init__(self, callback, batchSize=1000):
+        assert batchSize > 0, batchSize
+        self.callback = callback
+        self.batchSize = batchSize
+        self.records = []
+        self.__lock__ = threading.Lock()
+
+    def receive(self, record):
+        with self.__lock__:
+            self.records.append(record)
+            if len(self.records) < self.batchSize:
+                return
+            records, self.records = self.records, []
+        self.callback(records)
+
+    def flush(self):
+        with self.__lock__:
+            records, self.records = self.records, []
+        if records:
+            self.callback(records)
+
+
+@zope.interface.implementer(interfaces.IChangeFeedSubscriber)
+class QueueSubscriber:
+    """Buffers records in a queue of at most `maxsize` records.
+
+    While the queue is full, `receive()` blocks for up to `timeout` seconds.
+    Then it raises `queue.Full`, or drops the record if `overflow` is
+    `OVERFLOW_DROP`.
+    """
+
+    def __init__(self, maxsize=10000, timeout=None, overflow=OVERFLOW_RAISE):
+        if overflow not in (OVERFLOW_RAISE, OVERFLOW_DROP):
+            raise ValueError('Unknown overflow policy.', overflow)
+        self.queue = queue.Queue(maxsize)
+        self.timeout = timeout
+        self.overflow = overflow
+        # Number of dropped records.
+        self.dropped = 0
+
+    def receive(self, record):
+        try:
+            self.queue.put(record, timeout=self.timeout)
+        except queue.Full:
+            if self.overflow == OVERFLOW_RAISE:
+                raise
+            self.dropped += 1
+
+    def getBatch(self, maxSize=1000, timeout=None):
+        """Return up to `maxSize` records.
+
+        Waits up to `timeout` seconds for the first record and returns an
+        empty list if there is none.
+        """
+        try:
+            records = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(records) < maxSize:
+            try:
+                records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+
+@zope.interface.implementer(interfaces.IChangeFeedSubscriber)
+class AsyncQueueSubscriber:
+    """Buffers records in an asyncio queue of at most `maxsize` records.
+
+    Must be created in the event loop consuming the records. Writers in
+    other threads block for up to `timeout` seconds while the queue is full.
+    Writers in the event loop cannot wait. Then `receive()` raises
+    `asyncio.QueueFull`, or drops the record if `overflow` is
+    `OVERFLOW_DROP`.
+    """
+
+    def __init__(self, maxsize=10000, timeout=None, overflow=OVERFLOW_RAISE):
+        if overflow not in (OVERFLOW_RAISE, OVERFLOW_DROP):
+            raise ValueError('Unknown overflow policy.', overflow)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.timeout = timeout
+        self.overflow = overflow
+        # Number of dropped records.
+        self.dropped = 0
+
+    def receive(self, record):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            try:
+                self.queue.put_nowait(record)
+            except asyncio.QueueFull:
+                self.overflowed()
+            return
+        future = asyncio.run_coroutine_threadsafe(
+            self.queue.put(record), self.loop)
+        try:
+            future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            # The record must not be added once it was given up on.
+            future.cancel()
+            self.overflowed()
+
+    def overflowed(self):
+        if self.overflow == OVERFLOW_RAISE:
+            raise asyncio.QueueFull()
+        self.dropped += 1
+
+    async def getBatch(self, maxSize=1000):
+        """Wait for records and return up to `maxSize` of them."""
+        records = [await self.queue.get()]
+        while len(records) < maxSize and not self.queue.empty():
+            records.append(self.queue.get_nowait())
+        return records
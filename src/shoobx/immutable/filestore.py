@@ -0,0 +1,432 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""File-backed Revisioned Immutable Container.
+
+All changes are appended to a log file. Every record is framed by its length
+and CRC32 checksum, so that a record partially written by a crash is
+detected and discarded when the log is replayed::
+
+  <length:4><crc32:4><pickle:length>
+
+Writes are synced to disk in groups of `syncBatch` records, and at the
+latest `syncDelay` seconds after the first pending record was written (group
+commit). Records written after the last sync can be lost on a crash, but
+never corrupt the log. `sync()` and `close()` write all pending records.
+
+Every `snapshotInterval` records, the complete state is written to a
+snapshot file and a new, empty log segment is started, so that the log does
+not grow without bounds and opening the container only replays the records
+written after the latest snapshot. The snapshot is renamed into place, and
+its directory synced, before the new segment replaces the log. The log starts
+with the generation of the snapshot it follows::
+
+  <magic><generation:8><record>...
+"""
+import collections.abc
+import datetime
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+import zope.interface
+
+from shoobx.immutable import immutable, interfaces, revisioned
+
+MAGIC = b'SBXIMLOG1\n'
+HEADER = struct.Struct('>II')
+SEGMENT = struct.Struct('>Q')
+
+OP_ADD = 'add'
+OP_ROLLBACK = 'rollback'
+OP_DELETE = 'delete'
+
+
+def encodeRecord(record):
+    payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def syncDirectory(path):
+    """Sync the directory containing `path`, so that a rename to `path` is
+    durable."""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def readRecords(file, offset):
+    """Iterate over all `(record, end)` pairs of a log file from `offset`.
+
+    Stops at the first incomplete or corrupt record.
+    """
+    file.seek(offset)
+    while True:
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return
+        length, crc = HEADER.unpack(header)
+        payload = file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        offset += HEADER.size + length
+        yield pickle.loads(payload), offset
+
+
+@zope.interface.implementer(interfaces.IRevisionedImmutableManager)
+class FileRevisionedImmutableContainer(collections.abc.MutableMapping):
+    """Container of revisioned immutables stored in an append-only log.
+
+    Immutables are identified by their `__name__`. The revision histories
+    are kept in memory, indexed by name and version.
+    """
+
+    # testing hook, make sure this returns a steady increasing timestamp
+    # on each call, a static datetime does NOT cut it
+    now = datetime.datetime.now
+
+    # Change feed publishing a record for every added revision, see
+    # `shoobx.immutable.feed`.
+    changeFeed = None
+
+    def __init__(self, path, syncBatch=64, syncDelay=0.05,
+                 snapshotInterval=10000):
+        assert syncBatch > 0, syncBatch
+        self.path = path
+        self.snapshotPath = path + '.snapshot'
+        self.syncBatch = syncBatch
+        self.syncDelay = syncDelay
+        self.snapshotInterval = snapshotInterval
+        self.__data__ = {}
+        self.__lock__ = threading.RLock()
+        self.__pending = 0
+        self.__lastSync = time.monotonic()
+        # Timer syncing the pending records after `syncDelay`.
+        self.__flusher = None
+        # Generation of the latest snapshot, 0 without one.
+        self.__generation = 0
+        # Number of records written since the latest snapshot.
+        self.__records = 0
+        self.__file = None
+        self.open()
+
+    def open(self):
+        self.__generation = self.loadSnapshot()
+        if not os.path.exists(self.path):
+            self.startLog(self.__generation)
+        segment = self.openLog()
+        if segment < self.__generation:
+            # The snapshot was written, but the next segment was not started
+            # before a crash. All records are part of the snapshot.
+            self.__file.close()
+            self.startLog(self.__generation)
+            segment = self.openLog()
+        if segment != self.__generation:
+            self.__file.close()
+            raise ValueError('Log segment without snapshot.', self.path)
+
+        end = len(MAGIC) + SEGMENT.size
+        for record, end in readRecords(self.__file, end):
+            self.replay(record)
+            self.__records += 1
+        # Discard a partially written record.
+        self.__file.truncate(end)
+        self.__file.seek(end)
+
+    def startLog(self, generation):
+        """Replace the log with an empty segment following the snapshot of
+        the given generation."""
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'wb') as file:
+            file.write(MAGIC + SEGMENT.pack(generation))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpPath, self.path)
+        syncDirectory(self.path)
+
+    def openLog(self):
+        """Open the log and return the generation of its segment."""
+        self.__file = open(self.path, 'r+b')
+        header = self.__file.read(len(MAGIC) + SEGMENT.size)
+        if len(header) < len(MAGIC) + SEGMENT.size or \
+                not header.startswith(MAGIC):
+            self.__file.close()
+            raise ValueError('Not a revision log.', self.path)
+        return SEGMENT.unpack(header[len(MAGIC):])[0]
+
+    def close(self):
+        with self.__lock__:
+            if self.__file is not None:
+                self.sync()
+                self.__file.close()
+                self.__file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __now(self):
+        return self.now()
+
+    def getManager(self, name, create=False):
+        manager = self.__data__.get(name)
+        if manager is None and create:
+            manager = self.__data__[name] = \
+                revisioned.SimpleRevisionedImmutableManager()
+            manager.now = self.__now
+        return manager
+
+    # Log
+
+    def write(self, record):
+        self.__file.write(encodeRecord(record))
+        self.__pending += 1
+        self.__records += 1
+        if self.__pending >= self.syncBatch or \
+                time.monotonic() - self.__lastSync >= self.syncDelay:
+            self.sync()
+        elif self.__flusher is None:
+            self.__flusher = threading.Timer(
+                self.syncDelay, self.__syncPending)
+            self.__flusher.daemon = True
+            self.__flusher.start()
+        if self.snapshotInterval and \
+                self.__records >= self.snapshotInterval:
+            self.snapshot()
+
+    def __syncPending(self):
+        with self.__lock__:
+            if self.__file is not None and self.__pending:
+                self.sync()
+
+    def sync(self):
+        """Write all pending records to disk."""
+        with self.__lock__:
+            if self.__flusher is not None:
+                self.__flusher.cancel()
+                self.__flusher = None
+            self.__file.flush()
+            if self.__pending:
+                os.fsync(self.__file.fileno())
+            self.__pending = 0
+            self.__lastSync = time.monotonic()
+
+    def replay(self, record):
+        op, name = record[:2]
+        if op == OP_ADD:
+            revision, hasOld = record[2:]
+            manager = self.getManager(name, create=True)
+            if hasOld:
+                old = manager.loadRevision(-1)
+                old.__im_end_on__ = revision.__im_start_on__
+                old.__im_state__ = interfaces.IM_STATE_RETIRED
+            manager.restoreRevision(revision)
+            revision.__im_manager__ = self
+        elif op == OP_ROLLBACK:
+            version, activate = record[2:]
+            manager = self.__data__[name]
+            manager.rollbackToRevision(
+                manager.getRevision(version), activate=activate)
+        elif op == OP_DELETE:
+            endOn, = record[2:]
+            revision = self.__data__[name].getCurrentRevision()
+            revision.__im_end_on__ = endOn
+            revision.__im_state__ = interfaces.IM_STATE_DELETED
+        else:
+            raise ValueError('Unknown log record.', op)
+
+    # Snapshots
+
+    def snapshot(self):
+        """Write the complete state to the snapshot file and start a new log
+        segment."""
+        with self.__lock__:
+            self.sync()
+            generation = self.__generation + 1
+            state = {
+                name: list(manager.getRevisionHistory())
+                for name, manager in self.__data__.items()}
+            data = encodeRecord((generation, state))
+            tmpPath = self.snapshotPath + '.tmp'
+            with open(tmpPath, 'wb') as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmpPath, self.snapshotPath)
+            # The new segment must not replace the log before the snapshot
+            # is found on disk, or the records of the log would be lost.
+            syncDirectory(self.snapshotPath)
+            # All records are part of the snapshot now.
+            self.__file.close()
+            self.startLog(generation)
+            self.openLog()
+            self.__file.seek(0, os.SEEK_END)
+            self.__generation = generation
+            self.__records = 0
+
+    def loadSnapshot(self):
+        """Load the latest snapshot and return its generation."""
+        if not os.path.exists(self.snapshotPath):
+            return 0
+        with open(self.snapshotPath, 'rb') as file:
+            for (generation, state), end in readRecords(file, 0):
+                break
+            else:
+                return 0
+        for name, revisions in state.items():
+            manager = self.getManager(name, create=True)
+            for revision in revisions:
+                manager.restoreRevision(revision)
+                revision.__im_manager__ = self
+        return generation
+
+    # IRevisionedImmutableManager
+
+    def getCurrentRevision(self, obj):
+        manager = self.__data__.get(obj.__name__)
+        return manager.getCurrentRevision() if manager is not None else None
+
+    def getRevision(self, name, version):
+        return self.__data__[name].getRevision(version)
+
+    def getRevisionByVersion(self, version, obj):
+        return self.getRevision(obj.__name__, version)
+
+    def getRevisions(self, keys):
+        """Return the revisions with the given `(name, version)` pairs.
+
+        Missing revisions are left out.
+        """
+        revisions = {}
+        for name, version in keys:
+            manager = self.__data__.get(name)
+            if manager is None:
+                continue
+            try:
+                revisions[(name, version)] = manager.getRevision(version)
+            except KeyError:
+                pass
+        return revisions
+
+    def getRevisionAt(self, timestamp, obj):
+        manager = self.__data__.get(obj.__name__)
+        if manager is None:
+            return None
+        return manager.getRevisionAt(timestamp)
+
+    def getNumberOfRevisions(self, obj):
+        manager = self.__data__.get(obj.__name__)
+        return manager.getNumberOfRevisions() if manager is not None else 0
+
+    def getNumberOfRevisionsMany(self, names):
+        """Return the number of revisions by name."""
+        return {
+            name: (self.__data__[name].getNumberOfRevisions()
+                   if name in self.__data__ else 0)
+            for name in names}
+
+    def getRevisionHistory(
+            self, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        manager = self.__data__.get(obj.__name__)
+        if manager is None:
+            return iter(())
+        return manager.getRevisionHistory(
+            creator=creator, comment=comment,
+            startBefore=startBefore, startAfter=startAfter,
+            batchStart=batchStart, batchSize=batchSize, reversed=reversed,
+            afterVersion=afterVersion, beforeVersion=beforeVersion)
+
+    def getRevisionStubs(
+            self, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        manager = self.__data__.get(obj.__name__)
+        if manager is None:
+            return iter(())
+        stubs = manager.getRevisionStubs(
+            creator=creator, comment=comment,
+            startBefore=startBefore, startAfter=startAfter,
+            batchStart=batchStart, batchSize=batchSize, reversed=reversed,
+            afterVersion=afterVersion, beforeVersion=beforeVersion)
+        return self.__bindStubs(stubs, obj.__name__)
+
+    def __bindStubs(self, stubs, name):
+        # Load the revisions through the container, like the other
+        # containers do.
+        for stub in stubs:
+            stub.__im_loader__ = revisioned.RevisionLoader(
+                self, name, stub.__im_version__)
+            yield stub
+
+    def addRevision(self, new, old=None):
+        with self.__lock__:
+            manager = self.getManager(new.__name__, create=True)
+            if old is None and manager.getNumberOfRevisions():
+                # A name added again after it was deleted continues its
+                # versions, so that they still identify its revisions.
+                new.__im_version__ = \
+                    manager.loadRevision(-1).__im_version__ + 1
+            # `old` might be replaced by the current revision while rebasing.
+            head = manager.getCurrentRevision() if old is not None else None
+            manager.addRevision(new, old=old)
+            new.__im_manager__ = self
+            self.write((OP_ADD, new.__name__, new, old is not None))
+        if self.changeFeed is not None:
+            self.changeFeed.publishRevision(new, head)
+
+    def rollbackToRevision(self, revision, activate=True):
+        with self.__lock__:
+            self.__data__[revision.__name__].rollbackToRevision(
+                revision, activate=activate)
+            self.write((
+                OP_ROLLBACK, revision.__name__, revision.__im_version__,
+                activate))
+
+    # Mapping of names to current revisions.
+
+    def add(self, obj, name=None):
+        if immutable.IMMUTABLE_CHECKS.eager:
+            assert obj.__im_state__ == interfaces.IM_STATE_LOCKED, \
+                obj.__im_state__
+        if name is not None:
+            obj.__name__ = name
+        self.addRevision(obj)
+        return obj.__name__
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+    def __iter__(self):
+        for name, manager in list(self.__data__.items()):
+            if manager.getCurrentRevision() is not None:
+                yield name
+
+    def __getitem__(self, name):
+        manager = self.__data__.get(name)
+        revision = manager.getCurrentRevision() \
+            if manager is not None else None
+        if revision is None:
+            raise KeyError(name)
+        return revision
+
+    def __setitem__(self, name, obj):
+        self.add(obj, name)
+
+    def __delitem__(self, name):
+        with self.__lock__:
+            revision = self[name]
+            revision.__im_end_on__ = self.now()
+            revision.__im_state__ = interfaces.IM_STATE_DELETED
+            self.write((OP_DELETE, name, revision.__im_end_on__))
@@ -6,13 +6,191 @@
 """Immutable Objects."""
 
 import collections
+import contextvars
 import functools
+import itertools
+import types
+import weakref
 import zope.interface
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 
 from shoobx.immutable import interfaces
 
 
+def getCache(im):
+    """Return the cache of a non-transient immutable.
+
+    The cache is stored on the instance, so it is freed with it. It is
+    neither cloned nor pickled and dropped when the object becomes transient
+    again. Immutables without an instance dictionary must declare a
+    `__im_cache__` slot to be cached.
+    """
+    try:
+        return im.__im_cache__
+    except AttributeError:
+        pass
+    cache = {}
+    try:
+        object.__setattr__(im, '__im_cache__', cache)
+    except AttributeError:
+        raise TypeError(
+            f'Cannot cache values of {im.__class__.__name__} objects, '
+            f'since they have neither a `__dict__` nor a `__im_cache__` '
+            f'slot.') from None
+    return cache
+
+
+def getOrigin(im):
+    """Return the locked immutable `im` is an unchanged clone of.
+
+    Clones of locked immutables remember the object they were cloned from
+    until they or one of their sub-objects change. Unchanged clones of
+    unchanged clones refer to the first object, so that all unchanged
+    versions of an object have the same origin. Returns `None` if `im` was
+    changed, is no clone or its origin was garbage collected.
+    """
+    ref = getattr(im, '__im_origin__', None)
+    return ref() if ref is not None else None
+
+
+def trackOrigin(clone, im):
+    """Remember `im` as the origin of its new `clone`.
+
+    All unchanged clones of an object share the same weak reference to it.
+    """
+    if im.__im_state__ == interfaces.IM_STATE_TRANSIENT:
+        # Transient objects can still change.
+        return
+    ref = getattr(im, '__im_origin__', None)
+    if ref is None or ref() is None:
+        ref = weakref.ref(im)
+    try:
+        clone.__dict__['__im_origin__'] = ref
+    except AttributeError:
+        try:
+            clone.__im_origin__ = ref
+        except AttributeError:
+            # Slotted objects without an `__im_origin__` slot.
+            pass
+
+
+def settleOrigins(im):
+    """Drop the origins of all objects in the tree of `im` that changed.
+
+    An object changed if it was changed itself, see `__im_mark_changed__()`,
+    or if any of its sub-objects changed. Returns whether `im` still has an
+    origin.
+    """
+    unchanged = getOrigin(im) is not None
+    for value in im.__im_iter_values__():
+        if isinstance(value, SlottedImmutableBase) and \
+                not settleOrigins(value):
+            unchanged = False
+    if not unchanged:
+        im.__im_mark_changed__()
+    return unchanged
+
+
+class im_cached_property:
+    """A property whose value is cached while the immutable is locked.
+
+    While the immutable is transient, the value is computed on every access.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, inst, cls=None):
+        if inst is None:
+            return self
+        if inst.__im_state__ == interfaces.IM_STATE_TRANSIENT:
+            return self.func(inst)
+        cache = getCache(inst)
+        try:
+            return cache[self.name]
+        except KeyError:
+            value = cache[self.name] = self.func(inst)
+            return value
+
+
+def im_memoize(func):
+    """Cache the results of a method while the immutable is locked.
+
+    The results are cached by the arguments, which must be hashable. Calls
+    with unhashable arguments are not cached.
+    """
+
+    @functools.wraps(func)
+    def wrapper(inst, *args, **kw):
+        if inst.__im_state__ == interfaces.IM_STATE_TRANSIENT:
+            return func(inst, *args, **kw)
+        cache = getCache(inst)
+        try:
+            key = (func, args, frozenset(kw.items())) if kw else (func, args)
+            return cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable arguments.
+            return func(inst, *args, **kw)
+        result = cache[key] = func(inst, *args, **kw)
+        return result
+
+    return wrapper
+
+
+class ImmutableChecks:
+    """Checks run while creating and updating immutables.
+
+    The mode is stored in a context variable, so that every thread and every
+    asyncio task has its own mode.
+    """
+
+    def __init__(self):
+        self.__checks = contextvars.ContextVar(
+            'ImmutableChecks', default=(interfaces.IM_CHECKS_DEFAULT, True))
+
+    @property
+    def mode(self):
+        return self.__checks.get()[0]
+
+    @property
+    def eager(self):
+        # Whether each operation is checked as it happens.
+        return self.__checks.get()[1]
+
+    def set(self, mode):
+        """Set the mode and return a token for `reset()`."""
+        return self.__checks.set((mode, mode == interfaces.IM_CHECKS_EAGER))
+
+    def reset(self, token):
+        self.__checks.reset(token)
+
+
+IMMUTABLE_CHECKS = ImmutableChecks()
+
+
+@contextmanager
+def checks(mode):
+    """Select the checks run while creating and updating immutables.
+
+    Use `IM_CHECKS_UNCHECKED` to skip all checks for trusted bulk creates
+    and updates or `IM_CHECKS_STRICT` to validate the complete tree once on
+    finalization instead of checking every operation.
+    """
+    assert mode in interfaces.IM_CHECKS, mode
+    token = IMMUTABLE_CHECKS.set(mode)
+    try:
+        yield IMMUTABLE_CHECKS
+    finally:
+        IMMUTABLE_CHECKS.reset(token)
+
+
 def create(cls, *args, **kw):
     """Create an immutable object.
 
@@ -29,6 +207,14 @@ def update(im, *args, **kw):
     return im.__im_update__(*args, **kw)
 
 
+def aupdate(im, *args, **kw):
+    """Update an immutable object asynchronously.
+
+    This is a helper method for ``IImmutable.__im_aupdate__(*args, **kw)``.
+    """
+    return im.__im_aupdate__(*args, **kw)
+
+
 def failOnNonTransient(func):
     """Only allow function execution when immutable is transient."""
 
@@ -42,18 +228,111 @@ def failOnNonTransient(func):
     return wrapper
 
 
-@zope.interface.implementer(interfaces.IImmutable)
-class ImmutableBase:
-    """Immutable Base
+def lockedMutator(name):
+    """Create a mutator that always fails, used by locked classes."""
 
-    Core functionality for all immutable objects.
+    def mutator(inst, *args, **kwargs):
+        raise AttributeError('Cannot update locked immutable object.')
 
-    While the class can be used directly, it is meant to be a base class only.
+    mutator.__name__ = name
+    return mutator
+
+
+def isInternalAttr(im, name):
+    """Determine whether `name` is an internal attribute of `im`.
+
+    The result of `im.__im_is_internal_attr__(name)` is cached per class in
+    `__im_attr_routes__`, so that each assignment only costs a single dict
+    lookup.
     """
+    routes = im.__im_attr_routes__
+    internal = routes.get(name)
+    if internal is None:
+        internal = routes[name] = im.__im_is_internal_attr__(name)
+    return internal
+
+
+def createLockedClass(cls):
+    """Create the locked version of the given immutable class.
+
+    In the locked class all methods listed in `__im_mutators__` fail right
+    away, so that the regular (transient) class does not need to check the
+    state on every call. The locked class can be looked up as
+    `cls.__im_locked_class__`, which also allows it to be pickled.
+    """
+
+    def __init__(self, *args, **kw):
+        # Instantiating the locked class, for example using
+        # `self.__class__(...)`, always produces a transient object.
+        self.__class__ = cls
+        cls.__init__(self, *args, **kw)
+
+    def __setattr__(self, name, value):
+        if not isInternalAttr(self, name):
+            raise AttributeError('Cannot update locked immutable object.')
+        super(locked, self).__setattr__(name, value)
+
+    namespace = {
+        name: lockedMutator(name) for name in cls.__im_mutators__}
+    namespace.update(
+        __module__=cls.__module__,
+        __qualname__=f'{cls.__qualname__}.__im_locked_class__',
+        __doc__=cls.__doc__,
+        __init__=__init__,
+        __setattr__=__setattr__,
+        __im_transient_class__=cls,
+        # Keep the layout of `cls`, so that objects can switch classes.
+        __slots__=(),
+    )
+    if not isinstance(cls.__im_state__, types.MemberDescriptorType):
+        # Slotted classes store the state in the instance only.
+        namespace['__im_state__'] = interfaces.IM_STATE_LOCKED
+    locked = type(cls.__name__, (cls,), namespace)
+    return locked
+
+
+@zope.interface.implementer(interfaces.IImmutable)
+class SlottedImmutableBase:
+    """Slotted Immutable Base
+
+    Core functionality for all immutable objects, without an instance
+    dictionary. Subclasses declaring `__slots__` for all their attributes,
+    including `__im_state__` and `__im_mode__`, have no `__dict__` and must
+    override the methods accessing it: `__im_clone__()`,
+    `__im_iter_values__()`, `__im_set_state__()`, `__getstate__()` and
+    `__setstate__()`. To use `im_cached_property` and `im_memoize`, they must
+    also declare a `__im_cache__` slot and drop its value in
+    `__im_set_state__()` once the object becomes transient again. To track
+    their origin, see `getOrigin()`, they must declare an `__im_origin__`
+    slot and override `__im_mark_changed__()`.
+    """
+
+    __slots__ = ()
 
     __im_mode__ = interfaces.IM_MODE_DEFAULT
     __im_state__ = interfaces.IM_STATE_TRANSIENT
 
+    # Names of all methods modifying the data of the immutable. If
+    # specified, a locked version of the class is created in which those
+    # methods fail. Objects switch between both classes as their state
+    # changes using `__im_set_state__()`.
+    __im_mutators__ = ()
+
+    # Cache of attribute name to whether it is internal, as determined by
+    # `__im_is_internal_attr__()`. Every class has its own cache, which is
+    # shared with its locked version.
+    __im_attr_routes__ = {}
+
+    def __init_subclass__(cls, **kw):
+        super().__init_subclass__(**kw)
+        if '__im_transient_class__' in cls.__dict__:
+            # Locked version of a class.
+            return
+        cls.__im_attr_routes__ = {}
+        if cls.__im_mutators__:
+            cls.__im_transient_class__ = cls
+            cls.__im_locked_class__ = createLockedClass(cls)
+
     def __im_conform__(self, object):
         # The returned object will be a slave of `self`
         # `self.__im_state__` must be propagated to all slaves
@@ -93,9 +372,10 @@ class ImmutableBase:
         if hasattr(object, '__im_get__'):
             # assert that the new value is locked?
             newobj = object.__im_get__(mode=mode)
-            assert interfaces.IImmutable.providedBy(newobj)
-            assert newobj.__im_state__ == interfaces.IM_STATE_TRANSIENT
-            assert newobj.__im_mode__ == mode
+            if IMMUTABLE_CHECKS.eager:
+                assert interfaces.IImmutable.providedBy(newobj)
+                assert newobj.__im_state__ == interfaces.IM_STATE_TRANSIENT
+                assert newobj.__im_mode__ == mode
             return newobj
 
         raise ValueError('Unable to conform object to immutable.', object)
@@ -104,28 +384,103 @@ class ImmutableBase:
         # Create an exact clone of the current object.
         clone = self.__class__.__new__(self.__class__)
         for key, value in self.__dict__.items():
+            if key == '__im_cache__' or key == '__im_origin__':
+                continue
             if interfaces.IImmutable.providedBy(value):
                 value = value.__im_clone__()
             clone.__dict__[key] = value
         # Make sure the clone is transient.
         clone.__im_state__ = interfaces.IM_STATE_TRANSIENT
+        trackOrigin(clone, self)
         # Return the clone.
         return clone
 
+    def __im_clone_value__(self, value):
+        # Conform a value for a clone. Transient sub-objects would be
+        # returned as-is by `__im_conform__()`, so they are cloned as well.
+        if interfaces.IImmutable.providedBy(value) and \
+                value.__im_state__ == interfaces.IM_STATE_TRANSIENT:
+            value = value.__im_clone__()
+        return self.__im_conform__(value)
+
+    def __copy__(self):
+        # Locked immutables can never change, so they can be shared.
+        if self.__im_state__ != interfaces.IM_STATE_TRANSIENT:
+            return self
+        clone = self.__im_clone__()
+        clone.__im_mode__ = interfaces.IM_MODE_MASTER
+        return clone
+
+    def __deepcopy__(self, memo):
+        copy = self.__copy__()
+        memo[id(self)] = copy
+        return copy
+
+    def __im_iter_values__(self):
+        for name, value in self.__dict__.items():
+            if not isInternalAttr(self, name):
+                yield value
+
+    def __im_validate__(self):
+        seen = set()
+        stack = [self]
+        while stack:
+            obj = stack.pop()
+            for value in obj.__im_iter_values__():
+                if isinstance(value, interfaces.IMMUTABLE_TYPES):
+                    continue
+                if not interfaces.IImmutable.providedBy(value):
+                    raise ValueError('Value is not immutable.', value)
+                if value.__im_mode__ != interfaces.IM_MODE_SLAVE:
+                    raise ValueError('Sub-object is not a slave.', value)
+                if value.__im_state__ != self.__im_state__:
+                    raise ValueError(
+                        f'Sub-object is not {self.__im_state__}.', value)
+                if id(value) in seen:
+                    raise ValueError('Sub-object appears twice.', value)
+                seen.add(id(value))
+                stack.append(value)
+
     def __im_finalize__(self):
         # Do not allow finalization on anything but a transient state:
         if self.__im_state__ != interfaces.IM_STATE_TRANSIENT:
             raise RuntimeError(
                 f'Cannot finalize an immutable in state: {self.__im_state__}')
+        if IMMUTABLE_CHECKS.mode == interfaces.IM_CHECKS_STRICT:
+            self.__im_validate__()
+        settleOrigins(self)
         self.__im_set_state__(interfaces.IM_STATE_LOCKED)
 
+    def __im_mark_changed__(self):
+        # Called by all mutators, so that the object no longer claims to be
+        # an unchanged clone, see `getOrigin()`.
+        try:
+            self.__dict__.pop('__im_origin__', None)
+        except AttributeError:
+            # Slotted objects without an instance dictionary.
+            pass
+
     def __im_set_state__(self, state):
         self.__im_state__ = state
+        if self.__im_mutators__:
+            self.__im_switch_class__()
+        # Cached values are only valid while the object cannot change.
+        cache = self.__dict__.pop('__im_cache__', None)
+        if state != interfaces.IM_STATE_TRANSIENT and cache is not None:
+            self.__dict__['__im_cache__'] = cache
         # Propagate state to all IImmutable sub objects.
-        for subobj in self.__dict__.values():
-            if interfaces.IImmutable.providedBy(subobj):
+        for key, subobj in self.__dict__.items():
+            if key != '__im_cache__' and \
+                    interfaces.IImmutable.providedBy(subobj):
                 subobj.__im_set_state__(state)
 
+    def __im_switch_class__(self):
+        # Use the transient or locked class matching the current state.
+        if self.__im_state__ == interfaces.IM_STATE_TRANSIENT:
+            self.__class__ = self.__im_transient_class__
+        else:
+            self.__class__ = self.__im_locked_class__
+
     def __im_after_create__(self, *args, **kw):
         pass
 
@@ -135,6 +490,9 @@ class ImmutableBase:
     def __im_after_update__(self, clone):
         pass
 
+    async def __im_after_aupdate__(self, clone, *args, **kw):
+        self.__im_after_update__(clone, *args, **kw)
+
     @classmethod
     @contextmanager
     def __im_create__(cls, mode=None, finalize=True, *create_args, **create_kw):
@@ -155,8 +513,10 @@ class ImmutableBase:
             if finalize:
                 obj.__im_finalize__()
 
-    @contextmanager
-    def __im_update__(self, *args, **kw):
+    def __im_begin_update__(self, *args, **kw):
+        # Return the transient object to update, or `None` if the object
+        # itself is transient.
+
         # Make sure we don't update an outdated object again
         assert self.__im_state__ not in interfaces.IM_STATES_OUTDATED,\
             "Cannot update an outdated object."
@@ -168,28 +528,48 @@ class ImmutableBase:
 
         # If we already have a transient immutable, then just use it.
         if self.__im_state__ == interfaces.IM_STATE_TRANSIENT:
-            yield self
-            return
+            return None
 
         # Create a transient clone of itself.
         clone = self.__im_clone__()
-        assert clone.__im_state__ == interfaces.IM_STATE_TRANSIENT
+        if IMMUTABLE_CHECKS.eager:
+            assert clone.__im_state__ == interfaces.IM_STATE_TRANSIENT
 
         self.__im_before_update__(clone, *args, **kw)
+        return clone
+
+    @contextmanager
+    def __im_update__(self, *args, **kw):
+        clone = self.__im_begin_update__(*args, **kw)
+        if clone is None:
+            yield self
+            return
         yield clone
         clone.__im_finalize__()
         self.__im_after_update__(clone, *args, **kw)
 
+    @asynccontextmanager
+    async def __im_aupdate__(self, *args, **kw):
+        clone = self.__im_begin_update__(*args, **kw)
+        if clone is None:
+            yield self
+            return
+        yield clone
+        clone.__im_finalize__()
+        await self.__im_after_aupdate__(clone, *args, **kw)
+
     def __im_is_internal_attr__(self, name):
+        # The result is cached per class, so it must only depend on the name.
         return name.startswith('__') and name.endswith('__')
 
     def __setattr__(self, name, value):
         # Internal attributes can always be updated irregardless of state.
-        if self.__im_is_internal_attr__(name):
+        if isInternalAttr(self, name):
             super().__setattr__(name, value)
             return
 
-        if interfaces.IImmutable.providedBy(value):
+        if IMMUTABLE_CHECKS.eager and \
+                interfaces.IImmutable.providedBy(value):
             # do not allow setting a slave mode object
             assert value.__im_mode__ == interfaces.IM_MODE_MASTER
 
@@ -199,6 +579,33 @@ class ImmutableBase:
 
         im_value = self.__im_conform__(value)
         super().__setattr__(name, im_value)
+        self.__im_mark_changed__()
+
+    def __delattr__(self, name):
+        super().__delattr__(name)
+        if not isInternalAttr(self, name):
+            self.__im_mark_changed__()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('__im_cache__', None)
+        state.pop('__im_origin__', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.__im_mutators__:
+            self.__im_switch_class__()
+
+
+@zope.interface.implementer(interfaces.IImmutable)
+class ImmutableBase(SlottedImmutableBase):
+    """Immutable Base
+
+    Core functionality for all immutable objects.
+
+    While the class can be used directly, it is meant to be a base class only.
+    """
 
 
 @zope.interface.implementer(interfaces.IImmutableObject)
@@ -209,6 +616,10 @@ class Immutable(ImmutableBase):
 @zope.interface.implementer(interfaces.IImmutable)
 class ImmutableDict(ImmutableBase, collections.UserDict):
 
+    __im_mutators__ = (
+        '__setitem__', '__delitem__', '__ior__', 'clear', 'update',
+        'setdefault', 'pop', 'popitem')
+
     def __init__(self, *args, **kw):
         super().__init__()
         # make sure all values go through OUR `__setitem__`
@@ -221,13 +632,17 @@ class ImmutableDict(ImmutableBase, collections.UserDict):
     def __im_clone__(self):
         # Create an exact clone of the current object.
         newdata = {
-            key: self.__im_conform__(value)
+            key: self.__im_clone_value__(value)
             for key, value in self.data.items()
         }
-        dct = self.__class__()
+        dct = self.__im_transient_class__()
         dct.data.update(newdata)
+        trackOrigin(dct, self)
         return dct
 
+    def __im_iter_values__(self):
+        return iter(self.data.values())
+
     def __im_set_state__(self, state):
         super().__im_set_state__(state)
         # Propagate state to all dict values.
@@ -240,17 +655,18 @@ class ImmutableDict(ImmutableBase, collections.UserDict):
             return True
         return super().__im_is_internal_attr__(name)
 
-    @failOnNonTransient
     def __setitem__(self, key, value):
-        if interfaces.IImmutable.providedBy(value):
+        if IMMUTABLE_CHECKS.eager and \
+                interfaces.IImmutable.providedBy(value):
             # do not allow setting a slave mode object
             assert value.__im_mode__ == interfaces.IM_MODE_MASTER
         im_value = self.__im_conform__(value)
         super().__setitem__(key, im_value)
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def __delitem__(self, key):
         super().__delitem__(key)
+        self.__im_mark_changed__()
 
     def copy(self):
         # Only allow copy in locked state, otherwise a shallow clone cannot be
@@ -262,27 +678,27 @@ class ImmutableDict(ImmutableBase, collections.UserDict):
             copy.data = self.data.copy()
         return copy
 
-    @failOnNonTransient
     def clear(self):
-        return self.data.clear()
+        self.data.clear()
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def update(self, dct):
         for key, value in dct.items():
             # Need to loop through the items instead of self.data.update(dct)
             # because we need to __im_conform__ the items.
             self[key] = value
 
-    @failOnNonTransient
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
     def setdefault(self, key, default=None):
         im_default = self.__im_conform__(default)
         return super().setdefault(key, im_default)
 
-    @failOnNonTransient
     def pop(self, key, *args):
         return super().pop(key, *args)
 
-    @failOnNonTransient
     def popitem(self):
         return super().popitem()
 
@@ -301,9 +717,189 @@ class ImmutableDict(ImmutableBase, collections.UserDict):
         self.data = state
 
 
+class DictShape:
+    """Key table shared by all shaped dicts with the same keys.
+
+    The shape maps each key to the position of its value in the values tuple
+    of an `ImmutableShapedDict`.
+    """
+
+    __slots__ = ('keys', 'index', '__weakref__')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {key: pos for pos, key in enumerate(keys)}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.keys!r}>'
+
+
+# All shapes in use, keyed by their key tuple. Shapes are dropped once no
+# dict refers to them anymore.
+DICT_SHAPES = weakref.WeakValueDictionary()
+
+
+def getDictShape(keys):
+    """Return the shared shape for the given tuple of keys."""
+    try:
+        return DICT_SHAPES[keys]
+    except KeyError:
+        shape = DICT_SHAPES[keys] = DictShape(keys)
+        return shape
+
+
+@zope.interface.implementer(interfaces.IImmutable)
+class ImmutableShapedDict(
+        SlottedImmutableBase, collections.abc.MutableMapping):
+    """Compact immutable dictionary.
+
+    All shaped dicts having the same keys in the same order share a single
+    key table (`DictShape`) and only store their own values. This saves a
+    lot of memory when storing many dicts of the same shape, for example
+    rows of data. Setting existing keys keeps the shape, so only the values
+    are copied. Shaped dicts have no instance dictionary.
+    """
+
+    __slots__ = (
+        '__im_shape__', '__im_values__', '__im_state__', '__im_mode__',
+        '__im_cache__', '__im_origin__', '__weakref__')
+
+    __im_mutators__ = (
+        '__setitem__', '__delitem__', 'clear', 'update', 'setdefault', 'pop',
+        'popitem')
+
+    def __init__(self, *args, **kw):
+        super().__init__()
+        self.__im_state__ = interfaces.IM_STATE_TRANSIENT
+        self.__im_mode__ = interfaces.IM_MODE_MASTER
+        self.__im_origin__ = None
+        self.__im_shape__ = getDictShape(())
+        self.__im_values__ = []
+        # make sure all values go through OUR `__setitem__`
+        if args:
+            for key, value in args[0].items():
+                self[key] = value
+        for key, value in kw.items():
+            self[key] = value
+
+    def __im_clone__(self):
+        # Create an exact clone of the current object.
+        clone = self.__im_transient_class__()
+        clone.__im_shape__ = self.__im_shape__
+        clone.__im_values__ = [
+            self.__im_clone_value__(value) for value in self.__im_values__]
+        trackOrigin(clone, self)
+        return clone
+
+    def __im_mark_changed__(self):
+        if self.__im_origin__ is not None:
+            self.__im_origin__ = None
+
+    def __im_iter_values__(self):
+        return iter(self.__im_values__)
+
+    def __im_set_state__(self, state):
+        self.__im_state__ = state
+        self.__im_switch_class__()
+        # Locked dicts cannot change their values anymore, so store them
+        # compactly.
+        if state == interfaces.IM_STATE_TRANSIENT:
+            self.__im_values__ = list(self.__im_values__)
+            # Cached values are only valid while the object cannot change.
+            try:
+                del self.__im_cache__
+            except AttributeError:
+                pass
+        else:
+            self.__im_values__ = tuple(self.__im_values__)
+        # Propagate state to all dict values.
+        for subobj in self.__im_values__:
+            if interfaces.IImmutable.providedBy(subobj):
+                subobj.__im_set_state__(state)
+
+    def __getitem__(self, key):
+        return self.__im_values__[self.__im_shape__.index[key]]
+
+    def __setitem__(self, key, value):
+        if IMMUTABLE_CHECKS.eager and \
+                interfaces.IImmutable.providedBy(value):
+            # do not allow setting a slave mode object
+            assert value.__im_mode__ == interfaces.IM_MODE_MASTER
+        im_value = self.__im_conform__(value)
+        shape = self.__im_shape__
+        self.__im_mark_changed__()
+        pos = shape.index.get(key)
+        if pos is not None:
+            # The shape does not change.
+            self.__im_values__[pos] = im_value
+            return
+        self.__im_shape__ = getDictShape(shape.keys + (key,))
+        self.__im_values__.append(im_value)
+
+    def __delitem__(self, key):
+        shape = self.__im_shape__
+        pos = shape.index[key]
+        self.__im_shape__ = getDictShape(
+            shape.keys[:pos] + shape.keys[pos+1:])
+        del self.__im_values__[pos]
+        self.__im_mark_changed__()
+
+    def __iter__(self):
+        return iter(self.__im_shape__.keys)
+
+    def __len__(self):
+        return len(self.__im_values__)
+
+    def __contains__(self, key):
+        return key in self.__im_shape__.index
+
+    def copy(self):
+        # Only allow copy in locked state, otherwise a shallow clone cannot be
+        # produced.
+        assert self.__im_state__ == interfaces.IM_STATE_LOCKED
+        # Returns a shallow copy, sharing the shape and the values.
+        with self.__im_create__() as factory:
+            copy = factory()
+            copy.__im_shape__ = self.__im_shape__
+            copy.__im_values__ = self.__im_values__
+        return copy
+
+    def clear(self):
+        self.__im_shape__ = getDictShape(())
+        self.__im_values__ = []
+        self.__im_mark_changed__()
+
+    def __getstate__(self):
+        return dict(zip(self.__im_shape__.keys, self.__im_values__))
+
+    def __setstate__(self, state):
+        # The state is only kept by the class, see `createLockedClass()`.
+        if self.__class__ is self.__im_transient_class__:
+            self.__im_state__ = interfaces.IM_STATE_TRANSIENT
+            values = list(state.values())
+        else:
+            self.__im_state__ = interfaces.IM_STATE_LOCKED
+            values = tuple(state.values())
+        self.__im_mode__ = interfaces.IM_MODE_MASTER
+        self.__im_origin__ = None
+        self.__im_shape__ = getDictShape(tuple(state))
+        self.__im_values__ = values
+
+    def __repr__(self):
+        return repr(self.__getstate__())
+
+
 @zope.interface.implementer(interfaces.IImmutable)
 class ImmutableSet(ImmutableBase, collections.abc.MutableSet):
 
+    # When true, the data is compacted to a `frozenset` once the set is
+    # locked.
+    __im_compact__ = False
+
+    __im_mutators__ = (
+        'add', 'discard', 'remove', 'pop', 'clear', '__ior__', '__iand__',
+        '__ixor__', '__isub__')
+
     def __init__(self, *args, **kw):
         super().__init__()
         self.__data__ = set()
@@ -314,6 +910,11 @@ class ImmutableSet(ImmutableBase, collections.abc.MutableSet):
 
     def __im_set_state__(self, state):
         super().__im_set_state__(state)
+        if state == interfaces.IM_STATE_TRANSIENT:
+            if isinstance(self.__data__, frozenset):
+                self.__data__ = set(self.__data__)
+        elif self.__im_compact__:
+            self.__data__ = frozenset(self.__data__)
         # Propagate state to all values.
         for subobj in self.__data__:
             if interfaces.IImmutable.providedBy(subobj):
@@ -321,22 +922,39 @@ class ImmutableSet(ImmutableBase, collections.abc.MutableSet):
 
     def __im_clone__(self):
         # Create an exact clone of the current object.
-        newdata = set([self.__im_conform__(value) for value in self.__data__])
-        rset = self.__class__()
+        newdata = set(
+            [self.__im_clone_value__(value) for value in self.__data__])
+        rset = self.__im_transient_class__()
         rset.__data__.update(newdata)
+        trackOrigin(rset, self)
         return rset
 
-    @failOnNonTransient
+    def __im_iter_values__(self):
+        return iter(self.__data__)
+
     def add(self, value):
-        if interfaces.IImmutable.providedBy(value):
+        if IMMUTABLE_CHECKS.eager and \
+                interfaces.IImmutable.providedBy(value):
             # do not allow setting a slave mode object
             assert value.__im_mode__ == interfaces.IM_MODE_MASTER
         im_value = self.__im_conform__(value)
         self.__data__.add(im_value)
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def discard(self, value):
         self.__data__.discard(value)
+        self.__im_mark_changed__()
+
+    def copy(self):
+        # Only allow copy in locked state, otherwise a shallow clone cannot be
+        # produced.
+        assert self.__im_state__ == interfaces.IM_STATE_LOCKED
+        # Returns a shallow copy. Note that copying a `frozenset` returns the
+        # frozenset itself, so compacted data is shared.
+        with self.__im_create__() as factory:
+            copy = factory()
+            copy.__data__ = self.__data__.copy()
+        return copy
 
     def __contains__(self, key):
         return key in self.__data__
@@ -348,15 +966,26 @@ class ImmutableSet(ImmutableBase, collections.abc.MutableSet):
         return len(self.__data__)
 
     def __hash__(self):
+        # For compacted data, `frozenset()` returns the data itself, whose
+        # hash is cached.
         return frozenset(self.__data__).__hash__()
 
     def __repr__(self):
+        if isinstance(self.__data__, frozenset):
+            return repr(set(self.__data__))
         return repr(self.__data__)
 
 
 @zope.interface.implementer(interfaces.IImmutable)
 class ImmutableList(ImmutableBase, collections.UserList):
 
+    # When true, the data is compacted to a `tuple` once the list is locked.
+    __im_compact__ = False
+
+    __im_mutators__ = (
+        '__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+        'extend', 'insert', 'pop', 'remove', 'clear', 'reverse', 'sort')
+
     def __init__(self, *args, **kw):
         # need to avoid calling ImmutableBase.__init__ here
         collections.UserList.__init__(self)
@@ -372,29 +1001,87 @@ class ImmutableList(ImmutableBase, collections.UserList):
 
     def __im_clone__(self):
         # Create an exact clone of the current object.
-        newdata = [self.__im_conform__(value) for value in self.data]
-        clone = self.__class__()
+        newdata = [self.__im_clone_value__(value) for value in self.data]
+        clone = self.__im_transient_class__()
         clone.data.extend(newdata)
+        trackOrigin(clone, self)
         return clone
 
+    def __im_iter_values__(self):
+        return iter(self.data)
+
     def __im_set_state__(self, state):
         super().__im_set_state__(state)
+        if state == interfaces.IM_STATE_TRANSIENT:
+            if isinstance(self.data, tuple):
+                self.data = list(self.data)
+        elif self.__im_compact__:
+            self.data = tuple(self.data)
         # Propagate state to all subjects.
-        for subobj in self:
+        for subobj in self.data:
             if interfaces.IImmutable.providedBy(subobj):
                 subobj.__im_set_state__(state)
 
-    @failOnNonTransient
     def __setitem__(self, i, value):
-        if interfaces.IImmutable.providedBy(value):
+        if IMMUTABLE_CHECKS.eager and \
+                interfaces.IImmutable.providedBy(value):
             # do not allow setting a slave mode object
             assert value.__im_mode__ == interfaces.IM_MODE_MASTER
         value = self.__im_conform__(value)
         super().__setitem__(i, value)
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def __delitem__(self, i):
         super().__delitem__(i)
+        self.__im_mark_changed__()
+
+    def __operands(self, other):
+        # Compacted data is a tuple, which never compares equal to a list.
+        # Lists compared with compacted data are converted to tuples, so that
+        # the compacted data itself is never copied.
+        data = self.data
+        if isinstance(other, collections.UserList):
+            other = other.data
+        elif isinstance(other, tuple):
+            # Plain tuples still compare like they do with lists.
+            return self.__data(), other
+        if isinstance(data, tuple):
+            if isinstance(other, list):
+                other = tuple(other)
+        elif isinstance(other, tuple):
+            other = list(other)
+        return data, other
+
+    def __data(self):
+        if isinstance(self.data, tuple):
+            return list(self.data)
+        return self.data
+
+    def __lt__(self, other):
+        data, other = self.__operands(other)
+        return data < other
+
+    def __le__(self, other):
+        data, other = self.__operands(other)
+        return data <= other
+
+    def __eq__(self, other):
+        data, other = self.__operands(other)
+        return data == other
+
+    def __gt__(self, other):
+        data, other = self.__operands(other)
+        return data > other
+
+    def __ge__(self, other):
+        data, other = self.__operands(other)
+        return data >= other
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __repr__(self):
+        return repr(self.__data())
 
     def copy(self):
         # Only allow copy in locked state, otherwise a shallow clone cannot be
@@ -403,32 +1090,37 @@ class ImmutableList(ImmutableBase, collections.UserList):
         # Returns a shallow copy, which allows a simple transfer of data.
         with self.__im_create__() as factory:
             copy = factory()
-            copy.data = self.data.copy()
+            if isinstance(self.data, tuple):
+                # Compacted data can be shared.
+                copy.data = self.data
+            else:
+                copy.data = self.data.copy()
         return copy
 
-    @failOnNonTransient
     def append(self, item):
-        if interfaces.IImmutable.providedBy(item):
+        if IMMUTABLE_CHECKS.eager and \
+                interfaces.IImmutable.providedBy(item):
             # do not allow setting a slave mode object
             assert item.__im_mode__ == interfaces.IM_MODE_MASTER
         item = self.__im_conform__(item)
         super().append(item)
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def extend(self, other):
         for v in other:
             self.append(v)
 
     def __add__(self, other):
-        return self.__class__(self.data + list(other))
+        return self.__class__(itertools.chain(self.data, other))
+
+    def __radd__(self, other):
+        return self.__class__(itertools.chain(other, self.data))
 
-    @failOnNonTransient
     def __iadd__(self, other):
         for v in other:
             self.append(v)
         return self
 
-    @failOnNonTransient
     def __imul__(self, n):
         for item in self:
             if interfaces.IImmutable.providedBy(item):
@@ -439,32 +1131,35 @@ class ImmutableList(ImmutableBase, collections.UserList):
                 # IImmutable.
                 assert item.__im_mode__ == interfaces.IM_MODE_MASTER
         self.data *= n
+        self.__im_mark_changed__()
         return self
 
-    @failOnNonTransient
     def insert(self, i, item):
-        if interfaces.IImmutable.providedBy(item):
+        if IMMUTABLE_CHECKS.eager and \
+                interfaces.IImmutable.providedBy(item):
             # do not allow setting a slave mode object
             assert item.__im_mode__ == interfaces.IM_MODE_MASTER
         item = self.__im_conform__(item)
         super().insert(i, item)
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def pop(self, i=-1):
-        return super().pop(i)
+        item = super().pop(i)
+        self.__im_mark_changed__()
+        return item
 
-    @failOnNonTransient
     def remove(self, item):
         super().remove(item)
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def clear(self):
         super().clear()
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def reverse(self):
         super().reverse()
+        self.__im_mark_changed__()
 
-    @failOnNonTransient
     def sort(self, *args, **kwds):
         super().sort()
+        self.__im_mark_changed__()
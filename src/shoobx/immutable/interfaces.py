@@ -27,6 +27,17 @@ IM_STATES_REVISIONED = (
     IM_STATE_LOCKED, IM_STATE_TRANSIENT, IM_STATE_RETIRED, IM_STATE_DELETED)
 IM_STATES_OUTDATED = (IM_STATE_DELETED, IM_STATE_RETIRED)
 
+# Checks run while creating and updating immutables.
+# - eager: Check every operation as it happens (default).
+# - unchecked: Skip all checks, for trusted bulk creates and updates.
+# - strict: Skip the per-operation checks, but validate the complete tree
+#   once when finalizing.
+IM_CHECKS_EAGER = 'eager'
+IM_CHECKS_UNCHECKED = 'unchecked'
+IM_CHECKS_STRICT = 'strict'
+IM_CHECKS_DEFAULT = IM_CHECKS_EAGER
+IM_CHECKS = (IM_CHECKS_EAGER, IM_CHECKS_UNCHECKED, IM_CHECKS_STRICT)
+
 IMMUTABLE_TYPES = (
     bool, int, float, complex, decimal.Decimal, tuple, str, bytes, type(None),
     datetime.date, datetime.time, datetime.datetime, datetime.timedelta,
@@ -57,6 +68,7 @@ class IImmutable(zope.interface.Interface):
     `AttributeError` is raised with the message saying that the attribute
     cannot be set. The only exceptions are internal attributes which are
     determined using the `__im_is_internal_attr__(name) -> bool` method.
+    Its result is cached per class, so it must only depend on the name.
 
     Immutables are created using the `__im_create__()` context manager in the
     following way::
@@ -167,6 +179,31 @@ class IImmutable(zope.interface.Interface):
         Sub-objects are objects in attributes, dict values, list items, etc.
         """
 
+    def __im_iter_values__():
+        """Iterate over all user values of the object.
+
+        These are the values of attributes, dict values, list items, etc. and
+        are used to validate the complete tree of sub-objects.
+        """
+
+    def __im_mark_changed__():
+        """Mark the object as changed.
+
+        Called by all methods changing the data of the object, so that it is
+        no longer considered an unchanged clone of the object it was cloned
+        from.
+        """
+
+    def __im_validate__():
+        """Validate the object and its complete tree of sub-objects.
+
+        All values must be core immutables or `IImmutable` sub-objects in
+        `IM_MODE_SLAVE` mode and in the same state as the object. Each
+        sub-object may only appear once in the tree.
+
+        Raises a `ValueError` exception if the tree is invalid.
+        """
+
     def __im_finalize__():
         """Finalize the object.
 
@@ -224,6 +261,20 @@ class IImmutable(zope.interface.Interface):
         itself is returned.
         """
 
+    def __im_after_aupdate__(clone):
+        """Coroutine hook called at the end of `__im_aupdate__()`.
+
+        By default, `__im_after_update__()` is called.
+        """
+
+    def __im_aupdate__():
+        """Returns an asynchronous context manager allowing the context to be
+        modified.
+
+        Works like `__im_update__()`, but awaits `__im_after_aupdate__()`
+        instead of calling `__im_after_update__()`.
+        """
+
     def __setattr__(name, value):
         """Set the new attribute value for the given name.
 
@@ -269,6 +320,20 @@ class IRevisionedImmutableManager(zope.interface.Interface):
     def getNumberOfRevisions(obj):
         """Return the total number of revisions."""
 
+    def getRevisionByVersion(version: int, obj):
+        """Get the revision of the object with the given version.
+
+        Raises a `KeyError` if there is no such revision.
+        """
+
+    def getRevisionAt(timestamp: datetime.datetime, obj):
+        """Get the revision of the object active at the given date/time.
+
+        A revision is active from its `__im_start_on__` date/time on, until
+        its `__im_end_on__` date/time. If no revision was active at that
+        time, `None` is returned.
+        """
+
     def getRevisionHistory(
             obj,
             creator: str=None,
@@ -276,7 +341,8 @@ class IRevisionedImmutableManager(zope.interface.Interface):
             startBefore: datetime.datetime=None,
             startAfter: datetime.datetime=None,
             batchStart: int=0, batchSize: int=None,
-            reversed: bool=False):
+            reversed: bool=False,
+            afterVersion: int=None, beforeVersion: int=None):
         """Returns an iterable of object revisions in chronological order.
 
         The following arguments filter the search results:
@@ -301,6 +367,38 @@ class IRevisionedImmutableManager(zope.interface.Interface):
 
         * `batchSize`: The size the of the batch. It is thus the max length of
                        the iterable.
+
+        The following arguments select a page by version (keyset
+        pagination), so that deep pages cost as much as the first one:
+
+        * `afterVersion`: The version of the revision must be greater than
+                          the argument.
+
+        * `beforeVersion`: The version of the revision must be less than the
+                           argument.
+
+        To page through the history, pass the last version of the previous
+        page as `afterVersion`, or as `beforeVersion` if `reversed`.
+        """
+
+    def getRevisionStubs(
+            obj,
+            creator: str=None,
+            comment: str=None,
+            startBefore: datetime.datetime=None,
+            startAfter: datetime.datetime=None,
+            batchStart: int=0, batchSize: int=None,
+            reversed: bool=False,
+            afterVersion: int=None, beforeVersion: int=None):
+        """Returns an iterable of revision stubs in chronological order.
+
+        A stub only carries the `__name__`, `__im_version__`,
+        `__im_state__`, `__im_start_on__`, `__im_end_on__`,
+        `__im_creator__` and `__im_comment__` of a revision. All other
+        attributes are looked up on the full revision, which is loaded on
+        first access.
+
+        Accepts the same arguments as `getRevisionHistory()`.
         """
 
     def addRevision(new, old=None):
@@ -320,6 +418,11 @@ class IRevisionedImmutableManager(zope.interface.Interface):
         If the `old` revision is specified, the old revision's `__im_end_on__`
         date/time is set to the `new` revision's `__im_start_on__` date/time
         and the state is set to the `IM_STATE_RETIRED` state.
+
+        If the `old` revision is no longer the current revision, for example
+        because it was updated concurrently, a `RevisionConflictError` is
+        raised. Managers may instead rebase the `new` revision onto the
+        current one, if their changes do not overlap.
         """
 
     def rollbackToRevision(revision, activate=True):
@@ -342,6 +445,115 @@ class IRevisionedImmutableManager(zope.interface.Interface):
         """
 
 
+class IAsyncRevisionedImmutableManager(zope.interface.Interface):
+    """Asynchronous revisioned immutable container.
+
+    All methods of `IRevisionedImmutableManager` as coroutines, except for
+    `getRevisionHistory()`, which returns an asynchronous iterator.
+    """
+
+    async def getCurrentRevision(obj):
+        """See `IRevisionedImmutableManager.getCurrentRevision()`."""
+
+    async def getNumberOfRevisions(obj):
+        """See `IRevisionedImmutableManager.getNumberOfRevisions()`."""
+
+    async def getRevisionByVersion(version: int, obj):
+        """See `IRevisionedImmutableManager.getRevisionByVersion()`."""
+
+    async def getRevisionAt(timestamp: datetime.datetime, obj):
+        """See `IRevisionedImmutableManager.getRevisionAt()`."""
+
+    def getRevisionHistory(
+            obj,
+            creator: str=None,
+            comment: str=None,
+            startBefore: datetime.datetime=None,
+            startAfter: datetime.datetime=None,
+            batchStart: int=0, batchSize: int=None,
+            reversed: bool=False,
+            afterVersion: int=None, beforeVersion: int=None):
+        """Returns an asynchronous iterator of object revisions.
+
+        See `IRevisionedImmutableManager.getRevisionHistory()`.
+        """
+
+    def getRevisionStubs(
+            obj,
+            creator: str=None,
+            comment: str=None,
+            startBefore: datetime.datetime=None,
+            startAfter: datetime.datetime=None,
+            batchStart: int=0, batchSize: int=None,
+            reversed: bool=False,
+            afterVersion: int=None, beforeVersion: int=None):
+        """Returns an asynchronous iterator of revision stubs.
+
+        See `IRevisionedImmutableManager.getRevisionStubs()`.
+        """
+
+    async def addRevision(new, old=None):
+        """See `IRevisionedImmutableManager.addRevision()`."""
+
+    async def rollbackToRevision(revision, activate=True):
+        """See `IRevisionedImmutableManager.rollbackToRevision()`."""
+
+
+class IRevisionRetentionPolicy(zope.interface.Interface):
+    """Revision Retention Policy
+
+    Selects the revisions of a revision history that can be dropped.
+    """
+
+    def getDropped(revisions, now):
+        """Return the positions of all revisions to drop.
+
+        `revisions` is the sequence of revisions in chronological order. The
+        items provide at least the `__im_version__`, `__im_start_on__`,
+        `__im_end_on__`, `__im_creator__` and `__im_comment__` attributes.
+        `now` is the current date/time.
+
+        Managers never drop the latest revision, even if it is selected.
+        """
+
+
+class IChangeFeedSubscriber(zope.interface.Interface):
+    """Change Feed Subscriber
+
+    Consumes the change records published by a change feed, usually in
+    batches.
+    """
+
+    def receive(record):
+        """Receive a change record.
+
+        May block until the record can be accepted, applying backpressure to
+        the writer adding the revision. Raises an error if the record is
+        rejected.
+        """
+
+
+class IChangeFeed(zope.interface.Interface):
+    """Change Feed
+
+    Publishes a change record for every revision added to the revision
+    managers using the feed. A change record provides the `name`,
+    `oldVersion`, `newVersion`, `creator` and `timestamp` attributes.
+    """
+
+    def subscribe(subscriber):
+        """Add an `IChangeFeedSubscriber` and return it."""
+
+    def unsubscribe(subscriber):
+        """Remove a subscriber."""
+
+    def publish(record):
+        """Deliver the change record to all subscribers in turn.
+
+        Errors of a subscriber are logged and do not propagate.
+        """
+
+
 class IRevisionedImmutable(IImmutable):
     """Revisioned Immutable Object
 
@@ -419,6 +631,15 @@ class IRevisionedImmutable(IImmutable):
         `__im_manager__.addRevision(clone, old=self)` must be called.
         """
 
+    def __im_aupdate__(creator=None, comment=None):
+        """Returns an asynchronous context manager providing a clone that can
+        be edited.
+
+        Works like `__im_update__()`, but the new revision is added using the
+        `IAsyncRevisionedImmutableManager` of `__im_manager__`, so that the
+        event loop is not blocked.
+        """
+
     def __im_after_create__(creator=None, comment=None):
         """Hook called right after `__im_create__` factory called `__init__`
 
@@ -0,0 +1,158 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Memoization of functions taking locked immutables."""
+import collections
+import functools
+import threading
+import weakref
+
+from shoobx.immutable import interfaces
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# Marks the identity key of a locked immutable argument.
+IDENTITY = object()
+
+
+class Uncacheable(Exception):
+    """The arguments of a call cannot be used as cache key."""
+
+
+class LRUMemoizedFunction:
+    """Function whose results are cached in a bounded LRU cache.
+
+    Locked immutable arguments are keyed by their identity, since they can
+    never change. All other arguments must be hashable. Calls with transient
+    immutables or unhashable arguments are not cached.
+
+    Cache entries are evicted as soon as one of their immutable arguments is
+    garbage collected.
+    """
+
+    def __init__(self, func, maxsize=128):
+        assert maxsize is None or maxsize > 0, maxsize
+        self.func = func
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        # Maps the cache key to the result and the `id()` of all immutable
+        # arguments.
+        self.cache = collections.OrderedDict()
+        # Maps the `id()` of an immutable argument to a weak reference to it
+        # and to the keys of all cache entries using it.
+        self.refs = {}
+        functools.update_wrapper(self, func)
+
+    def getKeyPart(self, value):
+        if interfaces.IImmutable.providedBy(value):
+            if value.__im_state__ == interfaces.IM_STATE_TRANSIENT:
+                raise Uncacheable(value)
+            return (IDENTITY, id(value))
+        try:
+            hash(value)
+        except TypeError:
+            raise Uncacheable(value)
+        return value
+
+    def getKey(self, args, kw):
+        key = tuple(self.getKeyPart(arg) for arg in args)
+        if kw:
+            key += tuple(
+                (name, self.getKeyPart(value))
+                for name, value in sorted(kw.items()))
+        return key
+
+    def evict(self, oid):
+        with self.lock:
+            ref, keys = self.refs.pop(oid, (None, ()))
+            for key in keys:
+                if key in self.cache:
+                    self.remove(key)
+
+    def remove(self, key):
+        # Remove a cache entry and forget about it for all its immutables.
+        result, oids = self.cache.pop(key)
+        for oid in oids:
+            entry = self.refs.get(oid)
+            if entry is not None:
+                entry[1].discard(key)
+                if not entry[1]:
+                    del self.refs[oid]
+
+    def track(self, key, args, kw):
+        # Remember the cache entry for all its immutables, so that it is
+        # evicted when one of them is garbage collected.
+        oids = []
+        for value in args + tuple(kw.values()):
+            if not interfaces.IImmutable.providedBy(value):
+                continue
+            oid = id(value)
+            entry = self.refs.get(oid)
+            if entry is None:
+                callback = functools.partial(self.__evict, oid)
+                entry = self.refs[oid] = (
+                    weakref.ref(value, callback), set())
+            entry[1].add(key)
+            oids.append(oid)
+        return tuple(oids)
+
+    def __evict(self, oid, ref):
+        self.evict(oid)
+
+    def __call__(self, *args, **kw):
+        try:
+            key = self.getKey(args, kw)
+        except Uncacheable:
+            return self.func(*args, **kw)
+
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key][0]
+            self.misses += 1
+
+        result = self.func(*args, **kw)
+
+        with self.lock:
+            if key not in self.cache:
+                oids = self.track(key, args, kw)
+                self.cache[key] = (result, oids)
+                if self.maxsize is not None and \
+                        len(self.cache) > self.maxsize:
+                    self.remove(next(iter(self.cache)))
+        return result
+
+    def __get__(self, inst, cls=None):
+        # Support decorating methods.
+        if inst is None:
+            return self
+        return functools.partial(self, inst)
+
+    def cacheInfo(self):
+        with self.lock:
+            return CacheInfo(
+                self.hits, self.misses, self.maxsize, len(self.cache))
+
+    def cacheClear(self):
+        with self.lock:
+            self.cache.clear()
+            self.refs.clear()
+            self.hits = self.misses = 0
+
+
+def lruMemoize(maxsize=128):
+    """Memoize a function taking locked immutables as arguments.
+
+    Use `maxsize=None` for an unbounded cache. See `LRUMemoizedFunction`.
+    """
+
+    def decorator(func):
+        return LRUMemoizedFunction(func, maxsize)
+
+    return decorator
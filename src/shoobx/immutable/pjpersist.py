@@ -9,10 +9,11 @@ import datetime
 import zope.interface
 import zope.schema
 import pjpersist.sqlbuilder as sb
+from pjpersist import datamanager, serialize
 from pjpersist import interfaces as pjinterfaces
 from pjpersist.zope import container as pjcontainer
 
-from shoobx.immutable import interfaces, revisioned
+from shoobx.immutable import feed, immutable, interfaces, revisioned
 
 
 class NoOpProperty:
@@ -70,6 +71,11 @@ class Immutable(revisioned.RevisionedImmutable, pjcontainer.PJContained):
         clone._p_oid = None
         return clone
 
+    async def __im_after_aupdate__(self, clone, *args, **kw):
+        # The container joins the transaction of the current thread, so it
+        # cannot be used from an executor.
+        self.__im_after_update__(clone, *args, **kw)
+
     def _pj_get_column_fields(self):
         return {
             self._pj_name: getattr(self, self._pj_name),
@@ -87,7 +93,9 @@ class Immutable(revisioned.RevisionedImmutable, pjcontainer.PJContained):
             for name, value in self.__dict__.items()
             if (not name.startswith('_v_')
                 and not name.startswith('_p_')
-                and not name.startswith('_pj_'))
+                and not name.startswith('_pj_')
+                and name != '__im_cache__'
+                and name != '__im_origin__')
         }
 
     def __setstate__(self, state):
@@ -97,6 +105,65 @@ class Immutable(revisioned.RevisionedImmutable, pjcontainer.PJContained):
         return f'<{self.__class__.__name__} ({self.__name__}) at {self._p_oid}>'
 
 
+def fromTimestamp(value):
+    """Return a `timestamptz` column value as stored in the document.
+
+    The documents and `ImmutableContainer.now()` use naive date/times,
+    which PostgreSQL stores in the session time zone. It returns them in
+    that time zone again, so dropping the time zone restores them.
+    """
+    if value is None:
+        return None
+    return value.replace(tzinfo=None)
+
+
+def getIndexStatements(table, trigram=False, factory=Immutable):
+    """Return the SQL statements creating the indexes of a revision table.
+
+    The indexed columns are looked up in `factory._pj_column_fields`:
+
+    * Only one current revision per name, also serving the lookup of the
+      current revision. It is a deferred exclusion constraint on a partial
+      B-tree index, since the new revision may be written before the old
+      one is retired. Adding it to a table where a name has several current
+      revisions fails with an exclusion violation; retire the extra
+      revisions first.
+
+    * `(name, version)` for revision lookups, ordering and pagination.
+
+    * `(name, startOn)` for the history filters by date/time.
+
+    * With `trigram`, a trigram index on `comment` for the comment filter.
+      It needs the `pg_trgm` extension.
+    """
+    columns = {fld.__name__ for fld in factory._pj_column_fields}
+    name = factory._pj_name
+    for column in (name, 'version', 'startOn', 'endOn', 'comment'):
+        assert column in columns, column
+
+    current = f'{table}_{name}_current'
+    statements = [
+        # Constraints cannot be created conditionally.
+        f"""DO $$ BEGIN
+            ALTER TABLE {table} ADD CONSTRAINT {current}
+                EXCLUDE USING btree ({name} WITH =) WHERE (endOn IS NULL)
+                DEFERRABLE INITIALLY DEFERRED;
+        EXCEPTION WHEN duplicate_table OR duplicate_object THEN NULL;
+        END $$""",
+        f'CREATE INDEX IF NOT EXISTS {table}_{name}_version '
+        f'ON {table} ({name}, version)',
+        f'CREATE INDEX IF NOT EXISTS {table}_{name}_startOn '
+        f'ON {table} ({name}, startOn)',
+    ]
+    if trigram:
+        statements += [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            f'CREATE INDEX IF NOT EXISTS {table}_comment_trgm '
+            f'ON {table} USING GIN (comment gin_trgm_ops)',
+        ]
+    return statements
+
+
 @zope.interface.implementer(interfaces.IRevisionedImmutableManager)
 class ImmutableContainer(pjcontainer.AllItemsPJContainer):
 
@@ -107,9 +174,22 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
     _pj_column_fields = pjcontainer.AllItemsPJContainer._pj_column_fields + (
         tuple([fld.__name__ for fld in Immutable._pj_column_fields]))
 
+    # Columns read for revision stubs, in the order of the stub arguments.
+    _pj_stub_fields = (
+        _pj_mapping_key, 'version', 'state', 'startOn', 'endOn', 'creator',
+        'comment')
+
     # When true, the container APIs will include deleted items.
     _pj_with_deleted_items = False
 
+    # When true, revisions added based on an outdated revision are rebased
+    # onto the current revision, unless their changes conflict.
+    rebaseOnConflict = False
+
+    # Change feed publishing a record for every committed revision, see
+    # `shoobx.immutable.feed`.
+    changeFeed = None
+
     # Testing hook.
     now = datetime.datetime.now
 
@@ -138,7 +218,9 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
         return obj
 
     def add(self, obj, key=None):
-        assert obj.__im_state__ == interfaces.IM_STATE_LOCKED, obj.__im_state__
+        if immutable.IMMUTABLE_CHECKS.eager:
+            assert obj.__im_state__ == interfaces.IM_STATE_LOCKED, \
+                obj.__im_state__
 
         res = super().add(obj, key)
         self.addRevision(obj)
@@ -161,6 +243,70 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
         return self._load_one(
             row[self._pj_id_column], row[self._pj_data_column], use_cache=False)
 
+    def getRevisionByVersion(self, version, obj):
+        return self.getRevision(obj.__name__, version)
+
+    def getRevisions(self, keys):
+        """Return the revisions with the given `(name, version)` pairs,
+        using a single query.
+
+        The result maps the pairs to the revisions. Missing revisions are
+        left out.
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        with self._pj_jar.getCursor() as cur:
+            cur.execute(
+                sb.Select(self._get_sb_fields(()),
+                          self._getRevisionsQuery(keys)),
+                flush_hint=[self._pj_table])
+            rows = cur.fetchall()
+        revisions = {}
+        for row in rows:
+            revision = self._load_one(
+                row[self._pj_id_column], row[self._pj_data_column],
+                use_cache=False)
+            revisions[(revision.__name__, revision.__im_version__)] = revision
+        return revisions
+
+    def _getRevisionsQuery(self, keys):
+        nameFld = sb.Field(self._pj_table, self._pj_mapping_key)
+        versionFld = sb.Field(self._pj_table, 'version')
+        names, versions = zip(*sorted(keys))
+        # `(name, version) IN (SELECT * FROM unnest(names, versions))`
+        # keeps the statement small and lets the planner use the
+        # `(name, version)` index, however many keys there are.
+        pairs = sb.INSubquery(
+            sb.SQLConstant('(%s, %s)' % (
+                sb.sqlrepr(nameFld, 'postgres'),
+                sb.sqlrepr(versionFld, 'postgres'))),
+            sb.Select(sb.SQLConstant('*'), staticTables=[
+                sb.func.unnest(sb.PGArray(names), sb.PGArray(versions))]))
+        return self._combine_filters(
+            self._pj_get_resolve_filter_all_versions(), pairs)
+
+    def getRevisionAt(self, timestamp, obj):
+        endOnFld = sb.Field(self._pj_table, 'endOn')
+        qry = self._combine_filters(
+            self._pj_get_resolve_filter_all_versions(),
+            sb.Field(self._pj_table, self._pj_mapping_key) == obj.__name__,
+            sb.Field(self._pj_table, 'startOn') <= timestamp,
+            (endOnFld == None) | (endOnFld > timestamp),  # noqa E711
+        )
+        with self._pj_jar.getCursor() as cur:
+            cur.execute(
+                sb.Select(
+                    self._get_sb_fields(()), qry, end=1,
+                    orderBy=sb.Field(self._pj_table, 'version'),
+                    reversed=True),
+                flush_hint=[self._pj_table])
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return self._load_one(
+            row[self._pj_id_column], row[self._pj_data_column], use_cache=False)
+
     def getNumberOfRevisions(self, obj):
         # 1. Setup the basic query.
         qry = self._combine_filters(
@@ -171,11 +317,28 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
             cur.execute(sb.Select('COUNT(*)', qry), flush_hint=[self._pj_table])
             return cur.fetchone()[0]
 
-    def getRevisionHistory(
+    def getNumberOfRevisionsMany(self, names):
+        """Return the number of revisions by name, using a single query."""
+        counts = dict.fromkeys(names, 0)
+        if not counts:
+            return counts
+        nameFld = sb.Field(self._pj_table, self._pj_mapping_key)
+        qry = self._combine_filters(
+            self._pj_get_resolve_filter_all_versions(),
+            sb.IN(nameFld, list(counts)),
+        )
+        with self._pj_jar.getCursor() as cur:
+            cur.execute(
+                sb.Select([nameFld, 'COUNT(*)'], qry, groupBy=nameFld),
+                flush_hint=[self._pj_table])
+            for name, count in cur.fetchall():
+                counts[name] = count
+        return counts
+
+    def _getHistoryQuery(
             self, obj, creator=None, comment=None,
             startBefore=None, startAfter=None,
-            batchStart=0, batchSize=None, reversed=False):
-
+            afterVersion=None, beforeVersion=None):
         # 1. Setup the basic query.
         qry = self._combine_filters(
             self._pj_get_resolve_filter_all_versions(),
@@ -195,10 +358,25 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
         if startAfter is not None:
             startOnFld = sb.Field(self._pj_table, 'startOn')
             qry = self._combine_filters(qry, startOnFld > startAfter)
+        if afterVersion is not None:
+            versionFld = sb.Field(self._pj_table, 'version')
+            qry = self._combine_filters(qry, versionFld > afterVersion)
+        if beforeVersion is not None:
+            versionFld = sb.Field(self._pj_table, 'version')
+            qry = self._combine_filters(qry, versionFld < beforeVersion)
+        return qry
+
+    def _selectHistory(
+            self, fields, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        qry = self._getHistoryQuery(
+            obj, creator, comment, startBefore, startAfter,
+            afterVersion, beforeVersion)
 
         # 3. Setup ordering.
         orderBy = sb.Field(self._pj_table, 'version')
-        fields = self._get_sb_fields(())
 
         # 4. Apply batching.
         batchEnd = None
@@ -212,11 +390,40 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
                     fields, qry, start=batchStart, end=batchEnd,
                     orderBy=orderBy, reversed=reversed),
                 flush_hint=[self._pj_table])
-            for row in cur:
-                obj = self._load_one(
-                    row[self._pj_id_column], row[self._pj_data_column],
-                    use_cache=False)
-                yield obj
+            yield from cur
+
+    def getRevisionHistory(
+            self, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        rows = self._selectHistory(
+            self._get_sb_fields(()), obj, creator, comment,
+            startBefore, startAfter, batchStart, batchSize, reversed,
+            afterVersion, beforeVersion)
+        for row in rows:
+            obj = self._load_one(
+                row[self._pj_id_column], row[self._pj_data_column],
+                use_cache=False)
+            yield obj
+
+    def getRevisionStubs(
+            self, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        # Only read the metadata columns, not the JSONB document.
+        fields = [sb.Field(self._pj_table, name)
+                  for name in self._pj_stub_fields]
+        rows = self._selectHistory(
+            fields, obj, creator, comment,
+            startBefore, startAfter, batchStart, batchSize, reversed,
+            afterVersion, beforeVersion)
+        for name, version, state, startOn, endOn, creator, comment in rows:
+            yield revisioned.RevisionStub(
+                revisioned.RevisionLoader(self, name, version),
+                name, version, state, fromTimestamp(startOn),
+                fromTimestamp(endOn), creator, comment)
 
     def rollbackToRevision(self, revision, activate=False):
         cur = self._pj_jar.getCursor()
@@ -237,8 +444,42 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
         self._pj_jar.register(revision)
         self._cache[revision.__name__] = revision
 
+    def _getCurrentVersion(self, name):
+        # Lock the row of the current revision until the end of the
+        # transaction, so that concurrent updates are serialized.
+        versionFld = sb.Field(self._pj_table, 'version')
+        qry = self._combine_filters(
+            self._pj_get_resolve_filter_all_versions(),
+            sb.Field(self._pj_table, self._pj_mapping_key) == name,
+            sb.Field(self._pj_table, 'endOn') == None,  # noqa E711
+        )
+        with self._pj_jar.getCursor() as cur:
+            cur.execute(
+                sb.Select([versionFld], qry, forUpdate=True),
+                flush_hint=[self._pj_table])
+            row = cur.fetchone()
+        return row[0] if row is not None else None
+
     def addRevision(self, new, old=None):
-        assert new.__im_state__ == interfaces.IM_STATE_LOCKED, new.__im_state__
+        """Add a new revision.
+
+        Raises a `RevisionConflictError` if `old` is not the current
+        revision. If `rebaseOnConflict` is set, `new` is rebased onto the
+        current revision instead.
+        """
+        if immutable.IMMUTABLE_CHECKS.eager:
+            assert new.__im_state__ == interfaces.IM_STATE_LOCKED, \
+                new.__im_state__
+
+        if old is not None:
+            version = self._getCurrentVersion(old.__name__)
+            if version is not None and version != old.__im_version__:
+                if not self.rebaseOnConflict:
+                    raise revisioned.RevisionConflictError(
+                        'Revision is not the current revision.', old)
+                head = self.getRevision(old.__name__, version)
+                revisioned.rebaseRevision(new, old, head)
+                old = head
 
         now = self.now()
         if old is not None:
@@ -250,6 +491,109 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
         self._pj_jar.register(new)
         self._cache[new.__name__] = new
 
+        if self.changeFeed is not None:
+            # Only publish the change once it is committed.
+            self._pj_jar.transaction_manager.get().addAfterCommitHook(
+                self._publishChange, (feed.createRecord(new, old),))
+
+    def _publishChange(self, status, record):
+        if status:
+            self.changeFeed.publish(record)
+
+    def createIndexes(self, trigram=False):
+        """Create the indexes of the revision table, see
+        `getIndexStatements()`.
+
+        The table must exist already.
+        """
+        with self._pj_jar.getCursor() as cur:
+            for statement in getIndexStatements(self._pj_table, trigram):
+                cur.execute(statement)
+
+    def compact(self, policy, obj=None):
+        """Drop the revisions selected by the retention policy.
+
+        Compacts the history of `obj` or of all objects. The latest revision
+        is never dropped. Returns the number of deleted rows.
+        """
+        if obj is not None:
+            names = [obj.__name__]
+        else:
+            nameFld = sb.Field(self._pj_table, self._pj_mapping_key)
+            with self._pj_jar.getCursor() as cur:
+                cur.execute(
+                    sb.Select(
+                        [nameFld],
+                        self._combine_filters(
+                            self._pj_get_resolve_filter_all_versions()),
+                        distinct=True),
+                    flush_hint=[self._pj_table])
+                names = [row[0] for row in cur.fetchall()]
+        return sum(self._compactRevisions(policy, name) for name in names)
+
+    def _compactRevisions(self, policy, name):
+        fields = [
+            sb.Field(self._pj_table, field)
+            for field in (self._pj_id_column, 'version', 'startOn', 'endOn',
+                          'creator', 'comment')]
+        qry = self._combine_filters(
+            self._pj_get_resolve_filter_all_versions(),
+            sb.Field(self._pj_table, self._pj_mapping_key) == name
+        )
+        with self._pj_jar.getCursor() as cur:
+            cur.execute(
+                sb.Select(fields, qry, orderBy=fields[1]),
+                flush_hint=[self._pj_table])
+            rows = cur.fetchall()
+        infos = [
+            revisioned.RevisionInfo(
+                version, fromTimestamp(startOn), fromTimestamp(endOn),
+                creator, comment)
+            for id, version, startOn, endOn, creator, comment in rows]
+
+        dropped = set(policy.getDropped(infos, self.now()))
+        dropped.discard(len(infos) - 1)
+        if not dropped:
+            return 0
+
+        # Extend the revisions before the dropped ones to avoid gaps. All
+        # ends are updated with a single statement, in the column and in
+        # the document.
+        ends = {}
+        kept = None
+        for pos, info in enumerate(infos):
+            if pos not in dropped:
+                kept = pos
+            elif kept is not None:
+                ends[rows[kept][0]] = info.__im_end_on__
+        if ends:
+            writer = serialize.ObjectWriter(self._pj_jar)
+            params = []
+            for id, endOn in ends.items():
+                doc = datamanager.Json(writer.get_state(endOn))
+                params += [id, endOn, doc]
+            values = ', '.join(
+                ['(%s, %s::timestamptz, %s::jsonb)'] * len(ends))
+            table = self._pj_table
+            data = self._pj_data_column
+            with self._pj_jar.getCursor() as cur:
+                cur.execute(
+                    f"UPDATE {table} SET endOn = ends.endOn, "
+                    f"{data} = jsonb_set("
+                    f"{data}, '{{__im_end_on__}}', ends.doc) "
+                    f"FROM (VALUES {values}) AS ends (id, endOn, doc) "
+                    f"WHERE {table}.{self._pj_id_column} = ends.id",
+                    params, flush_hint=[table])
+
+        # This DELETE works fine just because `execute()` checks all SQL
+        # commands and calls `PJDataManager.setDirty()` accordingly.
+        idFld = sb.Field(self._pj_table, self._pj_id_column)
+        with self._pj_jar.getCursor() as cur:
+            cur.execute(sb.Delete(
+                self._pj_table,
+                sb.IN(idFld, [rows[pos][0] for pos in sorted(dropped)])))
+        return len(dropped)
+
     def withDeletedItems(self):
         clone = self.__class__.__new__(self.__class__)
         clone.__dict__.update(self.__dict__)
@@ -257,8 +601,9 @@ class ImmutableContainer(pjcontainer.AllItemsPJContainer):
         return clone
 
     def __setitem__(self, key, value):
-        assert value.__im_state__ == interfaces.IM_STATE_LOCKED, \
-               value.__im_state__
+        if immutable.IMMUTABLE_CHECKS.eager:
+            assert value.__im_state__ == interfaces.IM_STATE_LOCKED, \
+                value.__im_state__
         super().__setitem__(key, value)
 
     def __delitem__(self, key):
@@ -0,0 +1,75 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Revision Retention Policies.
+
+Policies select the revisions a revision manager drops when compacting its
+history, see `SimpleRevisionedImmutableManager.compact()` and
+`ImmutableContainer.compact()`.
+"""
+import datetime
+import zope.interface
+
+from shoobx.immutable import interfaces
+
+
+@zope.interface.implementer(interfaces.IRevisionRetentionPolicy)
+class KeepLast:
+    """Keep the last `count` revisions."""
+
+    def __init__(self, count):
+        assert count > 0, count
+        self.count = count
+
+    def getDropped(self, revisions, now):
+        return range(max(0, len(revisions) - self.count))
+
+
+@zope.interface.implementer(interfaces.IRevisionRetentionPolicy)
+class KeepDaily:
+    """Keep only the last revision of each day for revisions started more
+    than `after` ago."""
+
+    def __init__(self, after=datetime.timedelta(days=30)):
+        self.after = after
+
+    def getDropped(self, revisions, now):
+        cutoff = now - self.after
+        dropped = []
+        for pos in range(len(revisions) - 1):
+            start = revisions[pos].__im_start_on__
+            nextStart = revisions[pos + 1].__im_start_on__
+            if nextStart < cutoff and nextStart.date() == start.date():
+                dropped.append(pos)
+        return dropped
+
+
+@zope.interface.implementer(interfaces.IRevisionRetentionPolicy)
+class DropOlderThan:
+    """Drop all revisions that ended more than `age` ago."""
+
+    def __init__(self, age):
+        self.age = age
+
+    def getDropped(self, revisions, now):
+        cutoff = now - self.age
+        return [
+            pos for pos, revision in enumerate(revisions)
+            if (revision.__im_end_on__ is not None and
+                revision.__im_end_on__ < cutoff)]
+
+
+@zope.interface.implementer(interfaces.IRevisionRetentionPolicy)
+class CombinedPolicy:
+    """Drop all revisions dropped by any of the given policies."""
+
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def getDropped(self, revisions, now):
+        dropped = set()
+        for policy in self.policies:
+            dropped.update(policy.getDropped(revisions, now))
+        return sorted(dropped)
@@ -4,34 +4,119 @@
 #
 ###############################################################################
 """Revisioned Immutable and Container."""
+import asyncio
+import bisect
 import collections.abc
+import contextlib
+import contextvars
 import datetime
+import functools
+import itertools
 import threading
 import zope.interface
-from contextlib import contextmanager
 
-from shoobx.immutable import immutable, interfaces
+from shoobx.immutable import immutable, interfaces, views
 
 
-class DefaultRevisionInfo(threading.local):
-    creator: str = None
-    comment: str = None
+class DefaultRevisionInfo:
+    """Default creator and comment of new revisions.
+
+    The values are stored in a context variable, so that every thread and
+    every asyncio task has its own defaults.
+    """
+
+    def __init__(self):
+        self.__info = contextvars.ContextVar(
+            'DefaultRevisionInfo', default=(None, None))
+
+    @property
+    def creator(self):
+        return self.__info.get()[0]
+
+    @creator.setter
+    def creator(self, creator):
+        self.__info.set((creator, self.__info.get()[1]))
+
+    @property
+    def comment(self):
+        return self.__info.get()[1]
+
+    @comment.setter
+    def comment(self, comment):
+        self.__info.set((self.__info.get()[0], comment))
+
+    def get(self):
+        """Return the `(creator, comment)` tuple."""
+        return self.__info.get()
+
+    def set(self, creator, comment):
+        """Set creator and comment and return a token for `reset()`."""
+        return self.__info.set((creator, comment))
+
+    def reset(self, token):
+        self.__info.reset(token)
 
 
 DEFAULT_REVISION_INFO = DefaultRevisionInfo()
 
 
-@contextmanager
-def defaultInfo(creator=None, comment=None):
-    origCreator = DEFAULT_REVISION_INFO.creator
-    DEFAULT_REVISION_INFO.creator = creator
-    origComment = DEFAULT_REVISION_INFO.comment
-    DEFAULT_REVISION_INFO.comment = comment
-    try:
-        yield DEFAULT_REVISION_INFO
-    finally:
-        DEFAULT_REVISION_INFO.creator = origCreator
-        DEFAULT_REVISION_INFO.comment = origComment
+class defaultInfo(contextlib.ContextDecorator):
+    """Set the default creator and comment of new revisions.
+
+    Can be used as context manager, asynchronous context manager and
+    decorator.
+    """
+
+    def __init__(self, creator=None, comment=None):
+        self.creator = creator
+        self.comment = comment
+        self.tokens = []
+
+    def _recreate_cm(self):
+        # Every decorated call gets its own context manager.
+        return self.__class__(self.creator, self.comment)
+
+    def __enter__(self):
+        self.tokens.append(
+            DEFAULT_REVISION_INFO.set(self.creator, self.comment))
+        return DEFAULT_REVISION_INFO
+
+    def __exit__(self, *exc_info):
+        DEFAULT_REVISION_INFO.reset(self.tokens.pop())
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
+
+
+class RevisionConflictError(ValueError):
+    """A revision was added based on a revision that is no longer current."""
+
+
+class CommitSequence:
+    """Global sequence numbering all added revisions.
+
+    Numbers are drawn from `itertools.count()`, whose `next()` is atomic, so
+    that revision managers never wait for each other. Managers append a
+    revision to their history before its number, so that all revisions
+    numbered below `current()` are visible once it is drawn.
+    """
+
+    def __init__(self):
+        self.counter = itertools.count(1)
+
+    def next(self):
+        """Return the number of a new revision."""
+        return next(self.counter)
+
+    def current(self):
+        """Return a number greater than the numbers of all added revisions."""
+        return next(self.counter)
+
+
+COMMIT_SEQUENCE = CommitSequence()
 
 
 @zope.interface.implementer(interfaces.IRevisionedImmutable)
@@ -50,21 +135,134 @@ class RevisionedImmutableBase(immutable.ImmutableBase):
 
     def __im_before_update__(self, clone, creator=None, comment=None):
         # Assign the update information to the clone:
-        clone.__im_creator__ = creator \
-            if creator is not None else DEFAULT_REVISION_INFO.creator
-        clone.__im_comment__ = comment \
-            if comment is not None else DEFAULT_REVISION_INFO.comment
+        if creator is None or comment is None:
+            defaultCreator, defaultComment = DEFAULT_REVISION_INFO.get()
+            if creator is None:
+                creator = defaultCreator
+            if comment is None:
+                comment = defaultComment
+        clone.__im_creator__ = creator
+        clone.__im_comment__ = comment
         clone.__im_version__ = self.__im_version__ + 1
 
     def __im_after_update__(self, clone, creator=None, comment=None):
         if self.__im_manager__ is not None:
             self.__im_manager__.addRevision(clone, old=self)
 
+    async def __im_after_aupdate__(self, clone, creator=None, comment=None):
+        if self.__im_manager__ is not None:
+            manager = asyncManager(self.__im_manager__)
+            await manager.addRevision(clone, old=self)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        # The manager is not part of the revision.
+        state.pop('__im_manager__', None)
+        return state
+
 
 class RevisionedImmutable(RevisionedImmutableBase):
     pass
 
 
+class RevisionIndex:
+    """History of a revision manager and its indexes.
+
+    An index covers the first `length` entries of its lists. Revisions are
+    appended to all lists before `length` grows, so that readers never find
+    a position that is not valid yet.
+
+    Truncating returns a new index sharing the lists, with a smaller
+    length, so that it takes constant time and readers can keep using the
+    index they started with. Shared lists are never appended to: the first
+    revision appended to the truncated index copies its entries. A rollback
+    followed by an update therefore still copies the remaining history once,
+    but only using list and dict copies. Dropping revisions creates a new
+    index.
+    """
+
+    __slots__ = ('data', 'commits', 'creators', 'starts', 'sorted',
+                 'versions', 'length', 'shared')
+
+    def __init__(self):
+        self.data = []
+        # Commit sequence numbers of all revisions, by position.
+        self.commits = []
+        # Positions of all revisions by creator.
+        self.creators = {}
+        # Start times of all revisions, by position.
+        self.starts = []
+        # Whether the start times are sorted and can be searched using
+        # bisect.
+        self.sorted = True
+        # Positions of all revisions by version. Shared lists may contain
+        # positions beyond the length, see `find()`.
+        self.versions = {}
+        self.length = 0
+        # Whether the lists are shared with another index.
+        self.shared = False
+
+    def find(self, version):
+        """Return the position of the revision with the given version.
+
+        Returns `None` if there is no such revision.
+        """
+        pos = self.versions.get(version)
+        if pos is None or pos >= self.length:
+            return None
+        return pos
+
+    def append(self, revision, commit):
+        if self.shared:
+            self.unshare()
+        pos = self.length
+        self.data.append(revision)
+        self.commits.append(commit)
+        self.versions[revision.__im_version__] = pos
+        start = revision.__im_start_on__
+        if pos and self.sorted and start < self.starts[pos - 1]:
+            self.sorted = False
+        self.starts.append(start)
+        if revision.__im_creator__ is not None:
+            self.creators.setdefault(revision.__im_creator__, []).append(pos)
+        self.length = pos + 1
+
+    def truncate(self, length):
+        """Return a new index of the revisions before the given position."""
+        index = self.__class__()
+        index.data = self.data
+        index.commits = self.commits
+        index.creators = self.creators
+        index.starts = self.starts
+        index.sorted = self.sorted
+        index.versions = self.versions
+        index.length = length
+        index.shared = self.shared = True
+        return index
+
+    def unshare(self):
+        """Copy the entries of the index, so that it can be appended to."""
+        length = self.length
+        versions = self.versions.copy()
+        for pos in range(length, len(self.data)):
+            version = self.data[pos].__im_version__
+            if versions.get(version) == pos:
+                del versions[version]
+        creators = {}
+        for creator, positions in self.creators.items():
+            cut = bisect.bisect_left(positions, length)
+            if cut:
+                creators[creator] = positions[:cut]
+        # Readers may use the old or the new lists, both are valid up to the
+        # length.
+        self.data = self.data[:length]
+        self.commits = self.commits[:length]
+        self.starts = self.starts[:length]
+        self.versions = versions
+        self.creators = creators
+        self.shared = False
+
+
 @zope.interface.implementer(interfaces.IRevisionedImmutableManager)
 class SimpleRevisionedImmutableManager:
 
@@ -72,85 +270,917 @@ class SimpleRevisionedImmutableManager:
     # on each call, a static datetime does NOT cut it
     now = datetime.datetime.now
 
+    # Retention policy applied whenever a revision is added, see `compact()`.
+    retentionPolicy = None
+
+    # When true, revisions added based on an outdated revision are rebased
+    # onto the latest revision, unless their changes conflict.
+    rebaseOnConflict = False
+
+    # Change feed publishing a record for every added revision, see
+    # `shoobx.immutable.feed`.
+    changeFeed = None
+
     def __init__(self):
-        self.__data__ = []
+        self.__index__ = RevisionIndex()
+        # Serializes all writers. Readers do not lock, but work on the index
+        # they started with.
+        self.__lock__ = threading.RLock()
+
+    @property
+    def __data__(self):
+        index = self.__index__
+        if len(index.data) == index.length:
+            return index.data
+        return index.data[:index.length]
+
+    def loadRevision(self, pos, index=None):
+        """Return the revision at the given position of the history.
+
+        Positions refer to the given index, the current one by default.
+        """
+        index = index if index is not None else self.__index__
+        if pos < 0:
+            pos += index.length
+        return index.data[pos]
+
+    def isRevision(self, pos, revision):
+        """Whether `revision` is the revision at the given position."""
+        return self.__data__[pos] is revision
 
     def getCurrentRevision(self, obj=None):
-        if not self.__data__:
+        index = self.__index__
+        pos = index.length - 1
+        if pos < 0:
             return None
-        if self.__data__[-1].__im_end_on__ is not None:
+        if index.data[pos].__im_end_on__ is not None:
             return None
-        return self.__data__[-1]
+        return self.loadRevision(pos, index)
 
     def getNumberOfRevisions(self, obj=None):
-        return len(self.__data__)
+        return self.__index__.length
 
-    def getRevisionHistory(
-            self, obj=None, creator=None, comment=None,
+    def getRevision(self, version):
+        """Return the revision with the given version.
+
+        Raises a `KeyError` if there is no such revision.
+        """
+        index = self.__index__
+        pos = index.find(version)
+        if pos is None:
+            raise KeyError(version)
+        return self.loadRevision(pos, index)
+
+    def getRevisionByVersion(self, version, obj=None):
+        return self.getRevision(version)
+
+    def getRevisionAt(self, timestamp, obj=None):
+        """Return the revision active at the given date/time.
+
+        A revision is active from its start on, until it ends. Returns `None`
+        if no revision was active at that time.
+        """
+        index = self.__index__
+        length = index.length
+        if index.sorted:
+            pos = bisect.bisect_right(index.starts, timestamp, 0, length) - 1
+        else:
+            pos = -1
+            for idx in range(length):
+                if index.starts[idx] <= timestamp:
+                    end = index.data[idx].__im_end_on__
+                    if end is None or timestamp < end:
+                        pos = idx
+        if pos < 0:
+            return None
+        end = index.data[pos].__im_end_on__
+        if end is not None and end <= timestamp:
+            return None
+        return self.loadRevision(pos, index)
+
+    def getCommittedRevision(self, commit, obj=None):
+        """Return the current revision as of the given commit sequence number.
+
+        Returns `None` if there was no active revision at that point.
+        """
+        # Revisions are appended to the data before their commit number is,
+        # so that every found position is valid.
+        index = self.__index__
+        length = index.length
+        pos = bisect.bisect_right(index.commits, commit, 0, length) - 1
+        if pos < 0:
+            return None
+        revision = index.data[pos]
+        if pos == length - 1 and \
+                revision.__im_end_on__ is not None:
+            return None
+        return self.loadRevision(pos, index)
+
+    def findVersion(self, version, index=None):
+        """Return the position of the first revision with at least the given
+        version.
+
+        Versions increase with the positions, so they are searched by
+        bisection.
+        """
+        index = index if index is not None else self.__index__
+        pos = index.find(version)
+        if pos is not None:
+            return pos
+        data = index.data
+        lo, hi = 0, index.length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if data[mid].__im_version__ < version:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def getRevisionPositions(
+            self, creator=None, comment=None,
             startBefore=None, startAfter=None,
-            batchStart=0, batchSize=None, reversed=False):
-        result = list(self.__data__)
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None, index=None):
+        """Return an iterable of the positions of the matching revisions.
+
+        Positions refer to the given index, the current one by default. See
+        `getRevisionHistory()` for the other arguments.
+        """
+        index = index if index is not None else self.__index__
+        data = index.data
+        batchStart = batchStart or 0
 
-        # 1. Apply filtering.
+        # 1. Find the range of positions matching the start time filters.
+        lo, hi = 0, index.length
+        filterStart = not index.sorted
+        if index.sorted:
+            if startAfter is not None:
+                lo = bisect.bisect_right(index.starts, startAfter, 0, hi)
+            if startBefore is not None:
+                hi = bisect.bisect_left(index.starts, startBefore, 0, hi)
+        # Narrow it down to the range of versions.
+        if afterVersion is not None:
+            lo = max(lo, self.findVersion(afterVersion + 1, index))
+        if beforeVersion is not None:
+            hi = min(hi, self.findVersion(beforeVersion, index))
+
+        # 2. Select the candidate positions using the creator index.
         if creator is not None:
-            result = [
-                obj for obj in result
-                if (obj.__im_creator__ is not None and
-                    obj.__im_creator__ == creator)]
-        if comment is not None:
-            result = [
-                obj for obj in result
-                if (obj.__im_comment__ is not None and
-                    comment in obj.__im_comment__)]
-        if startBefore is not None:
-            result = [obj for obj in result
-                      if obj.__im_start_on__ < startBefore]
-        if startAfter is not None:
-            result = [obj for obj in result
-                      if obj.__im_start_on__ > startAfter]
+            positions = index.creators.get(creator, [])
+            pos = range(
+                bisect.bisect_left(positions, lo),
+                bisect.bisect_left(positions, hi))
+        else:
+            positions = None
+            pos = range(lo, max(lo, hi))
 
         # 3. Setup ordering
         if reversed:
-            result.reverse()
+            pos = pos[::-1]
+
+        # 4. Apply batching directly on the positions, if no further
+        # filtering is needed.
+        filterLazily = comment is not None or filterStart
+        if not filterLazily:
+            end = None if batchSize is None else batchStart + batchSize
+            pos = pos[batchStart:end]
+
+        if positions is not None:
+            pos = (positions[idx] for idx in pos)
+
+        if filterLazily:
+            # 5. Apply the remaining filters and batching lazily.
+            if comment is not None:
+                pos = (
+                    idx for idx in pos
+                    if (data[idx].__im_comment__ is not None and
+                        comment in data[idx].__im_comment__))
+            if filterStart and startBefore is not None:
+                pos = (idx for idx in pos
+                       if data[idx].__im_start_on__ < startBefore)
+            if filterStart and startAfter is not None:
+                pos = (idx for idx in pos
+                       if data[idx].__im_start_on__ > startAfter)
+            end = None if batchSize is None else batchStart + batchSize
+            pos = itertools.islice(pos, batchStart, end)
+
+        return pos
 
-        # 4. Apply batching
-        if batchStart:
-            result = result[batchStart:]
-        if batchSize is not None:
-            result = result[:batchSize]
+    def getRevisionHistory(
+            self, obj=None, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        index = self.__index__
+        pos = self.getRevisionPositions(
+            creator, comment, startBefore, startAfter,
+            batchStart, batchSize, reversed, afterVersion, beforeVersion,
+            index)
+        return (self.loadRevision(idx, index) for idx in pos)
+
+    def getRevisionStubs(
+            self, obj=None, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        index = self.__index__
+        pos = self.getRevisionPositions(
+            creator, comment, startBefore, startAfter,
+            batchStart, batchSize, reversed, afterVersion, beforeVersion,
+            index)
+        return (self.getRevisionStub(idx, index) for idx in pos)
 
-        return iter(result)
+    def getRevisionStub(self, pos, index=None):
+        index = index if index is not None else self.__index__
+        revision = index.data[pos]
+        return RevisionStub(
+            RevisionLoader(self, revision.__im_version__),
+            getattr(revision, '__name__', None), revision.__im_version__,
+            revision.__im_state__, revision.__im_start_on__,
+            revision.__im_end_on__, revision.__im_creator__,
+            revision.__im_comment__)
 
     def addRevision(self, new, old=None):
-        assert new.__im_state__ == interfaces.IM_STATE_LOCKED, new.__im_state__
+        """Add a new revision.
+
+        Raises a `RevisionConflictError` if `old` is not the latest revision,
+        for example because another thread updated it first. If
+        `rebaseOnConflict` is set, `new` is rebased onto the latest revision
+        instead, see `rebaseRevision()`.
+        """
+        if immutable.IMMUTABLE_CHECKS.eager:
+            assert new.__im_state__ == interfaces.IM_STATE_LOCKED, \
+                new.__im_state__
+
+        with self.__lock__:
+            old = self.commitRevision(new, old)
+
+        # Subscribers must not hold up other writers.
+        if self.changeFeed is not None:
+            self.changeFeed.publishRevision(new, old)
+
+    def commitRevision(self, new, old=None):
+        """Add a new revision while holding the write lock.
+
+        Returns the revision `new` replaced, which differs from `old` if
+        `new` was rebased.
+        """
+        last = self.__index__.length - 1
+        if old is not None and last >= 0 and not self.isRevision(last, old):
+            if not self.rebaseOnConflict:
+                raise RevisionConflictError(
+                    'Revision is not the latest revision.', old)
+            head = self.loadRevision(last)
+            rebaseRevision(new, old, head)
+            old = head
 
         now = self.now()
+        new.__im_start_on__ = now
+        new.__im_manager__ = self
+        self.__index__.append(new, COMMIT_SEQUENCE.next())
+
+        # Retire the old revision only after the new one is visible.
         if old is not None:
             old.__im_end_on__ = now
             old.__im_state__ = interfaces.IM_STATE_RETIRED
 
-        new.__im_start_on__ = now
-        new.__im_manager__ = self
-        self.__data__.append(new)
+        if self.retentionPolicy is not None:
+            self.compact()
+        return old
+
+    def restoreRevision(self, revision):
+        """Append a stored revision to the history as it is.
+
+        Unlike `addRevision()`, neither the revision nor the previous one are
+        changed.
+        """
+        with self.__lock__:
+            self.__index__.append(revision, COMMIT_SEQUENCE.next())
+            revision.__im_manager__ = self
 
     def rollbackToRevision(self, revision, activate=True):
-        idx = self.__data__.index(revision)
-        self.__data__ = self.__data__[0:idx-1]
-        if activate:
-            revision.__im_end_on__ = None
-            revision.__im_state__ = interfaces.IM_STATE_LOCKED
+        with self.__lock__:
+            index = self.__index__
+            idx = index.find(revision.__im_version__)
+            if idx is None or not self.isRevision(idx, revision):
+                raise ValueError('Revision is not in the history.', revision)
+            if idx + 1 < index.length:
+                self.__index__ = index.truncate(idx + 1)
+            if activate:
+                revision.__im_end_on__ = None
+                revision.__im_state__ = interfaces.IM_STATE_LOCKED
+
+    def compact(self, policy=None, obj=None):
+        """Drop the revisions selected by the retention policy.
+
+        Uses `retentionPolicy` if no policy is given. The latest revision is
+        never dropped. Returns the number of dropped revisions.
+        """
+        policy = policy if policy is not None else self.retentionPolicy
+        with self.__lock__:
+            data = self.__data__
+            dropped = set(policy.getDropped(data, self.now()))
+            dropped.discard(len(data) - 1)
+            if dropped:
+                self.dropRevisions(sorted(dropped))
+        return len(dropped)
+
+    def dropRevisions(self, positions, records=None):
+        """Drop the revisions at the given positions.
+
+        Versions are kept. The revision before a dropped one is replaced by
+        a copy ending when the dropped one ended, so that there are no gaps;
+        see `extendRevision()`. `records` maps positions to records stored
+        instead of the current ones. The remaining revisions are indexed
+        anew and replace the current index at once, so that readers never
+        see a partially compacted history and keep the revisions they
+        started with.
+        """
+        dropped = set(positions)
+        records = records or {}
+        with self.__lock__:
+            current = self.__index__
+            index = RevisionIndex()
+            for pos in range(current.length):
+                record = current.data[pos]
+                if pos not in dropped:
+                    index.append(records.get(pos, record), current.commits[pos])
+                elif index.length:
+                    last = index.length - 1
+                    index.data[last] = self.extendRevision(
+                        index.data[last], record.__im_end_on__)
+            self.__index__ = index
+
+    def extendRevision(self, record, endOn):
+        """Return a copy of the stored `record` ending at `endOn`.
+
+        The copy is a locked revision in the same state. Revisions obtained
+        before the copy was made no longer match it, for example in
+        `rollbackToRevision()`.
+        """
+        revision = record.__im_clone__()
+        revision.__im_end_on__ = endOn
+        revision.__im_finalize__()
+        revision.__im_state__ = record.__im_state__
+        return revision
+
+
+@zope.interface.implementer(interfaces.IAsyncRevisionedImmutableManager)
+class AsyncRevisionedImmutableManager:
+    """Asynchronous adapter of a revision manager.
+
+    All calls to the manager are run in the `executor`, the default executor
+    of the event loop if `None`, with a copy of the current context. The
+    revision history is fetched in chunks of `fetchSize` revisions.
+    """
+
+    fetchSize = 100
+
+    def __init__(self, manager, executor=None):
+        self.manager = manager
+        self.executor = executor
+
+    async def run(self, func, *args, **kw):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(context.run, func, *args, **kw))
+
+    async def getCurrentRevision(self, obj=None):
+        return await self.run(self.manager.getCurrentRevision, obj)
+
+    async def getNumberOfRevisions(self, obj=None):
+        return await self.run(self.manager.getNumberOfRevisions, obj)
+
+    async def getRevisionByVersion(self, version, obj=None):
+        return await self.run(
+            self.manager.getRevisionByVersion, version, obj)
+
+    async def getRevisionAt(self, timestamp, obj=None):
+        return await self.run(self.manager.getRevisionAt, timestamp, obj)
+
+    async def getRevisionHistory(
+            self, obj=None, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        history = await self.run(
+            self.manager.getRevisionHistory, obj, creator=creator,
+            comment=comment, startBefore=startBefore, startAfter=startAfter,
+            batchStart=batchStart, batchSize=batchSize, reversed=reversed,
+            afterVersion=afterVersion, beforeVersion=beforeVersion)
+        async for revision in self.fetch(history):
+            yield revision
+
+    async def getRevisionStubs(
+            self, obj=None, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        stubs = await self.run(
+            self.manager.getRevisionStubs, obj, creator=creator,
+            comment=comment, startBefore=startBefore, startAfter=startAfter,
+            batchStart=batchStart, batchSize=batchSize, reversed=reversed,
+            afterVersion=afterVersion, beforeVersion=beforeVersion)
+        async for stub in self.fetch(stubs):
+            yield stub
+
+    async def fetch(self, iterable):
+        """Iterate over `iterable` in chunks of `fetchSize` items."""
+        iterator = iter(iterable)
+        while True:
+            chunk = await self.run(
+                list, itertools.islice(iterator, self.fetchSize))
+            for item in chunk:
+                yield item
+            if len(chunk) < self.fetchSize:
+                break
+
+    async def addRevision(self, new, old=None):
+        return await self.run(self.manager.addRevision, new, old)
+
+    async def rollbackToRevision(self, revision, activate=True):
+        return await self.run(
+            self.manager.rollbackToRevision, revision, activate)
+
+
+def asyncManager(manager, executor=None):
+    """Return the asynchronous variant of a revision manager.
+
+    Managers providing `IAsyncRevisionedImmutableManager` are returned as
+    they are, all others are adapted using `AsyncRevisionedImmutableManager`.
+    """
+    if interfaces.IAsyncRevisionedImmutableManager.providedBy(manager):
+        return manager
+    return AsyncRevisionedImmutableManager(manager, executor)
+
+
+# Marks a removed attribute or dict key in a delta.
+DELETED = object()
+
+
+class DictDelta:
+    """Changes of a nested `ImmutableDict` by key."""
+
+    __slots__ = ('changes',)
+
+    def __init__(self, changes):
+        self.changes = changes
+
+
+def diffDict(old, new):
+    changes = {}
+    for key, value in new.items():
+        if key not in old:
+            changes[key] = value
+            continue
+        oldValue = old[key]
+        if oldValue is value:
+            continue
+        if isinstance(value, immutable.ImmutableDict) and \
+                isinstance(oldValue, immutable.ImmutableDict):
+            delta = diffDict(oldValue, value)
+            if delta.changes:
+                changes[key] = delta
+        elif type(oldValue) is not type(value) or oldValue != value:
+            changes[key] = value
+    for key in old:
+        if key not in new:
+            changes[key] = DELETED
+    return DictDelta(changes)
+
+
+def diffRevisions(old, new):
+    """Compute the changes between two revisions.
+
+    The changes are computed by attribute, recursing into `ImmutableDict`
+    values. Returns `None` if the revisions cannot be compared.
+    """
+    if old.__class__ is not new.__class__ or \
+            new.__im_mutators__ or not hasattr(new, '__dict__'):
+        return None
+    oldAttrs = dict(views.iterItems(old))
+    newAttrs = dict(views.iterItems(new))
+    return diffDict(oldAttrs, newAttrs).changes
+
+
+def applyDictDelta(dct, changes):
+    for key, change in changes.items():
+        if change is DELETED:
+            del dct.data[key]
+        elif isinstance(change, DictDelta):
+            applyDictDelta(dct.data[key], change.changes)
+        else:
+            dct.data[key] = dct.__im_conform__(change)
+    dct.__im_mark_changed__()
+
+
+def applyDelta(clone, changes):
+    """Apply the changes to a transient clone of the previous revision."""
+    for name, change in changes.items():
+        if change is DELETED:
+            del clone.__dict__[name]
+        elif isinstance(change, DictDelta):
+            applyDictDelta(clone.__dict__[name], change.changes)
+        else:
+            clone.__dict__[name] = clone.__im_conform__(change)
+    clone.__im_mark_changed__()
+
+
+def rebaseChanges(ours, theirs):
+    """Return the changes of `ours` still to apply after `theirs`.
+
+    Both are changes to the same revision. Raises a `RevisionConflictError`
+    if they change the same attribute or key differently.
+    """
+    changes = {}
+    for key, change in ours.items():
+        if key not in theirs:
+            changes[key] = change
+            continue
+        other = theirs[key]
+        if isinstance(change, DictDelta) and isinstance(other, DictDelta):
+            nested = rebaseChanges(change.changes, other.changes)
+            if nested:
+                changes[key] = DictDelta(nested)
+        elif change is not other and (
+                type(change) is not type(other) or
+                isinstance(change, DictDelta) or change != other):
+            raise RevisionConflictError(
+                'Revisions change the same value.', key)
+    return changes
+
+
+def rebaseRevision(new, old, head):
+    """Rebase a revision created from `old` onto the newer `head` revision.
+
+    Three-way merges the changes from `old` to `new` with the changes from
+    `old` to `head` and stores the result in `new`, which becomes the
+    successor of `head`. Raises a `RevisionConflictError` if the changes
+    overlap or cannot be computed.
+    """
+    ours = diffRevisions(old, new)
+    theirs = diffRevisions(old, head)
+    if ours is None or theirs is None:
+        raise RevisionConflictError('Revisions cannot be merged.', old)
+    merged = head.__im_clone__()
+    applyDelta(merged, rebaseChanges(ours, theirs))
+
+    for name, value in list(views.iterItems(new)):
+        del new.__dict__[name]
+    for name, value in views.iterItems(merged):
+        new.__dict__[name] = value
+    new.__im_mark_changed__()
+    immutable.settleOrigins(new)
+    new.__im_version__ = head.__im_version__ + 1
+    new.__im_set_state__(interfaces.IM_STATE_LOCKED)
+
+
+class RevisionInfo:
+    """Metadata of a revision."""
+
+    __slots__ = (
+        '__im_version__', '__im_start_on__', '__im_end_on__',
+        '__im_creator__', '__im_comment__')
+
+    def __init__(
+            self, version, startOn, endOn=None, creator=None, comment=None):
+        self.__im_version__ = version
+        self.__im_start_on__ = startOn
+        self.__im_end_on__ = endOn
+        self.__im_creator__ = creator
+        self.__im_comment__ = comment
+
+
+class RevisionDelta(RevisionInfo):
+    """Stored revision, keeping its metadata and the changes to the previous
+    revision."""
+
+    __slots__ = ('changes',)
+
+    def __init__(self, revision, changes):
+        super().__init__(
+            revision.__im_version__, revision.__im_start_on__,
+            revision.__im_end_on__, revision.__im_creator__,
+            revision.__im_comment__)
+        self.changes = changes
+
+
+class RevisionLoader:
+    """Loader of a revision for a `RevisionStub`.
+
+    Calls `getRevision()` of the manager with the `key`, the version for
+    the revision managers of one object and the name and version for
+    containers. The manager is not pickled, since it holds the history or
+    the connection, and a lock. An unpickled loader has no manager; set
+    `manager` before loading.
+    """
+
+    __slots__ = ('manager', 'key')
+
+    def __init__(self, manager, *key):
+        self.manager = manager
+        self.key = key
+
+    def __call__(self):
+        if self.manager is None:
+            raise ValueError(
+                'Revision loader is not bound to a manager.', self.key)
+        return self.manager.getRevision(*self.key)
+
+    def __reduce__(self):
+        return (self.__class__, (None,) + self.key)
+
+
+class RevisionStub(RevisionInfo):
+    """Metadata of a revision, loading the full revision on demand.
+
+    All other attributes are looked up on the full revision, which is
+    loaded by calling `loader()` on first access. Special attributes are
+    not, so that copying, pickling and protocol checks keep the stub
+    unloaded. Revision attributes (`__im_*__`) are looked up.
+    """
+
+    __slots__ = (
+        '__name__', '__im_state__', '__im_loader__', '__im_revision__')
+
+    def __init__(
+            self, loader, name, version, state, startOn, endOn=None,
+            creator=None, comment=None):
+        super().__init__(version, startOn, endOn, creator, comment)
+        self.__name__ = name
+        self.__im_state__ = state
+        self.__im_loader__ = loader
+        self.__im_revision__ = None
+
+    def __im_load__(self):
+        """Return the full revision."""
+        if self.__im_revision__ is None:
+            self.__im_revision__ = self.__im_loader__()
+        return self.__im_revision__
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__') and \
+                not name.startswith('__im_'):
+            raise AttributeError(name)
+        return getattr(self.__im_load__(), name)
+
+    def __reduce__(self):
+        # The loaded revision is not part of the stub.
+        return (self.__class__, (
+            self.__im_loader__, self.__name__, self.__im_version__,
+            self.__im_state__, self.__im_start_on__, self.__im_end_on__,
+            self.__im_creator__, self.__im_comment__))
+
+    def __copy__(self):
+        func, args = self.__reduce__()
+        stub = func(*args)
+        stub.__im_revision__ = self.__im_revision__
+        return stub
+
+    def __deepcopy__(self, memo):
+        # The metadata and the revision are immutable, so they are shared.
+        return self.__copy__()
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} {self.__name__!r} '
+            f'version {self.__im_version__}>')
+
+
+class DeltaRevisionedImmutableManager(SimpleRevisionedImmutableManager):
+    """Revision manager storing most revisions as deltas.
+
+    Every `checkpointInterval` revisions, and whenever two revisions cannot
+    be compared, the full revision is stored. All other revisions only store
+    their changes to the previous revision and are reconstructed on demand
+    from the closest full or cached revision. The latest revision is always
+    kept in full. The `cacheSize` last reconstructed revisions are cached.
+    """
+
+    def __init__(self, checkpointInterval=32, cacheSize=16):
+        super().__init__()
+        assert checkpointInterval > 0, checkpointInterval
+        self.checkpointInterval = checkpointInterval
+        self.cacheSize = cacheSize
+        self.__head__ = None
+        self.__cache__ = collections.OrderedDict()
+
+    def loadRevision(self, pos, index=None):
+        with self.__lock__:
+            current = self.__index__
+            index = index if index is not None else current
+            data = index.data
+            if pos < 0:
+                pos += index.length
+            # The head and the cache belong to the current index only.
+            cached = index is current
+            if cached and pos == index.length - 1:
+                return self.__head__
+            record = data[pos]
+            if not isinstance(record, RevisionDelta):
+                return record
+            cache = self.__cache__ if cached else {}
+            if pos in cache:
+                self.__cache__.move_to_end(pos)
+                return cache[pos]
+
+            # Find the closest full or cached revision.
+            start = pos - 1
+            while isinstance(data[start], RevisionDelta) and \
+                    start not in cache:
+                start -= 1
+            base = cache.get(start, data[start])
+
+            revision = base.__im_clone__()
+            for idx in range(start + 1, pos + 1):
+                applyDelta(revision, data[idx].changes)
+            for name in RevisionInfo.__slots__:
+                revision.__dict__[name] = getattr(record, name)
+            revision.__im_manager__ = self
+            immutable.settleOrigins(revision)
+            revision.__im_set_state__(interfaces.IM_STATE_LOCKED)
+            if record.__im_end_on__ is not None:
+                revision.__im_state__ = interfaces.IM_STATE_RETIRED
+
+            if cached and self.cacheSize:
+                self.__cache__[pos] = revision
+                if len(self.__cache__) > self.cacheSize:
+                    self.__cache__.popitem(last=False)
+            return revision
+
+    def getRevisionStub(self, pos, index=None):
+        # Avoid reconstructing the revision just for its metadata.
+        index = index if index is not None else self.__index__
+        record = index.data[pos]
+        if not isinstance(record, RevisionDelta):
+            return super().getRevisionStub(pos, index)
+        state = interfaces.IM_STATE_LOCKED
+        if record.__im_end_on__ is not None:
+            state = interfaces.IM_STATE_RETIRED
+        return RevisionStub(
+            RevisionLoader(self, record.__im_version__),
+            getattr(self.__head__, '__name__', None), record.__im_version__,
+            state, record.__im_start_on__, record.__im_end_on__,
+            record.__im_creator__, record.__im_comment__)
+
+    def isRevision(self, pos, revision):
+        # Reconstructed revisions are not unique, so compare the metadata.
+        record = self.__data__[pos]
+        return (
+            revision.__im_manager__ is self and
+            revision.__im_version__ == record.__im_version__ and
+            revision.__im_start_on__ == record.__im_start_on__)
+
+    def commitRevision(self, new, old=None):
+        previous = self.__head__
+        replaced = super().commitRevision(new, old)
+        data = self.__index__.data
+        pos = self.__index__.length - 1
+        if pos and old is not None:
+            # `old` might have been replaced by the head while rebasing.
+            record = data[pos - 1]
+            record.__im_end_on__ = new.__im_start_on__
+            if not isinstance(record, RevisionDelta):
+                record.__im_state__ = interfaces.IM_STATE_RETIRED
+        if pos % self.checkpointInterval:
+            changes = diffRevisions(previous, new)
+            if changes is not None:
+                data[pos] = RevisionDelta(new, changes)
+        self.__head__ = new
+        return replaced
+
+    def rollbackToRevision(self, revision, activate=True):
+        with self.__lock__:
+            super().rollbackToRevision(revision, activate)
+            index = self.__index__
+            pos = index.length - 1
+            index.data[pos].__im_end_on__ = revision.__im_end_on__
+            self.__head__ = revision
+            for idx in list(self.__cache__):
+                if idx >= pos:
+                    del self.__cache__[idx]
+
+    def dropRevisions(self, positions):
+        # Store kept revisions in full, if one of the revisions they are
+        # reconstructed from is dropped.
+        dropped = set(positions)
+        pending = False
+        records = {}
+        with self.__lock__:
+            for pos, record in enumerate(self.__data__):
+                if pos in dropped:
+                    pending = True
+                elif not isinstance(record, RevisionDelta):
+                    pending = False
+                elif pending:
+                    records[pos] = self.loadRevision(pos)
+                    pending = False
+            self.__cache__.clear()
+            super().dropRevisions(positions, records)
+
+    def extendRevision(self, record, endOn):
+        if not isinstance(record, RevisionDelta):
+            return super().extendRevision(record, endOn)
+        delta = RevisionDelta(record, record.changes)
+        delta.__im_end_on__ = endOn
+        return delta
+
+
+class RevisionedMappingSnapshot(collections.abc.Mapping):
+    """Read-only view of a `RevisionedMapping` at a given date/time.
+
+    Maps all keys to the revision active at that time. Keys without an
+    active revision are not part of the snapshot. Revisions are only looked
+    up when a key is accessed and are remembered afterwards.
+    """
+
+    def __init__(self, managers, timestamp):
+        self.__managers__ = dict(managers)
+        self.__resolved__ = {}
+        self.timestamp = timestamp
+
+    def getRevision(self, manager):
+        return manager.getRevisionAt(self.timestamp)
+
+    def __resolve(self, key):
+        if key not in self.__resolved__:
+            manager = self.__managers__[key]
+            self.__resolved__[key] = self.getRevision(manager)
+        return self.__resolved__[key]
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __iter__(self):
+        for key in self.__managers__:
+            if self.__resolve(key) is not None:
+                yield key
+
+    def __getitem__(self, key):
+        revision = self.__resolve(key)
+        if revision is None:
+            raise KeyError(key)
+        return revision
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} at {self.timestamp}>'
+
+
+class CommittedRevisionedMappingSnapshot(RevisionedMappingSnapshot):
+    """Read-only view of the current revisions of a `RevisionedMapping` as of
+    a commit sequence number.
+
+    Revisions added after the commit are not visible, so all reads are
+    consistent with each other, while writers proceed.
+    """
+
+    def __init__(self, managers, commit):
+        super().__init__(managers, None)
+        self.commit = commit
+
+    def getRevision(self, manager):
+        return manager.getCommittedRevision(self.commit)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} at commit {self.commit}>'
 
 
 class RevisionedMapping(collections.abc.MutableMapping):
+    """Mapping of keys to revision histories.
+
+    Updates of the revisions of a key are serialized by its revision manager.
+    Adding and removing keys is serialized by the mapping.
+    """
 
     def __init__(self):
         self.__data__ = {}
+        self.__lock__ = threading.Lock()
 
     def getRevisionManager(self, key):
         if key not in self.__data__:
             raise KeyError(key)
         return self.__data__[key]
 
+    def asOf(self, timestamp):
+        """Return a read-only snapshot of the mapping at the given date/time.
+
+        Only the histories of the current keys are considered, since setting
+        or deleting a key discards its history.
+        """
+        return RevisionedMappingSnapshot(self.__data__, timestamp)
+
+    def snapshot(self):
+        """Return a read-only snapshot of the current revisions.
+
+        The snapshot does not change when revisions are added or keys are
+        set afterwards. Reading it never waits for writers.
+        """
+        with self.__lock__:
+            return CommittedRevisionedMappingSnapshot(
+                self.__data__, COMMIT_SEQUENCE.current())
+
     def __len__(self):
         return len(self.__data__)
 
@@ -162,8 +1192,11 @@ class RevisionedMapping(collections.abc.MutableMapping):
         return revisions.getCurrentRevision()
 
     def __setitem__(self, key, value):
-        self.__data__[key] = SimpleRevisionedImmutableManager()
-        self.__data__[key].addRevision(value)
+        manager = SimpleRevisionedImmutableManager()
+        with self.__lock__:
+            manager.addRevision(value)
+            self.__data__[key] = manager
 
     def __delitem__(self, key):
-        del self.__data__[key]
+        with self.__lock__:
+            del self.__data__[key]
@@ -0,0 +1,407 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""SQLite-backed Revisioned Immutable Container.
+
+A lightweight alternative to `shoobx.immutable.pjpersist.ImmutableContainer`
+with the same behavior, using the `sqlite3` module of the standard library.
+Every revision is a row; the metadata is stored in columns and the revision
+itself is pickled into the `data` column.
+
+Unlike the pjpersist container, every change is committed immediately.
+"""
+import collections.abc
+import contextlib
+import datetime
+import pickle
+import sqlite3
+import threading
+import zope.interface
+
+from shoobx.immutable import immutable, interfaces, revisioned
+
+COLUMNS = (
+    'name', 'version', 'state', 'startOn', 'endOn', 'creator', 'comment',
+    'data')
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        startOn TEXT,
+        endOn TEXT,
+        creator TEXT,
+        comment TEXT,
+        data BLOB NOT NULL)''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS {table}_name_version
+        ON {table} (name, version)''',
+    '''CREATE INDEX IF NOT EXISTS {table}_name_endOn
+        ON {table} (name, endOn)''',
+)
+
+
+# Most parameters older SQLite versions accept per statement.
+MAX_PARAMS = 999
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def toTimestamp(value):
+    # Fixed width ISO format, so that timestamps sort as strings.
+    if value is None:
+        return None
+    return value.isoformat(timespec='microseconds')
+
+
+def fromTimestamp(value):
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+@zope.interface.implementer(interfaces.IRevisionedImmutableManager)
+class SQLiteRevisionedImmutableContainer(collections.abc.MutableMapping):
+    """Container of revisioned immutables stored in an SQLite database.
+
+    Immutables are identified by their `__name__`. Behaves like
+    `ImmutableContainer`, including deleted item handling.
+    """
+
+    # When true, deleting an item removes all its revisions. Otherwise the
+    # current revision is marked as deleted.
+    removeDocuments = True
+
+    # When true, the container APIs will include deleted items.
+    withDeleted = False
+
+    # When true, revisions added based on an outdated revision are rebased
+    # onto the current revision, unless their changes conflict.
+    rebaseOnConflict = False
+
+    # Change feed publishing a record for every committed revision, see
+    # `shoobx.immutable.feed`.
+    changeFeed = None
+
+    # Testing hook.
+    now = datetime.datetime.now
+
+    def __init__(self, path, table='immutables'):
+        self.path = path
+        self.table = table
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            self.connection.execute(statement.format(table=table))
+
+    def close(self):
+        self.connection.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the enclosed statements in one write transaction."""
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(
+                sql.format(table=self.table), params).fetchall()
+
+    def getCurrentFilter(self):
+        # Return a filter that matches ONLY the current version.
+        if self.withDeleted:
+            return '(endOn IS NULL OR state = ?)', [
+                interfaces.IM_STATE_DELETED]
+        return 'endOn IS NULL', []
+
+    def load(self, row):
+        version, state, startOn, endOn, creator, comment, data = row
+        obj = pickle.loads(data)
+        obj.__im_version__ = version
+        obj.__im_state__ = state
+        obj.__im_start_on__ = fromTimestamp(startOn)
+        obj.__im_end_on__ = fromTimestamp(endOn)
+        obj.__im_creator__ = creator
+        obj.__im_comment__ = comment
+        obj.__im_manager__ = self
+        return obj
+
+    def select(self, where, params, suffix=''):
+        rows = self.execute(
+            'SELECT version, state, startOn, endOn, creator, comment, data '
+            'FROM {table} WHERE ' + where + suffix, params)
+        return [self.load(row) for row in rows]
+
+    def withDeletedItems(self):
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.withDeleted = True
+        return clone
+
+    # IRevisionedImmutableManager
+
+    def getCurrentRevision(self, obj):
+        return self.get(obj.__name__)
+
+    def getRevision(self, name, version):
+        """Return the revision with the given version.
+
+        Raises a `KeyError` if there is no such revision.
+        """
+        revisions = self.select(
+            'name = ? AND version = ?', [name, version])
+        if not revisions:
+            raise KeyError((name, version))
+        return revisions[0]
+
+    def getRevisionByVersion(self, version, obj):
+        return self.getRevision(obj.__name__, version)
+
+    def getRevisions(self, keys):
+        """Return the revisions with the given `(name, version)` pairs.
+
+        The result maps the pairs to the revisions. Missing revisions are
+        left out.
+        """
+        revisions = {}
+        for chunk in chunked(sorted(set(keys)), MAX_PARAMS // 2):
+            params = [value for key in chunk for value in key]
+            for revision in self.select(
+                    '(name, version) IN (VALUES %s)' % ', '.join(
+                        ['(?, ?)'] * len(chunk)), params):
+                key = (revision.__name__, revision.__im_version__)
+                revisions[key] = revision
+        return revisions
+
+    def getRevisionAt(self, timestamp, obj):
+        timestamp = toTimestamp(timestamp)
+        revisions = self.select(
+            'name = ? AND startOn <= ? AND (endOn IS NULL OR endOn > ?)',
+            [obj.__name__, timestamp, timestamp],
+            ' ORDER BY version DESC LIMIT 1')
+        return revisions[0] if revisions else None
+
+    def getNumberOfRevisions(self, obj):
+        return self.execute(
+            'SELECT COUNT(*) FROM {table} WHERE name = ?', [obj.__name__]
+        )[0][0]
+
+    def getNumberOfRevisionsMany(self, names):
+        """Return the number of revisions by name."""
+        counts = dict.fromkeys(names, 0)
+        for chunk in chunked(list(counts), MAX_PARAMS):
+            rows = self.execute(
+                'SELECT name, COUNT(*) FROM {table} WHERE name IN (%s) '
+                'GROUP BY name' % ', '.join('?' * len(chunk)), chunk)
+            counts.update(rows)
+        return counts
+
+    def getHistoryQuery(
+            self, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        """Return the filter, parameters and suffix of a history query."""
+
+        # 1. Setup the basic query.
+        where = ['name = ?']
+        params = [obj.__name__]
+
+        # 2. Apply all additional filters.
+        if creator is not None:
+            where.append('creator = ?')
+            params.append(creator)
+        if comment is not None:
+            where.append('instr(comment, ?) > 0')
+            params.append(comment)
+        if startBefore is not None:
+            where.append('startOn < ?')
+            params.append(toTimestamp(startBefore))
+        if startAfter is not None:
+            where.append('startOn > ?')
+            params.append(toTimestamp(startAfter))
+        if afterVersion is not None:
+            where.append('version > ?')
+            params.append(afterVersion)
+        if beforeVersion is not None:
+            where.append('version < ?')
+            params.append(beforeVersion)
+
+        # 3. Setup ordering.
+        suffix = ' ORDER BY version' + (' DESC' if reversed else '')
+
+        # 4. Apply batching.
+        suffix += ' LIMIT ? OFFSET ?'
+        params += [batchSize if batchSize is not None else -1,
+                   batchStart or 0]
+        return ' AND '.join(where), params, suffix
+
+    def getRevisionHistory(
+            self, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        return iter(self.select(*self.getHistoryQuery(
+            obj, creator, comment, startBefore, startAfter,
+            batchStart, batchSize, reversed, afterVersion, beforeVersion)))
+
+    def getRevisionStubs(
+            self, obj, creator=None, comment=None,
+            startBefore=None, startAfter=None,
+            batchStart=0, batchSize=None, reversed=False,
+            afterVersion=None, beforeVersion=None):
+        where, params, suffix = self.getHistoryQuery(
+            obj, creator, comment, startBefore, startAfter,
+            batchStart, batchSize, reversed, afterVersion, beforeVersion)
+        # Only read the metadata columns.
+        rows = self.execute(
+            'SELECT name, version, state, startOn, endOn, creator, comment '
+            'FROM {table} WHERE ' + where + suffix, params)
+        return iter([
+            revisioned.RevisionStub(
+                revisioned.RevisionLoader(self, name, version),
+                name, version, state, fromTimestamp(startOn),
+                fromTimestamp(endOn), creator, comment)
+            for name, version, state, startOn, endOn, creator, comment
+            in rows])
+
+    def getCurrentVersion(self, name):
+        rows = self.execute(
+            'SELECT version FROM {table} WHERE name = ? AND endOn IS NULL',
+            [name])
+        return rows[0][0] if rows else None
+
+    def addRevision(self, new, old=None):
+        """Add a new revision.
+
+        Raises a `RevisionConflictError` if `old` is not the current
+        revision. If `rebaseOnConflict` is set, `new` is rebased onto the
+        current revision instead.
+        """
+        if immutable.IMMUTABLE_CHECKS.eager:
+            assert new.__im_state__ == interfaces.IM_STATE_LOCKED, \
+                new.__im_state__
+
+        with self.lock:
+            with self.transaction():
+                if old is not None:
+                    version = self.getCurrentVersion(old.__name__)
+                    if version is not None and version != old.__im_version__:
+                        if not self.rebaseOnConflict:
+                            raise revisioned.RevisionConflictError(
+                                'Revision is not the current revision.', old)
+                        head = self.getRevision(old.__name__, version)
+                        revisioned.rebaseRevision(new, old, head)
+                        old = head
+
+                now = self.now()
+                if old is not None:
+                    self.execute(
+                        'UPDATE {table} SET endOn = ?, state = ? '
+                        'WHERE name = ? AND version = ?',
+                        [toTimestamp(now), interfaces.IM_STATE_RETIRED,
+                         old.__name__, old.__im_version__])
+
+                new.__im_start_on__ = now
+                new.__im_manager__ = self
+                self.execute(
+                    'INSERT INTO {table} (%s) VALUES (%s)' % (
+                        ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                    [new.__name__, new.__im_version__, new.__im_state__,
+                     toTimestamp(now), toTimestamp(new.__im_end_on__),
+                     new.__im_creator__, new.__im_comment__,
+                     pickle.dumps(new, pickle.HIGHEST_PROTOCOL)])
+
+            # Retire the old revision only once the transaction committed.
+            if old is not None:
+                old.__im_end_on__ = now
+                old.__im_state__ = interfaces.IM_STATE_RETIRED
+
+        if self.changeFeed is not None:
+            self.changeFeed.publishRevision(new, old)
+
+    def rollbackToRevision(self, revision, activate=False):
+        with self.transaction():
+            self.execute(
+                'DELETE FROM {table} WHERE name = ? AND version > ?',
+                [revision.__name__, revision.__im_version__])
+            revision.__im_state__ = interfaces.IM_STATE_LOCKED
+            if activate:
+                revision.__im_end_on__ = None
+            self.execute(
+                'UPDATE {table} SET endOn = ?, state = ? '
+                'WHERE name = ? AND version = ?',
+                [toTimestamp(revision.__im_end_on__), revision.__im_state__,
+                 revision.__name__, revision.__im_version__])
+
+    # Mapping of names to current revisions.
+
+    def add(self, obj, key=None):
+        if immutable.IMMUTABLE_CHECKS.eager:
+            assert obj.__im_state__ == interfaces.IM_STATE_LOCKED, \
+                obj.__im_state__
+        if key is not None:
+            obj.__name__ = key
+        self.addRevision(obj)
+        return obj.__name__
+
+    def __len__(self):
+        where, params = self.getCurrentFilter()
+        return self.execute(
+            'SELECT COUNT(*) FROM {table} WHERE ' + where, params)[0][0]
+
+    def __iter__(self):
+        where, params = self.getCurrentFilter()
+        rows = self.execute(
+            'SELECT name FROM {table} WHERE ' + where + ' ORDER BY name',
+            params)
+        return iter([row[0] for row in rows])
+
+    def __getitem__(self, key):
+        where, params = self.getCurrentFilter()
+        revisions = self.select(
+            'name = ? AND ' + where, [key] + params,
+            ' ORDER BY version DESC LIMIT 1')
+        if not revisions:
+            raise KeyError(key)
+        return revisions[0]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key, value):
+        self.add(value, key)
+
+    def __delitem__(self, key):
+        with self.transaction():
+            value = self[key]
+            value.__im_end_on__ = self.now()
+            value.__im_state__ = interfaces.IM_STATE_DELETED
+            if self.removeDocuments:
+                # We need to make sure that all revisions get deleted.
+                self.execute('DELETE FROM {table} WHERE name = ?', [key])
+            else:
+                self.execute(
+                    'UPDATE {table} SET endOn = ?, state = ? '
+                    'WHERE name = ? AND version = ?',
+                    [toTimestamp(value.__im_end_on__), value.__im_state__,
+                     key, value.__im_version__])
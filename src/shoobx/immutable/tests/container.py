@@ -0,0 +1,339 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Shared Tests of the Revisioned Immutable Containers.
+
+Every container backend runs `ContainerTests`, so that they all provide the
+same query surface.
+"""
+import datetime
+import os
+import pickle
+import shutil
+import tempfile
+from zope.interface import verify
+
+from shoobx.immutable import feed, interfaces, revisioned
+
+
+class Question(revisioned.RevisionedImmutable):
+
+    def __init__(self, question=None, answer=None):
+        self.question = question
+        self.answer = answer
+
+
+def createQuestion(question, answer=None):
+    with Question.__im_create__() as factory:
+        return factory(question, answer)
+
+
+class ContainerTests:
+    """Tests of a container stored in a file.
+
+    Subclasses set the file name and implement `createContainer()`.
+    """
+
+    filename = None
+
+    def createContainer(self, path, **kw):
+        raise NotImplementedError()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, self.filename)
+        self.day = 0
+        self.questions = self.open()
+
+    def tearDown(self):
+        self.questions.close()
+        shutil.rmtree(self.dir)
+
+    def now(self):
+        self.day += 1
+        return datetime.datetime(2020, 1, self.day)
+
+    def open(self, **kw):
+        questions = self.createContainer(self.path, **kw)
+        questions.now = self.now
+        return questions
+
+    def reopen(self, **kw):
+        self.questions.close()
+        self.questions = self.open(**kw)
+        return self.questions
+
+    def createHistory(self):
+        q = createQuestion('What is the answer')
+        self.questions['everything'] = q
+        with q.__im_update__(creator='arthur') as q2:
+            q2.answer = 42
+        with q2.__im_update__(creator='ford', comment='a guess') as q3:
+            q3.answer = 43
+        return [q, q2, q3]
+
+    def versions(self, obj, **kw):
+        return [rev.__im_version__
+                for rev in self.questions.getRevisionHistory(obj, **kw)]
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyObject(
+                interfaces.IRevisionedImmutableManager, self.questions))
+
+    def test_add(self):
+        q = createQuestion('What is the answer')
+        self.assertEqual(self.questions.add(q, 'everything'), 'everything')
+        self.assertEqual(q.__name__, 'everything')
+        self.assertIs(q.__im_manager__, self.questions)
+        self.assertEqual(q.__im_start_on__, datetime.datetime(2020, 1, 1))
+        self.assertEqual(len(self.questions), 1)
+        self.assertEqual(list(self.questions), ['everything'])
+
+    def test_getitem(self):
+        self.createHistory()
+        rev = self.questions['everything']
+        self.assertEqual(rev.answer, 43)
+        self.assertEqual(rev.__im_version__, 2)
+        self.assertEqual(rev.__im_creator__, 'ford')
+        self.assertEqual(rev.__im_state__, interfaces.IM_STATE_LOCKED)
+        self.assertIs(rev.__im_manager__, self.questions)
+        with self.assertRaises(KeyError):
+            self.questions['unknown']
+
+    def test_getitem_afterReopen(self):
+        self.createHistory()
+        questions = self.reopen()
+        rev = questions['everything']
+        self.assertEqual(rev.answer, 43)
+        self.assertIs(rev.__im_manager__, questions)
+        self.assertEqual(questions.getNumberOfRevisions(rev), 3)
+        # New revisions are added to the restored history.
+        with rev.__im_update__() as rev2:
+            pass
+        self.assertEqual(rev2.__im_version__, 3)
+        self.assertEqual(self.reopen().getNumberOfRevisions(rev), 4)
+
+    def test_getCurrentRevision(self):
+        q, q2, q3 = self.createHistory()
+        self.assertEqual(
+            self.questions.getCurrentRevision(q).__im_version__, 2)
+
+    def test_getRevision(self):
+        q, q2, q3 = self.createHistory()
+        rev = self.questions.getRevision('everything', 0)
+        self.assertIsNone(rev.answer)
+        self.assertEqual(rev.__im_state__, interfaces.IM_STATE_RETIRED)
+        self.assertEqual(rev.__im_end_on__, datetime.datetime(2020, 1, 2))
+        with self.assertRaises(KeyError):
+            self.questions.getRevision('everything', 3)
+        with self.assertRaises(KeyError):
+            self.questions.getRevision('unknown', 0)
+
+    def test_getRevisionByVersion(self):
+        q, q2, q3 = self.createHistory()
+        self.assertEqual(
+            self.questions.getRevisionByVersion(1, q).answer, 42)
+        with self.assertRaises(KeyError):
+            self.questions.getRevisionByVersion(3, q)
+
+    def test_getRevisionAt(self):
+        q, q2, q3 = self.createHistory()
+        self.assertIsNone(
+            self.questions.getRevisionAt(datetime.datetime(2019, 1, 1), q))
+        rev = self.questions.getRevisionAt(
+            datetime.datetime(2020, 1, 2, 12), q)
+        self.assertEqual(rev.__im_version__, 1)
+        rev = self.questions.getRevisionAt(datetime.datetime(2020, 1, 3), q)
+        self.assertEqual(rev.__im_version__, 2)
+
+    def test_getNumberOfRevisions(self):
+        q, q2, q3 = self.createHistory()
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 3)
+        other = createQuestion('Who')
+        other.__name__ = 'other'
+        self.assertEqual(self.questions.getNumberOfRevisions(other), 0)
+
+    def test_getNumberOfRevisionsMany(self):
+        self.createHistory()
+        self.questions['other'] = createQuestion('Who')
+        self.assertEqual(
+            self.questions.getNumberOfRevisionsMany(
+                ['everything', 'other', 'unknown']),
+            {'everything': 3, 'other': 1, 'unknown': 0})
+        self.assertEqual(self.questions.getNumberOfRevisionsMany([]), {})
+
+    def test_getRevisionHistory(self):
+        q, q2, q3 = self.createHistory()
+        history = self.questions.getRevisionHistory(q)
+        self.assertEqual([rev.answer for rev in history], [None, 42, 43])
+
+    def test_getRevisionHistory_withUnknownName(self):
+        q = createQuestion('What is the answer')
+        q.__name__ = 'everything'
+        self.assertEqual(list(self.questions.getRevisionHistory(q)), [])
+        self.assertEqual(list(self.questions.getRevisionStubs(q)), [])
+        self.assertIsNone(self.questions.getCurrentRevision(q))
+
+    def test_getRevisionHistory_withFilters(self):
+        q, q2, q3 = self.createHistory()
+        self.assertEqual(self.versions(q, creator='arthur'), [1])
+        self.assertEqual(self.versions(q, comment='guess'), [2])
+        self.assertEqual(
+            self.versions(q, startBefore=datetime.datetime(2020, 1, 2)), [0])
+        self.assertEqual(
+            self.versions(q, startAfter=datetime.datetime(2020, 1, 2)), [2])
+
+    def test_getRevisionHistory_withBatching(self):
+        q, q2, q3 = self.createHistory()
+        self.assertEqual(self.versions(q, batchStart=1), [1, 2])
+        self.assertEqual(self.versions(q, batchStart=1, batchSize=1), [1])
+        self.assertEqual(self.versions(q, reversed=True), [2, 1, 0])
+        self.assertEqual(
+            self.versions(q, reversed=True, batchSize=2), [2, 1])
+
+    def test_getRevisionHistory_withVersions(self):
+        q, q2, q3 = self.createHistory()
+        self.assertEqual(self.versions(q, afterVersion=0), [1, 2])
+        self.assertEqual(
+            self.versions(q, beforeVersion=2, reversed=True), [1, 0])
+        self.assertEqual(
+            self.versions(q, afterVersion=0, beforeVersion=2), [1])
+        stubs = self.questions.getRevisionStubs(q, afterVersion=1)
+        self.assertEqual([stub.__im_version__ for stub in stubs], [2])
+
+    def test_getRevisionStubs(self):
+        q, q2, q3 = self.createHistory()
+        stubs = list(self.questions.getRevisionStubs(q, reversed=True))
+        self.assertEqual(
+            [(stub.__name__, stub.__im_version__, stub.__im_state__,
+              stub.__im_creator__, stub.__im_comment__) for stub in stubs],
+            [('everything', 2, interfaces.IM_STATE_LOCKED, 'ford', 'a guess'),
+             ('everything', 1, interfaces.IM_STATE_RETIRED, 'arthur', None),
+             ('everything', 0, interfaces.IM_STATE_RETIRED, None, None)])
+        self.assertEqual(stubs[1].__im_end_on__, datetime.datetime(2020, 1, 3))
+        # The full revisions are only loaded on access.
+        self.assertIsNone(stubs[1].__im_revision__)
+        self.assertEqual(stubs[1].answer, 42)
+        self.assertIsNotNone(stubs[1].__im_revision__)
+
+    def test_getRevisionStubs_pickle(self):
+        q, q2, q3 = self.createHistory()
+        stub = list(self.questions.getRevisionStubs(q))[1]
+        stub2 = pickle.loads(pickle.dumps(stub))
+        self.assertEqual(stub2.__im_version__, 1)
+        self.assertEqual(stub2.__im_creator__, 'arthur')
+        # The container is not pickled, the stub has to be bound again.
+        with self.assertRaises(ValueError):
+            stub2.answer
+        stub2.__im_loader__.manager = self.questions
+        self.assertEqual(stub2.answer, 42)
+
+    def test_getRevisionStubs_withFilters(self):
+        q, q2, q3 = self.createHistory()
+        stubs = self.questions.getRevisionStubs(
+            q, comment='guess', startAfter=datetime.datetime(2020, 1, 2))
+        self.assertEqual([stub.__im_version__ for stub in stubs], [2])
+
+    def test_getRevisions(self):
+        q, q2, q3 = self.createHistory()
+        self.questions['other'] = createQuestion('Who')
+        revisions = self.questions.getRevisions(
+            [('everything', 0), ('everything', 2), ('other', 0),
+             ('other', 1), ('unknown', 0)])
+        self.assertEqual(
+            sorted(revisions), [('everything', 0), ('everything', 2),
+                                ('other', 0)])
+        self.assertEqual(revisions[('everything', 2)].answer, 43)
+        self.assertEqual(revisions[('other', 0)].question, 'Who')
+        self.assertEqual(self.questions.getRevisions([]), {})
+
+    def test_addRevision_withConflict(self):
+        q, q2, q3 = self.createHistory()
+        q4 = q2.__im_clone__()
+        q4.__im_version__ = 2
+        q4.__im_finalize__()
+        with self.assertRaises(revisioned.RevisionConflictError):
+            self.questions.addRevision(q4, old=q2)
+        self.assertEqual(self.questions['everything'].answer, 43)
+        self.assertEqual(self.reopen().getNumberOfRevisions(q), 3)
+
+    def test_rollbackToRevision(self):
+        q, q2, q3 = self.createHistory()
+        rev = self.questions.getRevision('everything', 1)
+        self.questions.rollbackToRevision(rev, activate=True)
+        for reopen in (False, True):
+            questions = self.reopen() if reopen else self.questions
+            rev = questions['everything']
+            self.assertEqual(rev.__im_version__, 1)
+            self.assertIsNone(rev.__im_end_on__)
+            self.assertEqual(rev.__im_state__, interfaces.IM_STATE_LOCKED)
+            self.assertEqual(questions.getNumberOfRevisions(q), 2)
+
+    def test_rollbackToRevision_thenUpdate(self):
+        q, q2, q3 = self.createHistory()
+        rev = self.questions.getRevision('everything', 1)
+        self.questions.rollbackToRevision(rev, activate=True)
+        with self.questions['everything'].__im_update__() as q4:
+            q4.answer = 44
+        for reopen in (False, True):
+            questions = self.reopen() if reopen else self.questions
+            self.assertEqual(self.versions(q), [0, 1, 2])
+            self.assertEqual(questions['everything'].answer, 44)
+            self.assertEqual(
+                questions.getRevision('everything', 1).__im_state__,
+                interfaces.IM_STATE_RETIRED)
+
+    def test_rollbackToRevision_withoutActivate(self):
+        q, q2, q3 = self.createHistory()
+        rev = self.questions.getRevision('everything', 1)
+        self.questions.rollbackToRevision(rev, activate=False)
+        self.assertNotIn('everything', self.questions)
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 2)
+
+    def test_delitem(self):
+        q, q2, q3 = self.createHistory()
+        del self.questions['everything']
+        for reopen in (False, True):
+            questions = self.reopen() if reopen else self.questions
+            self.assertNotIn('everything', questions)
+            self.assertEqual(len(questions), 0)
+            with self.assertRaises(KeyError):
+                questions['everything']
+
+    def test_changeFeed(self):
+        self.questions.changeFeed = feed.ChangeFeed()
+        sub = self.questions.changeFeed.subscribe(feed.QueueSubscriber())
+        self.createHistory()
+        records = sub.getBatch()
+        self.assertEqual(
+            [(rec.name, rec.oldVersion, rec.newVersion, rec.creator)
+             for rec in records],
+            [('everything', None, 0, None),
+             ('everything', 0, 1, 'arthur'),
+             ('everything', 1, 2, 'ford')])
+        self.assertEqual(records[2].timestamp, datetime.datetime(2020, 1, 3))
+
+    def test_changeFeed_withConflict(self):
+        self.questions.changeFeed = feed.ChangeFeed()
+        sub = self.questions.changeFeed.subscribe(feed.QueueSubscriber())
+        q, q2, q3 = self.createHistory()
+        q4 = q2.__im_clone__()
+        q4.__im_version__ = 2
+        q4.__im_finalize__()
+        with self.assertRaises(revisioned.RevisionConflictError):
+            self.questions.addRevision(q4, old=q2)
+        self.assertEqual(len(sub.getBatch()), 3)
+
+    def test_changeFeed_withFailingSubscriber(self):
+        self.questions.changeFeed = feed.ChangeFeed()
+        self.questions.changeFeed.subscribe(
+            feed.QueueSubscriber(maxsize=1, timeout=0.01))
+        sub = self.questions.changeFeed.subscribe(feed.QueueSubscriber())
+        with self.assertLogs('shoobx.immutable.feed', 'ERROR') as logs:
+            self.createHistory()
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(self.questions['everything'].answer, 43)
+        self.assertEqual(len(sub.getBatch()), 3)
@@ -0,0 +1,320 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Revision Change Feed Tests."""
+import asyncio
+import datetime
+import mock
+import queue
+import threading
+import unittest
+from zope.interface import verify
+
+from shoobx.immutable import feed, interfaces, revisioned
+
+
+def createRecord(version):
+    return feed.ChangeRecord(
+        'doc', version - 1 if version else None, version, 'arthur',
+        datetime.datetime(2020, 1, 1))
+
+
+class ChangeFeedTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyObject(interfaces.IChangeFeed, feed.ChangeFeed()))
+
+    def test_publish(self):
+        changes = feed.ChangeFeed()
+        sub1 = changes.subscribe(feed.BatchSubscriber(list, batchSize=1))
+        sub2 = changes.subscribe(feed.QueueSubscriber())
+        self.assertEqual(changes.subscribers, (sub1, sub2))
+        changes.publish(createRecord(0))
+        self.assertEqual(sub2.getBatch(), [createRecord(0)])
+
+    def test_publish_withFailingSubscriber(self):
+        changes = feed.ChangeFeed()
+        sub1 = changes.subscribe(feed.BatchSubscriber(
+            mock.Mock(side_effect=RuntimeError), batchSize=1))
+        sub2 = changes.subscribe(feed.QueueSubscriber())
+        with self.assertLogs('shoobx.immutable.feed', 'ERROR') as logs:
+            changes.publish(createRecord(0))
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn(repr(sub1), logs.output[0])
+        # The other subscribers still receive the record.
+        self.assertEqual(sub2.getBatch(), [createRecord(0)])
+
+    def test_unsubscribe(self):
+        changes = feed.ChangeFeed()
+        sub = changes.subscribe(feed.QueueSubscriber())
+        changes.unsubscribe(sub)
+        self.assertEqual(changes.subscribers, ())
+        changes.publish(createRecord(0))
+        self.assertEqual(sub.getBatch(timeout=0), [])
+
+    def test_publishRevision(self):
+        changes = feed.ChangeFeed()
+        sub = changes.subscribe(feed.QueueSubscriber())
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        with rim.__im_update__(creator='arthur') as rim2:
+            pass
+        rim2.__name__ = 'doc'
+        rim2.__im_start_on__ = datetime.datetime(2020, 1, 1)
+        changes.publishRevision(rim2, rim)
+        self.assertEqual(sub.getBatch(), [createRecord(1)])
+
+    def test_manager(self):
+        changes = feed.ChangeFeed()
+        sub = changes.subscribe(feed.QueueSubscriber())
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.changeFeed = changes
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        with rim.__im_update__(creator='arthur') as rim2:
+            pass
+        records = sub.getBatch()
+        self.assertEqual(
+            [(rec.oldVersion, rec.newVersion, rec.creator)
+             for rec in records],
+            [(None, 0, None), (0, 1, 'arthur')])
+        self.assertEqual(records[1].timestamp, rim2.__im_start_on__)
+
+    def test_manager_withDeltas(self):
+        changes = feed.ChangeFeed()
+        sub = changes.subscribe(feed.QueueSubscriber())
+        rimm = revisioned.DeltaRevisionedImmutableManager()
+        rimm.changeFeed = changes
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        for idx in range(3):
+            with rim.__im_update__() as rim:
+                rim.count = idx
+        self.assertEqual(
+            [rec.newVersion for rec in sub.getBatch()], [0, 1, 2, 3])
+
+    def test_manager_withRebase(self):
+        changes = feed.ChangeFeed()
+        sub = changes.subscribe(feed.QueueSubscriber())
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.rebaseOnConflict = True
+        rimm.changeFeed = changes
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        with rim.__im_update__() as rim2:
+            rim2.title = 'Title'
+        rim3 = rim.__im_clone__()
+        rim3.__im_version__ = 1
+        rim3.body = 'Body'
+        rim3.__im_finalize__()
+        rimm.addRevision(rim3, old=rim)
+        self.assertEqual(
+            [(rec.oldVersion, rec.newVersion) for rec in sub.getBatch()],
+            [(None, 0), (0, 1), (1, 2)])
+
+    def test_manager_withConflict(self):
+        changes = feed.ChangeFeed()
+        sub = changes.subscribe(feed.QueueSubscriber())
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.changeFeed = changes
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        with rim.__im_update__():
+            pass
+        rim3 = rim.__im_clone__()
+        rim3.__im_finalize__()
+        with self.assertRaises(revisioned.RevisionConflictError):
+            rimm.addRevision(rim3, old=rim)
+        self.assertEqual(len(sub.getBatch()), 2)
+
+    def test_manager_withFullQueue(self):
+        changes = feed.ChangeFeed()
+        sub = changes.subscribe(feed.QueueSubscriber(maxsize=1, timeout=0.01))
+        other = changes.subscribe(feed.QueueSubscriber())
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.changeFeed = changes
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        # The revision is committed, even if a subscriber cannot take it.
+        with self.assertLogs('shoobx.immutable.feed', 'ERROR'):
+            with rim.__im_update__() as rim2:
+                pass
+        self.assertIs(rimm.getCurrentRevision(), rim2)
+        self.assertEqual([rec.newVersion for rec in sub.getBatch()], [0])
+        self.assertEqual(
+            [rec.newVersion for rec in other.getBatch()], [0, 1])
+
+    def test_manager_publishesWithoutLock(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager()
+        locked = []
+
+        def callback(records):
+            locked.append(rimm.__lock__._is_owned())
+
+        rimm.changeFeed = feed.ChangeFeed()
+        rimm.changeFeed.subscribe(feed.BatchSubscriber(callback, batchSize=1))
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        with rim.__im_update__():
+            pass
+        self.assertEqual(locked, [False, False])
+
+
+class BatchSubscriberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.sub = feed.BatchSubscriber(self.batches.append, batchSize=3)
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyObject(interfaces.IChangeFeedSubscriber, self.sub))
+
+    def test_receive(self):
+        for version in range(7):
+            self.sub.receive(createRecord(version))
+        self.assertEqual(
+            [[rec.newVersion for rec in batch] for batch in self.batches],
+            [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(len(self.sub.records), 1)
+
+    def test_flush(self):
+        self.sub.receive(createRecord(0))
+        self.sub.flush()
+        self.assertEqual(self.batches, [[createRecord(0)]])
+        self.sub.flush()
+        self.assertEqual(len(self.batches), 1)
+
+
+class QueueSubscriberTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyObject(
+                interfaces.IChangeFeedSubscriber, feed.QueueSubscriber()))
+
+    def test_getBatch(self):
+        sub = feed.QueueSubscriber()
+        for version in range(5):
+            sub.receive(createRecord(version))
+        self.assertEqual(
+            [rec.newVersion for rec in sub.getBatch(maxSize=3)], [0, 1, 2])
+        self.assertEqual([rec.newVersion for rec in sub.getBatch()], [3, 4])
+        self.assertEqual(sub.getBatch(timeout=0), [])
+
+    def test_receive_withFullQueue(self):
+        sub = feed.QueueSubscriber(maxsize=1, timeout=0)
+        sub.receive(createRecord(0))
+        with self.assertRaises(queue.Full):
+            sub.receive(createRecord(1))
+
+    def test_receive_withDropOverflow(self):
+        sub = feed.QueueSubscriber(
+            maxsize=1, timeout=0, overflow=feed.OVERFLOW_DROP)
+        sub.receive(createRecord(0))
+        sub.receive(createRecord(1))
+        self.assertEqual(sub.dropped, 1)
+        self.assertEqual(sub.getBatch(), [createRecord(0)])
+
+    def test_init_withUnknownOverflow(self):
+        with self.assertRaises(ValueError):
+            feed.QueueSubscriber(overflow='block')
+
+    def test_receive_withBackpressure(self):
+        sub = feed.QueueSubscriber(maxsize=2)
+
+        def write():
+            for version in range(10):
+                sub.receive(createRecord(version))
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        versions = []
+        while len(versions) < 10:
+            batch = sub.getBatch(timeout=5)
+            self.assertLessEqual(len(batch), 2)
+            versions += [rec.newVersion for rec in batch]
+        writer.join()
+        self.assertEqual(versions, list(range(10)))
+
+
+class AsyncQueueSubscriberTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+
+        async def main():
+            return feed.AsyncQueueSubscriber()
+
+        self.assertTrue(
+            verify.verifyObject(
+                interfaces.IChangeFeedSubscriber, asyncio.run(main())))
+
+    def test_init_withoutLoop(self):
+        with self.assertRaises(RuntimeError):
+            feed.AsyncQueueSubscriber()
+
+    def test_getBatch(self):
+
+        async def main():
+            sub = feed.AsyncQueueSubscriber()
+            for version in range(5):
+                sub.receive(createRecord(version))
+            return await sub.getBatch(maxSize=3), await sub.getBatch()
+
+        batch1, batch2 = asyncio.run(main())
+        self.assertEqual([rec.newVersion for rec in batch1], [0, 1, 2])
+        self.assertEqual([rec.newVersion for rec in batch2], [3, 4])
+
+    def test_receive_withFullQueue(self):
+
+        async def main():
+            sub = feed.AsyncQueueSubscriber(maxsize=1)
+            sub.receive(createRecord(0))
+            sub.receive(createRecord(1))
+
+        with self.assertRaises(asyncio.QueueFull):
+            asyncio.run(main())
+
+    def test_receive_withDropOverflow(self):
+
+        async def main():
+            sub = feed.AsyncQueueSubscriber(
+                maxsize=1, timeout=0.01, overflow=feed.OVERFLOW_DROP)
+            sub.receive(createRecord(0))
+            sub.receive(createRecord(1))
+            # Writers in other threads give up after the timeout.
+            await asyncio.get_running_loop().run_in_executor(
+                None, sub.receive, createRecord(2))
+            self.assertEqual(sub.dropped, 2)
+            return await sub.getBatch()
+
+        self.assertEqual(asyncio.run(main()), [createRecord(0)])
+
+    def test_receive_withBackpressure(self):
+
+        async def main():
+            sub = feed.AsyncQueueSubscriber(maxsize=2)
+
+            def write():
+                for version in range(10):
+                    sub.receive(createRecord(version))
+
+            writer = asyncio.get_running_loop().run_in_executor(None, write)
+            versions = []
+            while len(versions) < 10:
+                batch = await sub.getBatch()
+                self.assertLessEqual(len(batch), 2)
+                versions += [rec.newVersion for rec in batch]
+            await writer
+            return versions
+
+        self.assertEqual(asyncio.run(main()), list(range(10)))
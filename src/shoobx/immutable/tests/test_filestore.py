@@ -0,0 +1,273 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""File-backed Revisioned Immutable Container Tests."""
+import datetime
+import mock
+import os
+import shutil
+import time
+import unittest
+
+from shoobx.immutable import filestore, interfaces
+from shoobx.immutable.tests.container import ContainerTests, createQuestion
+
+
+class FileRevisionedImmutableContainerTest(ContainerTests, unittest.TestCase):
+
+    filename = 'questions.log'
+
+    def createContainer(self, path, **kw):
+        return filestore.FileRevisionedImmutableContainer(path, **kw)
+
+    def assertRevisionsEqual(self, revisions, expected):
+        self.assertEqual(len(revisions), len(expected))
+        for rev, orig in zip(revisions, expected):
+            self.assertIsNot(rev, orig)
+            self.assertEqual(rev.__class__, orig.__class__)
+            for name in ('question', 'answer', '__name__', '__im_version__',
+                         '__im_start_on__', '__im_end_on__',
+                         '__im_creator__', '__im_comment__', '__im_state__'):
+                self.assertEqual(getattr(rev, name), getattr(orig, name))
+
+    def test_update(self):
+        q, q2, q3 = self.createHistory()
+        self.assertIs(self.questions['everything'], q3)
+        self.assertIs(q2.__im_manager__, self.questions)
+        self.assertEqual(q2.__im_state__, interfaces.IM_STATE_RETIRED)
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 3)
+        self.assertIs(self.questions.getCurrentRevision(q), q3)
+        self.assertIs(self.questions.getRevision('everything', 1), q2)
+        self.assertIs(self.questions.getRevisionByVersion(1, q), q2)
+        with self.assertRaises(KeyError):
+            self.questions.getRevisionByVersion(3, q)
+        self.assertIs(
+            self.questions.getRevisionAt(datetime.datetime(2020, 1, 2), q),
+            q2)
+
+    def test_getRevisionHistory_keepsRevisions(self):
+        q, q2, q3 = self.createHistory()
+        self.assertListEqual(
+            list(self.questions.getRevisionHistory(q)), [q, q2, q3])
+        self.assertListEqual(
+            list(self.questions.getRevisionHistory(q, creator='arthur')),
+            [q2])
+        self.assertListEqual(
+            list(self.questions.getRevisionHistory(
+                q, reversed=True, batchSize=2)),
+            [q3, q2])
+
+    def test_delitem_keepsHistory(self):
+        q, q2, q3 = self.createHistory()
+        del self.questions['everything']
+        self.assertEqual(q3.__im_state__, interfaces.IM_STATE_DELETED)
+        self.assertNotIn('everything', self.questions)
+        questions = self.reopen()
+        self.assertNotIn('everything', questions)
+        self.assertEqual(len(questions), 0)
+        history = list(questions.getRevisionHistory(q))
+        self.assertEqual(history[-1].__im_state__, interfaces.IM_STATE_DELETED)
+        self.assertEqual(history[-1].__im_end_on__, q3.__im_end_on__)
+
+    def test_add_afterDelete(self):
+        q, q2, q3 = self.createHistory()
+        del self.questions['everything']
+        q4 = createQuestion('What is the new answer')
+        self.questions['everything'] = q4
+        # The versions continue, instead of replacing the first revisions.
+        self.assertEqual(q4.__im_version__, 3)
+        for reopen in (False, True):
+            questions = self.reopen() if reopen else self.questions
+            self.assertEqual(self.versions(q), [0, 1, 2, 3])
+            self.assertEqual(
+                questions.getRevision('everything', 0).question,
+                'What is the answer')
+            self.assertEqual(
+                questions['everything'].question, 'What is the new answer')
+
+    def test_open_withPartialRecord(self):
+        revisions = self.createHistory()
+        self.questions.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as file:
+            file.write(filestore.encodeRecord(('add', 'other'))[:-3])
+        questions = self.reopen()
+        self.assertRevisionsEqual(
+            list(questions.getRevisionHistory(revisions[0])), revisions)
+        # The partial record was discarded.
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_open_withCorruptRecord(self):
+        revisions = self.createHistory()
+        self.questions.close()
+        with open(self.path, 'r+b') as file:
+            file.seek(-1, os.SEEK_END)
+            file.write(b'\0')
+        questions = self.reopen()
+        # The last update is lost, so its previous revision is current.
+        history = list(questions.getRevisionHistory(revisions[0]))
+        self.assertRevisionsEqual(history[:1], revisions[:1])
+        self.assertEqual(len(history), 2)
+        self.assertIs(questions['everything'], history[1])
+        self.assertIsNone(history[1].__im_end_on__)
+
+    def test_open_withInvalidFile(self):
+        path = os.path.join(self.dir, 'other.log')
+        with open(path, 'wb') as file:
+            file.write(b'other')
+        with self.assertRaises(ValueError):
+            filestore.FileRevisionedImmutableContainer(path)
+
+    def test_sync(self):
+        self.reopen(syncBatch=2, syncDelay=60)
+        with mock.patch('os.fsync') as fsync:
+            q = createQuestion('What is the answer')
+            self.questions['everything'] = q
+            self.assertEqual(fsync.call_count, 0)
+            with q.__im_update__():
+                pass
+            self.assertEqual(fsync.call_count, 1)
+            self.questions['other'] = createQuestion('What is the question')
+            self.questions.sync()
+            self.assertEqual(fsync.call_count, 2)
+
+    def test_sync_withDelay(self):
+        self.reopen(syncBatch=100, syncDelay=0)
+        with mock.patch('os.fsync') as fsync:
+            self.questions['everything'] = createQuestion('What is it')
+            self.assertEqual(fsync.call_count, 1)
+
+    def test_sync_afterDelay(self):
+        self.reopen(syncBatch=100, syncDelay=60)
+        with mock.patch('threading.Timer') as timer, \
+                mock.patch('os.fsync') as fsync:
+            self.questions['everything'] = createQuestion('What is it')
+            self.questions['other'] = createQuestion('What is the question')
+            # One timer syncs all records pending after the delay.
+            timer.assert_called_once()
+            delay, flush = timer.call_args[0]
+            self.assertEqual(delay, 60)
+            self.assertEqual(fsync.call_count, 0)
+            flush()
+            self.assertEqual(fsync.call_count, 1)
+            # The next pending record starts a new timer, which is
+            # cancelled by syncing.
+            self.questions['third'] = createQuestion('What is the third')
+            self.assertEqual(timer.call_count, 2)
+            timer.return_value.cancel.reset_mock()
+            self.questions.sync()
+            timer.return_value.cancel.assert_called_once_with()
+            self.assertEqual(fsync.call_count, 2)
+
+    def test_sync_withTimer(self):
+        self.reopen(syncBatch=100, syncDelay=0.01)
+        self.questions['everything'] = createQuestion('What is it')
+        with mock.patch('os.fsync') as fsync:
+            self.questions['other'] = createQuestion('What is the question')
+            for idx in range(100):
+                if fsync.called:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(fsync.call_count, 1)
+
+    def test_snapshot(self):
+        self.reopen(snapshotInterval=2)
+        revisions = self.createHistory()
+        self.assertTrue(os.path.exists(self.questions.snapshotPath))
+        questions = self.reopen()
+        self.assertRevisionsEqual(
+            list(questions.getRevisionHistory(revisions[0])), revisions)
+
+    def test_snapshot_startsNewSegment(self):
+        self.createHistory()
+        self.questions.sync()
+        size = os.path.getsize(self.path)
+        self.questions.snapshot()
+        self.assertLess(os.path.getsize(self.path), size)
+        self.questions['other'] = createQuestion('What is the question')
+        questions = self.reopen()
+        self.assertEqual(len(questions), 2)
+
+    def test_open_withSnapshotAfterSegment(self):
+        revisions = self.createHistory()
+        self.questions.close()
+        shutil.copy(self.path, self.path + '.orig')
+        questions = self.reopen()
+        questions.snapshot()
+        questions.close()
+        # A crash before the new segment was started leaves the old one.
+        shutil.copy(self.path + '.orig', self.path)
+        questions = self.reopen()
+        self.assertRevisionsEqual(
+            list(questions.getRevisionHistory(revisions[0])), revisions)
+        self.assertLess(
+            os.path.getsize(self.path), os.path.getsize(self.path + '.orig'))
+
+    def test_snapshot_syncsDirectory(self):
+        self.createHistory()
+        calls = mock.Mock()
+        with mock.patch('os.replace', wraps=os.replace) as replace, \
+                mock.patch.object(
+                    filestore, 'syncDirectory',
+                    wraps=filestore.syncDirectory) as syncDirectory:
+            calls.attach_mock(replace, 'replace')
+            calls.attach_mock(syncDirectory, 'syncDirectory')
+            self.questions.snapshot()
+        # The snapshot is renamed durably before the log is replaced.
+        self.assertEqual(
+            [(name, args[-1]) for name, args, kw in calls.mock_calls],
+            [('replace', self.questions.snapshotPath),
+             ('syncDirectory', self.questions.snapshotPath),
+             ('replace', self.path),
+             ('syncDirectory', self.path)])
+
+    def test_snapshot_withMissingRename(self):
+        revisions = self.createHistory()
+        # A crash before the snapshot was renamed keeps the log.
+        with mock.patch('os.replace', side_effect=OSError('crash')):
+            with self.assertRaises(OSError):
+                self.questions.snapshot()
+        self.assertFalse(os.path.exists(self.questions.snapshotPath))
+        questions = self.reopen()
+        self.assertRevisionsEqual(
+            list(questions.getRevisionHistory(revisions[0])), revisions)
+        # The next snapshot overwrites the stale temporary file.
+        questions.snapshot()
+        questions = self.reopen()
+        self.assertRevisionsEqual(
+            list(questions.getRevisionHistory(revisions[0])), revisions)
+
+    def test_open_withSegmentWithoutSnapshot(self):
+        self.questions.snapshot()
+        self.questions.close()
+        os.remove(self.questions.snapshotPath)
+        with self.assertRaises(ValueError):
+            self.open()
+
+    def test_snapshot_replaysLaterRecords(self):
+        q, q2, q3 = self.createHistory()
+        self.questions.snapshot()
+        with q3.__im_update__() as q4:
+            q4.answer = 42
+        with mock.patch.object(
+                filestore.FileRevisionedImmutableContainer, 'replay',
+                side_effect=filestore.FileRevisionedImmutableContainer.replay,
+                autospec=True) as replay:
+            questions = self.reopen()
+        self.assertEqual(replay.call_count, 1)
+        self.assertRevisionsEqual(
+            list(questions.getRevisionHistory(q)), [q, q2, q3, q4])
+
+    def test_getRevisionStubs_loadsKeptRevision(self):
+        q, q2, q3 = self.createHistory()
+        stubs = list(self.questions.getRevisionStubs(q, creator='arthur'))
+        self.assertEqual(len(stubs), 1)
+        self.assertEqual(stubs[0].__name__, 'everything')
+        self.assertEqual(stubs[0].__im_version__, 1)
+        self.assertIs(stubs[0].__im_load__(), q2)
+        other = createQuestion('Who')
+        other.__name__ = 'other'
+        self.assertEqual(list(self.questions.getRevisionStubs(other)), [])
+
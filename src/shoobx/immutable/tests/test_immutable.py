@@ -5,8 +5,12 @@
 ###############################################################################
 """Immutable Objects Tests."""
 
+import asyncio
+import copy
 import datetime
+import gc
 import mock
+import pickle
 import unittest
 from enum import Enum
 from zope.interface import verify
@@ -35,6 +39,19 @@ class ImmutableHelpersTest(unittest.TestCase):
             im2.answer = 42
         self.assertIsNot(im, im2)
 
+    def test_aupdate(self):
+        with immutable.ImmutableBase.__im_create__() as factory:
+            im = factory()
+
+        async def update():
+            async with immutable.aupdate(im) as im2:
+                im2.answer = 42
+            return im2
+
+        im2 = asyncio.run(update())
+        self.assertIsNot(im, im2)
+        self.assertEqual(im2.answer, 42)
+
     def test_update_double(self):
         with immutable.ImmutableBase.__im_create__() as factory:
             im = factory()
@@ -69,6 +86,420 @@ class ImmutableHelpersTest(unittest.TestCase):
         with self.assertRaises(AttributeError):
             wrapper(im)
 
+    def test_isInternalAttr(self):
+
+        class Answer(immutable.Immutable):
+            __im_is_internal_attr__ = mock.Mock(return_value=True)
+
+        answer = Answer()
+        self.assertTrue(immutable.isInternalAttr(answer, 'answer'))
+        self.assertTrue(immutable.isInternalAttr(answer, 'answer'))
+        Answer.__im_is_internal_attr__.assert_called_once_with('answer')
+        self.assertEqual(Answer.__im_attr_routes__, {'answer': True})
+        self.assertNotIn('answer', immutable.Immutable.__im_attr_routes__)
+
+    def test_isInternalAttr_withLockedClass(self):
+
+        class Answers(immutable.ImmutableList):
+            pass
+
+        self.assertIs(
+            Answers.__im_locked_class__.__im_attr_routes__,
+            Answers.__im_attr_routes__)
+        self.assertIsNot(
+            Answers.__im_attr_routes__,
+            immutable.ImmutableList.__im_attr_routes__)
+
+    def test_lockedMutator(self):
+        mutator = immutable.lockedMutator('append')
+        self.assertEqual(mutator.__name__, 'append')
+        with self.assertRaises(AttributeError):
+            mutator(None, 42)
+
+    def test_createLockedClass(self):
+
+        class Answers(immutable.ImmutableList):
+            pass
+
+        locked = Answers.__im_locked_class__
+        self.assertTrue(issubclass(locked, Answers))
+        self.assertIs(locked.__im_transient_class__, Answers)
+        self.assertIs(Answers.__im_transient_class__, Answers)
+        self.assertEqual(locked.__name__, 'Answers')
+        self.assertEqual(locked.__im_state__, interfaces.IM_STATE_LOCKED)
+        with self.assertRaises(AttributeError):
+            locked.append(Answers(), 42)
+        # Instantiating the locked class results in a transient object.
+        answers = locked([42])
+        self.assertIs(answers.__class__, Answers)
+        self.assertEqual(answers.data, [42])
+
+    def test_createLockedClass_attributes(self):
+        with immutable.ImmutableList.__im_create__() as factory:
+            im_list = factory()
+        # Internal attributes can still be set on locked objects.
+        im_list.__name__ = 'answers'
+        self.assertEqual(im_list.__name__, 'answers')
+        with self.assertRaises(AttributeError):
+            im_list.answer = 42
+
+
+class Order(immutable.Immutable):
+
+    @immutable.im_cached_property
+    def total(self):
+        """Total of the order."""
+        self.__dict__['computed'].append('total')
+        return sum(self.items)
+
+    @immutable.im_memoize
+    def discounted(self, rate, rounded=False):
+        self.__dict__['computed'].append('discounted')
+        total = self.total * (1 - rate)
+        return round(total) if rounded else total
+
+
+class Row(immutable.ImmutableShapedDict):
+
+    @immutable.im_cached_property
+    def total(self):
+        return sum(self.values())
+
+
+class ImmutableCacheTest(unittest.TestCase):
+
+    def order(self, finalize=True):
+        with Order.__im_create__(finalize=finalize) as factory:
+            order = factory()
+            order.items = [10, 20]
+        order.__dict__['computed'] = []
+        return order
+
+    def test_im_cached_property(self):
+        self.assertIsInstance(Order.total, immutable.im_cached_property)
+        self.assertEqual(Order.total.__doc__, 'Total of the order.')
+        order = self.order()
+        self.assertEqual(order.total, 30)
+        self.assertEqual(order.total, 30)
+        self.assertEqual(order.computed, ['total'])
+        self.assertEqual(order.__im_cache__, {'total': 30})
+
+    def test_im_cached_property_withTransient(self):
+        order = self.order(finalize=False)
+        self.assertEqual(order.total, 30)
+        order.items.append(30)
+        self.assertEqual(order.total, 60)
+        self.assertEqual(order.computed, ['total', 'total'])
+        self.assertNotIn('__im_cache__', order.__dict__)
+
+    def test_im_memoize(self):
+        order = self.order()
+        self.assertEqual(order.discounted(0.5), 15)
+        self.assertEqual(order.discounted(0.5), 15)
+        self.assertEqual(order.discounted(0.6, rounded=True), 12)
+        self.assertEqual(order.discounted(0.6, rounded=True), 12)
+        self.assertEqual(
+            order.computed, ['discounted', 'total', 'discounted'])
+
+    def test_im_memoize_withUnhashableArgs(self):
+        order = self.order()
+        self.assertEqual(order.discounted(0.5, rounded=[]), 15)
+        self.assertEqual(order.discounted(0.5, rounded=[]), 15)
+        self.assertEqual(
+            order.computed, ['discounted', 'total', 'discounted'])
+
+    def test_im_memoize_withTransient(self):
+        order = self.order(finalize=False)
+        self.assertEqual(order.discounted(0.5), 15)
+        self.assertEqual(order.discounted(0.5), 15)
+        self.assertEqual(
+            order.computed,
+            ['discounted', 'total', 'discounted', 'total'])
+
+    def test_clone(self):
+        order = self.order()
+        order.total
+        with order.__im_update__() as order2:
+            self.assertNotIn('__im_cache__', order2.__dict__)
+            order2.items.append(30)
+        self.assertEqual(order2.total, 60)
+        self.assertEqual(order.total, 30)
+
+    def test_im_set_state(self):
+        order = self.order()
+        order.total
+        order.__im_set_state__(interfaces.IM_STATE_DELETED)
+        self.assertEqual(order.__im_cache__, {'total': 30})
+        order.__im_set_state__(interfaces.IM_STATE_TRANSIENT)
+        self.assertNotIn('__im_cache__', order.__dict__)
+
+    def test_pickle(self):
+        order = self.order()
+        order.total
+        state = order.__getstate__()
+        self.assertNotIn('__im_cache__', state)
+        self.assertIn('__im_cache__', order.__dict__)
+        order2 = pickle.loads(pickle.dumps(order))
+        self.assertNotIn('__im_cache__', order2.__dict__)
+        self.assertEqual(order2.total, 30)
+
+    def test_im_cached_property_withShapedDict(self):
+        with Row.__im_create__(finalize=False) as factory:
+            row = factory(one=1, two=2)
+        self.assertEqual(row.total, 3)
+        with self.assertRaises(AttributeError):
+            row.__im_cache__
+        row.__im_finalize__()
+        self.assertEqual(row.total, 3)
+        self.assertEqual(row.__im_cache__, {'total': 3})
+        with row.__im_update__() as row2:
+            row2['three'] = 3
+            with self.assertRaises(AttributeError):
+                row2.__im_cache__
+        self.assertEqual(row2.total, 6)
+        row2.__im_set_state__(interfaces.IM_STATE_TRANSIENT)
+        with self.assertRaises(AttributeError):
+            row2.__im_cache__
+        self.assertNotIn('__im_cache__', pickle.loads(pickle.dumps(row)))
+
+    def test_getCache_withoutSlot(self):
+
+        class Point(immutable.SlottedImmutableBase):
+            __slots__ = ('__im_state__', '__im_mode__')
+
+            @immutable.im_cached_property
+            def length(self):
+                return 0
+
+        point = Point()
+        point.__im_state__ = interfaces.IM_STATE_LOCKED
+        with self.assertRaises(TypeError):
+            point.length
+
+
+class ImmutableOriginTest(unittest.TestCase):
+
+    def doc(self):
+        with immutable.ImmutableDict.__im_create__() as factory:
+            return factory({'a': {'x': 1}, 'b': [1, 2], 'c': {3}})
+
+    def test_getOrigin(self):
+        doc = self.doc()
+        self.assertIsNone(immutable.getOrigin(doc))
+        with doc.__im_update__() as doc2:
+            self.assertIs(immutable.getOrigin(doc2), doc)
+            self.assertIs(immutable.getOrigin(doc2['a']), doc['a'])
+        self.assertIs(immutable.getOrigin(doc2), doc)
+        self.assertIs(immutable.getOrigin(doc2['b']), doc['b'])
+        # Unchanged clones of unchanged clones share the first origin.
+        with doc2.__im_update__() as doc3:
+            pass
+        self.assertIs(immutable.getOrigin(doc3), doc)
+        self.assertIs(immutable.getOrigin(doc3['c']), doc['c'])
+
+    def test_getOrigin_withTransient(self):
+        with immutable.ImmutableDict.__im_create__(finalize=False) as factory:
+            doc = factory()
+        self.assertIsNone(immutable.getOrigin(doc.__im_clone__()))
+
+    def test_getOrigin_withChangedSubObject(self):
+        doc = self.doc()
+        with doc.__im_update__() as doc2:
+            doc2['a']['x'] = 1
+        self.assertIsNone(immutable.getOrigin(doc2))
+        self.assertIsNone(immutable.getOrigin(doc2['a']))
+        self.assertIs(immutable.getOrigin(doc2['b']), doc['b'])
+        # Changed clones are the origin of their clones.
+        with doc2.__im_update__() as doc3:
+            pass
+        self.assertIs(immutable.getOrigin(doc3), doc2)
+        self.assertIs(immutable.getOrigin(doc3['b']), doc['b'])
+
+    def test_getOrigin_withMutators(self):
+        doc = self.doc()
+        mutations = [
+            ('b', lambda lst: lst.append(3)),
+            ('b', lambda lst: lst.pop()),
+            ('b', lambda lst: lst.remove(1)),
+            ('b', lambda lst: lst.insert(0, 0)),
+            ('b', lambda lst: lst.reverse()),
+            ('b', lambda lst: lst.sort()),
+            ('b', lambda lst: lst.clear()),
+            ('b', lambda lst: lst.__imul__(2)),
+            ('b', lambda lst: lst.__setitem__(0, 0)),
+            ('b', lambda lst: lst.__delitem__(0)),
+            ('c', lambda im_set: im_set.add(4)),
+            ('c', lambda im_set: im_set.discard(3)),
+            ('a', lambda dct: dct.pop('x')),
+            ('a', lambda dct: dct.clear()),
+            ('a', lambda dct: dct.update({'y': 2})),
+            ('a', lambda dct: dct.setdefault('y', 2)),
+        ]
+        for key, mutation in mutations:
+            with doc.__im_update__() as doc2:
+                mutation(doc2[key])
+            self.assertIsNone(immutable.getOrigin(doc2))
+            self.assertIsNone(immutable.getOrigin(doc2[key]))
+
+    def test_getOrigin_withAttributes(self):
+
+        class Person(immutable.Immutable):
+            pass
+
+        with Person.__im_create__() as factory:
+            person = factory()
+            person.name = 'Stephan'
+        with person.__im_update__() as person2:
+            pass
+        self.assertIs(immutable.getOrigin(person2), person)
+        with person.__im_update__() as person2:
+            person2.name = 'Stephan'
+        self.assertIsNone(immutable.getOrigin(person2))
+        with person.__im_update__() as person2:
+            del person2.name
+        self.assertIsNone(immutable.getOrigin(person2))
+
+    def test_getOrigin_withShapedDict(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            row = factory(one=1)
+        with row.__im_update__() as row2:
+            pass
+        self.assertIs(immutable.getOrigin(row2), row)
+        with row.__im_update__() as row2:
+            row2['one'] = 2
+        self.assertIsNone(immutable.getOrigin(row2))
+
+    def test_getOrigin_withCollectedOrigin(self):
+        doc = self.doc()
+        with doc.__im_update__() as doc2:
+            pass
+        del doc
+        gc.collect()
+        self.assertIsNone(immutable.getOrigin(doc2))
+        with doc2.__im_update__() as doc3:
+            pass
+        self.assertIs(immutable.getOrigin(doc3), doc2)
+
+    def test_pickle(self):
+        doc = self.doc()
+        with doc.__im_update__() as doc2:
+            pass
+        doc3 = pickle.loads(pickle.dumps(doc2))
+        self.assertIsNone(immutable.getOrigin(doc3))
+        self.assertIsNone(immutable.getOrigin(doc3['a']))
+
+
+class ImmutableChecksTest(unittest.TestCase):
+
+    def slave(self):
+        with immutable.ImmutableList.__im_create__(
+                mode=interfaces.IM_MODE_SLAVE) as factory:
+            return factory()
+
+    def test_checks(self):
+        self.assertEqual(
+            immutable.IMMUTABLE_CHECKS.mode, interfaces.IM_CHECKS_EAGER)
+        with immutable.checks(interfaces.IM_CHECKS_UNCHECKED) as checks:
+            self.assertEqual(checks.mode, interfaces.IM_CHECKS_UNCHECKED)
+            self.assertFalse(checks.eager)
+            with immutable.checks(interfaces.IM_CHECKS_STRICT):
+                self.assertEqual(checks.mode, interfaces.IM_CHECKS_STRICT)
+            self.assertEqual(checks.mode, interfaces.IM_CHECKS_UNCHECKED)
+        self.assertEqual(checks.mode, interfaces.IM_CHECKS_EAGER)
+        self.assertTrue(checks.eager)
+
+    def test_checks_withTasks(self):
+
+        async def unchecked(started, done):
+            with immutable.checks(interfaces.IM_CHECKS_UNCHECKED):
+                started.set()
+                await done.wait()
+                return immutable.IMMUTABLE_CHECKS.mode
+
+        async def main():
+            started, done = asyncio.Event(), asyncio.Event()
+            task = asyncio.create_task(unchecked(started, done))
+            await started.wait()
+            # The mode of the other task does not leak into this one.
+            mode = immutable.IMMUTABLE_CHECKS.mode
+            done.set()
+            return mode, await task
+
+        self.assertEqual(
+            asyncio.run(main()),
+            (interfaces.IM_CHECKS_EAGER, interfaces.IM_CHECKS_UNCHECKED))
+
+    def test_checks_withUnknownMode(self):
+        with self.assertRaises(AssertionError):
+            with immutable.checks('unknown'):
+                pass
+
+    def test_eager(self):
+        with self.assertRaises(AssertionError):
+            with immutable.ImmutableDict.__im_create__() as factory:
+                factory(answer=self.slave())
+
+    def test_unchecked(self):
+        slave = self.slave()
+        with immutable.checks(interfaces.IM_CHECKS_UNCHECKED):
+            with immutable.ImmutableDict.__im_create__() as factory:
+                dct = factory(answer=slave)
+        # The value was conformed into a transient clone anyways.
+        self.assertIsNot(dct['answer'], slave)
+        self.assertEqual(dct.__im_state__, interfaces.IM_STATE_LOCKED)
+
+    def test_unchecked_withImGet(self):
+
+        class Mutable:
+            def __im_get__(self, mode=None):
+                return 42
+
+        im = immutable.ImmutableBase()
+        with immutable.checks(interfaces.IM_CHECKS_UNCHECKED):
+            self.assertEqual(im.__im_conform__(Mutable()), 42)
+        with self.assertRaises(AssertionError):
+            im.__im_conform__(Mutable())
+
+    def test_strict(self):
+        with immutable.checks(interfaces.IM_CHECKS_STRICT):
+            with immutable.ImmutableDict.__im_create__() as factory:
+                dct = factory(answer=self.slave(), question={'a': [1]})
+            with dct.__im_update__() as dct2:
+                dct2['question']['a'].append(2)
+        self.assertEqual(dct2['question']['a'], [1, 2])
+
+    def test_strict_withSharedSubObject(self):
+        with immutable.checks(interfaces.IM_CHECKS_STRICT):
+            with self.assertRaises(ValueError) as cm:
+                with immutable.ImmutableList.__im_create__() as factory:
+                    im_list = factory([[1]])
+                    im_list.data.append(im_list[0])
+        self.assertEqual(cm.exception.args[0], 'Sub-object appears twice.')
+
+    def test_strict_withMutableValue(self):
+        with immutable.checks(interfaces.IM_CHECKS_STRICT):
+            with self.assertRaises(ValueError) as cm:
+                with immutable.ImmutableSet.__im_create__() as factory:
+                    im_set = factory()
+                    im_set.__data__.add(frozenset())
+        self.assertEqual(cm.exception.args[0], 'Value is not immutable.')
+
+    def test_strict_withMasterSubObject(self):
+        with immutable.checks(interfaces.IM_CHECKS_STRICT):
+            with self.assertRaises(ValueError) as cm:
+                with immutable.ImmutableBase.__im_create__() as factory:
+                    im = factory()
+                    im.__dict__['answer'] = immutable.ImmutableList()
+        self.assertEqual(cm.exception.args[0], 'Sub-object is not a slave.')
+
+    def test_strict_withLockedSubObject(self):
+        with immutable.checks(interfaces.IM_CHECKS_STRICT):
+            with self.assertRaises(ValueError) as cm:
+                with immutable.ImmutableDict.__im_create__() as factory:
+                    dct = factory()
+                    dct.data['answer'] = self.slave()
+        self.assertEqual(cm.exception.args[0], 'Sub-object is not transient.')
+
 
 class ImmutableBaseTest(unittest.TestCase):
 
@@ -204,6 +635,32 @@ class ImmutableBaseTest(unittest.TestCase):
         self.assertIsNot(im.answer, im2.answer)
         self.assertEqual(im2.answer.__im_state__, interfaces.IM_STATE_TRANSIENT)
 
+    def test_copy(self):
+        with immutable.create(immutable.ImmutableBase) as factory:
+            im = factory()
+        self.assertIs(copy.copy(im), im)
+        self.assertIs(copy.deepcopy(im), im)
+        self.assertIs(copy.deepcopy([im])[0], im)
+
+    def test_copy_withTransient(self):
+        with immutable.create(
+                immutable.ImmutableBase, finalize=False) as factory:
+            im = factory()
+            im.answer = {'question': [42]}
+        for im2 in (copy.copy(im), copy.deepcopy(im)):
+            self.assertIsNot(im2, im)
+            self.assertEqual(im2.__im_state__, interfaces.IM_STATE_TRANSIENT)
+            self.assertIsNot(im2.answer, im.answer)
+            self.assertIsNot(im2.answer['question'], im.answer['question'])
+
+    def test_copy_withSlave(self):
+        with immutable.ImmutableDict.__im_create__(finalize=False) as factory:
+            dct = factory(answer=[42])
+        im_list = copy.copy(dct['answer'])
+        self.assertEqual(im_list.__im_mode__, interfaces.IM_MODE_MASTER)
+        self.assertEqual(
+            dct['answer'].__im_mode__, interfaces.IM_MODE_SLAVE)
+
     def test_im_finalize(self):
         with immutable.ImmutableBase.__im_create__(finalize=False) as factory:
             im = factory()
@@ -308,6 +765,33 @@ class ImmutableBaseTest(unittest.TestCase):
         self.assertEqual(im2.answer, 42)
         self.assertEqual(im2.__im_state__, interfaces.IM_STATE_LOCKED)
 
+    def test_im_aupdate(self):
+        with immutable.ImmutableBase.__im_create__() as factory:
+            im = factory()
+        hook = mock.Mock()
+        im.__dict__['__im_after_update__'] = hook
+
+        async def update():
+            async with im.__im_aupdate__() as im2:
+                im2.answer = 42
+            return im2
+
+        im2 = asyncio.run(update())
+        self.assertIsNot(im, im2)
+        self.assertEqual(im2.answer, 42)
+        self.assertEqual(im2.__im_state__, interfaces.IM_STATE_LOCKED)
+        hook.assert_called_once_with(im2)
+
+    def test_im_aupdate_withTransientImmutable(self):
+        with immutable.ImmutableBase.__im_create__(finalize=False) as factory:
+            im = factory()
+
+        async def update():
+            async with im.__im_aupdate__() as im2:
+                return im2
+
+        self.assertIs(asyncio.run(update()), im)
+
     def test_im_update_withTransientImmutable(self):
         with immutable.ImmutableBase.__im_create__(finalize=False) as factory:
             im = factory()
@@ -554,6 +1038,27 @@ class ImmutableDictTest(unittest.TestCase):
         self.assertEqual(
             im_dct.__im_state__, interfaces.IM_STATE_TRANSIENT)
 
+    def test_clone_withTransientValue(self):
+        with immutable.ImmutableDict.__im_create__(finalize=False) as factory:
+            im_dct = factory({'question': {'answer': 42}})
+        im_dct2 = im_dct.__im_clone__()
+        self.assertIsNot(im_dct2['question'], im_dct['question'])
+        self.assertEqual(
+            im_dct2['question'].__im_mode__, interfaces.IM_MODE_SLAVE)
+        im_dct2['question']['answer'] = 41
+        self.assertEqual(im_dct['question']['answer'], 42)
+
+    def test_deepcopy(self):
+        with immutable.ImmutableDict.__im_create__() as factory:
+            im_dct = factory({'question': {'answer': [42]}})
+        self.assertIs(copy.deepcopy(im_dct), im_dct)
+        with im_dct.__im_update__() as im_dct2:
+            im_dct3 = copy.deepcopy(im_dct2)
+            self.assertIsInstance(im_dct3, immutable.ImmutableDict)
+            self.assertEqual(im_dct3, im_dct2)
+            self.assertIsNot(
+                im_dct3['question']['answer'], im_dct2['question']['answer'])
+
     def test_im_set_state(self):
         with immutable.ImmutableDict.__im_create__(finalize=False) as factory:
             im_dct = factory({'one': 1})
@@ -764,6 +1269,222 @@ class ImmutableDictTest(unittest.TestCase):
         dct.__setstate__({'answer': 42})
         self.assertDictEqual(dict(dct), {'answer': 42})
 
+    def test_ior(self):
+        with immutable.ImmutableDict.__im_create__() as factory:
+            dct = factory(answer=41)
+        with dct.__im_update__() as dct2:
+            dct2 |= {'answer': 42, 'question': ['What?']}
+        self.assertEqual(dct2['answer'], 42)
+        self.assertIsInstance(dct2['question'], immutable.ImmutableList)
+
+        with self.assertRaises(AttributeError):
+            dct |= {'answer': 43}
+        self.assertEqual(dct['answer'], 41)
+
+    def test_stateClass(self):
+        with immutable.ImmutableDict.__im_create__(finalize=False) as factory:
+            dct = factory({'question': {'answer': 42}})
+        self.assertIs(dct.__class__, immutable.ImmutableDict)
+        dct.__im_finalize__()
+        self.assertIs(
+            dct.__class__, immutable.ImmutableDict.__im_locked_class__)
+        self.assertIs(
+            dct['question'].__class__,
+            immutable.ImmutableDict.__im_locked_class__)
+        self.assertIsInstance(dct, immutable.ImmutableDict)
+        clone = dct.__im_clone__()
+        self.assertIs(clone.__class__, immutable.ImmutableDict)
+        self.assertIs(clone['question'].__class__, immutable.ImmutableDict)
+
+    def test_pickle(self):
+        with immutable.ImmutableDict.__im_create__() as factory:
+            dct = factory({'question': {'answer': 42}})
+        dct2 = pickle.loads(pickle.dumps(dct))
+        self.assertEqual(dct2, dct)
+        self.assertEqual(dct2.__im_state__, interfaces.IM_STATE_LOCKED)
+        with self.assertRaises(AttributeError):
+            dct2['answer'] = 42
+
+
+class ImmutableShapedDictTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyClass(
+                interfaces.IImmutable, immutable.ImmutableShapedDict))
+
+    def test_init(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory({'one': 1}, two=2)
+        self.assertDictEqual(dict(dct), {'one': 1, 'two': 2})
+        self.assertEqual(dct.__im_shape__.keys, ('one', 'two'))
+        self.assertEqual(dct.__im_values__, (1, 2))
+        self.assertEqual(dct.__im_state__, interfaces.IM_STATE_LOCKED)
+
+    def test_sharedShape(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            row1 = factory({'id': 1, 'name': 'Arthur'})
+            row2 = factory({'id': 2, 'name': 'Ford'})
+        self.assertIs(row1.__im_shape__, row2.__im_shape__)
+        self.assertIs(
+            row1.__im_shape__, immutable.getDictShape(('id', 'name')))
+
+    def test_clone(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory({'question': {'answer': 42}})
+        clone = dct.__im_clone__()
+        self.assertIs(clone.__im_shape__, dct.__im_shape__)
+        self.assertIsNot(clone['question'], dct['question'])
+        self.assertEqual(
+            clone['question'].__im_mode__, interfaces.IM_MODE_SLAVE)
+        self.assertEqual(clone.__im_state__, interfaces.IM_STATE_TRANSIENT)
+
+    def test_im_set_state_withImmutableValue(self):
+        with immutable.ImmutableShapedDict.__im_create__(
+                finalize=False) as factory:
+            dct = factory({'question': {'answer': 42}})
+        self.assertIsInstance(dct.__im_values__, list)
+        dct.__im_set_state__(interfaces.IM_STATE_LOCKED)
+        self.assertIsInstance(dct.__im_values__, tuple)
+        self.assertEqual(
+            dct['question'].__im_state__, interfaces.IM_STATE_LOCKED)
+
+    def test_setitem(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=41)
+        with dct.__im_update__() as dct2:
+            dct2['answer'] = 42
+        # Updating an existing key keeps the shape.
+        self.assertIs(dct2.__im_shape__, dct.__im_shape__)
+        self.assertEqual(dct2['answer'], 42)
+        self.assertEqual(dct['answer'], 41)
+
+        with self.assertRaises(AttributeError):
+            dct['answer'] = 42
+
+    def test_setitem_newKey(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=42)
+        with dct.__im_update__() as dct2:
+            dct2['question'] = 'What?'
+        self.assertEqual(dct2.__im_shape__.keys, ('answer', 'question'))
+        self.assertEqual(dct.__im_shape__.keys, ('answer',))
+
+    def test_setitem_withImmutableSlave(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory()
+        with dct.__im_update__() as dct2:
+            with immutable.ImmutableBase.__im_create__(
+                    mode=interfaces.IM_MODE_SLAVE) as factory:
+                item = factory()
+            with self.assertRaises(AssertionError):
+                dct2['answer'] = item
+
+    def test_delitem(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(one=1, two=2, three=3)
+        with dct.__im_update__() as dct2:
+            del dct2['two']
+        self.assertDictEqual(dict(dct2), {'one': 1, 'three': 3})
+        self.assertEqual(dct2.__im_shape__.keys, ('one', 'three'))
+        self.assertEqual(len(dct), 3)
+
+        with self.assertRaises(KeyError):
+            with dct.__im_update__() as dct3:
+                del dct3['four']
+
+        with self.assertRaises(AttributeError):
+            del dct['one']
+
+    def test_getitem_unknownKey(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory()
+        with self.assertRaises(KeyError):
+            dct['answer']
+
+    def test_mappingApi(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(one=1, two=2)
+        self.assertEqual(len(dct), 2)
+        self.assertIn('one', dct)
+        self.assertNotIn('three', dct)
+        self.assertEqual(list(dct), ['one', 'two'])
+        self.assertEqual(list(dct.values()), [1, 2])
+        self.assertEqual(dct.get('three', 3), 3)
+        self.assertEqual(dct, {'one': 1, 'two': 2})
+
+    def test_update(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(one=1)
+        with dct.__im_update__() as dct2:
+            dct2.update({'one': 11, 'two': 2})
+            self.assertEqual(dct2.pop('one'), 11)
+        self.assertDictEqual(dict(dct2), {'two': 2})
+
+        with self.assertRaises(AttributeError):
+            dct.update({'one': 2})
+
+    def test_copy(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=42)
+        dct_copy = dct.copy()
+        self.assertIsNot(dct_copy, dct)
+        self.assertIs(dct_copy.__im_values__, dct.__im_values__)
+        self.assertEqual(dct_copy.__im_state__, interfaces.IM_STATE_LOCKED)
+
+        with dct.__im_update__() as dct2:
+            with self.assertRaises(AssertionError):
+                dct2.copy()
+
+    def test_clear(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=42)
+        with dct.__im_update__() as dct2:
+            dct2.clear()
+        self.assertEqual(len(dct2), 0)
+        self.assertEqual(len(dct), 1)
+
+        with self.assertRaises(AttributeError):
+            dct.clear()
+
+    def test_getstate(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=42)
+        self.assertDictEqual(dct.__getstate__(), {'answer': 42})
+
+    def test_setstate(self):
+        dct = immutable.ImmutableShapedDict.__new__(
+            immutable.ImmutableShapedDict)
+        dct.__setstate__({'answer': 42})
+        self.assertDictEqual(dict(dct), {'answer': 42})
+        self.assertEqual(dct.__im_state__, interfaces.IM_STATE_TRANSIENT)
+        self.assertEqual(dct.__im_mode__, interfaces.IM_MODE_MASTER)
+        self.assertIsInstance(dct.__im_values__, list)
+
+    def test_slots(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=42)
+        self.assertFalse(hasattr(dct, '__dict__'))
+        with self.assertRaises(AttributeError):
+            dct.__answer__ = 42
+
+    def test_pickle(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=42, question={'text': 'What?'})
+        dct2 = pickle.loads(pickle.dumps(dct))
+        self.assertDictEqual(
+            dict(dct2), {'answer': 42, 'question': {'text': 'What?'}})
+        self.assertIs(dct2.__im_shape__, dct.__im_shape__)
+        self.assertEqual(dct2.__im_state__, interfaces.IM_STATE_LOCKED)
+        self.assertIsInstance(dct2.__im_values__, tuple)
+        with self.assertRaises(AttributeError):
+            dct2['answer'] = 43
+
+    def test_repr(self):
+        with immutable.ImmutableShapedDict.__im_create__() as factory:
+            dct = factory(answer=42)
+        self.assertEqual(repr(dct), "{'answer': 42}")
+
 
 class ImmutableSetTest(unittest.TestCase):
 
@@ -972,6 +1693,59 @@ class ImmutableSetTest(unittest.TestCase):
             im_set = factory({42})
         self.assertEqual(repr(im_set), '{42}')
 
+    def test_copy(self):
+        with immutable.ImmutableSet.__im_create__() as factory:
+            im_set = factory({42})
+        im_set_copy = im_set.copy()
+        self.assertIsNot(im_set_copy.__data__, im_set.__data__)
+        self.assertSetEqual(im_set_copy.__data__, {42})
+        self.assertEqual(
+            im_set_copy.__im_state__, interfaces.IM_STATE_LOCKED)
+
+        with im_set.__im_update__() as im_set2:
+            with self.assertRaises(AssertionError):
+                im_set2.copy()
+
+
+class CompactImmutableSet(immutable.ImmutableSet):
+    __im_compact__ = True
+
+
+class CompactImmutableSetTest(unittest.TestCase):
+
+    def test_finalize(self):
+        with CompactImmutableSet.__im_create__() as factory:
+            im_set = factory({42})
+        self.assertIsInstance(im_set.__data__, frozenset)
+        self.assertIn(42, im_set)
+        self.assertEqual(list(im_set), [42])
+        self.assertEqual(hash(im_set), hash(frozenset({42})))
+        self.assertEqual(repr(im_set), '{42}')
+
+    def test_transient(self):
+        with CompactImmutableSet.__im_create__(finalize=False) as factory:
+            im_set = factory({42})
+        self.assertIsInstance(im_set.__data__, set)
+        im_set.__im_set_state__(interfaces.IM_STATE_LOCKED)
+        im_set.__im_set_state__(interfaces.IM_STATE_TRANSIENT)
+        self.assertIsInstance(im_set.__data__, set)
+        im_set.add(43)
+        self.assertSetEqual(set(im_set), {42, 43})
+
+    def test_update(self):
+        with CompactImmutableSet.__im_create__() as factory:
+            im_set = factory({42})
+        with im_set.__im_update__() as im_set2:
+            im_set2.add(43)
+        self.assertEqual(im_set.__data__, frozenset({42}))
+        self.assertEqual(im_set2.__data__, frozenset({42, 43}))
+
+    def test_copy(self):
+        with CompactImmutableSet.__im_create__() as factory:
+            im_set = factory({42})
+        im_set_copy = im_set.copy()
+        self.assertIs(im_set_copy.__data__, im_set.__data__)
+
 
 class ImmutableListTest(unittest.TestCase):
 
@@ -1295,3 +2069,121 @@ class ImmutableListTest(unittest.TestCase):
 
         with self.assertRaises(AttributeError):
             im_list.sort()
+
+    def test_iter(self):
+        with immutable.ImmutableList.__im_create__() as factory:
+            im_list = factory([41, 42])
+        self.assertEqual(list(iter(im_list)), [41, 42])
+
+    def test_deepcopy(self):
+        with immutable.ImmutableList.__im_create__() as factory:
+            im_list = factory([[42]])
+        self.assertIs(copy.copy(im_list), im_list)
+        self.assertIs(copy.deepcopy(im_list), im_list)
+        im_list2 = copy.deepcopy(im_list.__im_clone__())
+        self.assertEqual(im_list2, im_list)
+        self.assertEqual(im_list2.__im_state__, interfaces.IM_STATE_TRANSIENT)
+
+    def test_getitem_slice(self):
+        with immutable.ImmutableList.__im_create__() as factory:
+            im_list = factory([41, 42])
+        im_slice = im_list[1:]
+        self.assertListEqual(im_slice.data, [42])
+        self.assertEqual(im_slice.__im_state__, interfaces.IM_STATE_TRANSIENT)
+        im_slice.append(43)
+        self.assertListEqual(im_slice.data, [42, 43])
+
+    def test_pickle(self):
+        with immutable.ImmutableList.__im_create__() as factory:
+            im_list = factory([41, [42]])
+        im_list2 = pickle.loads(pickle.dumps(im_list))
+        self.assertEqual(im_list2, im_list)
+        self.assertEqual(im_list2.__im_state__, interfaces.IM_STATE_LOCKED)
+        with self.assertRaises(AttributeError):
+            im_list2.append(43)
+
+    def test_setstate(self):
+        im_list = immutable.ImmutableList.__new__(immutable.ImmutableList)
+        im_list.__setstate__(
+            {'data': [42], '__im_state__': interfaces.IM_STATE_LOCKED})
+        self.assertIs(
+            im_list.__class__, immutable.ImmutableList.__im_locked_class__)
+        with self.assertRaises(AttributeError):
+            im_list.append(43)
+
+    def test_radd(self):
+        im_list = [40] + immutable.ImmutableList([41, 42])
+        self.assertIsInstance(im_list, immutable.ImmutableList)
+        self.assertListEqual(im_list.data, [40, 41, 42])
+
+
+class CompactImmutableList(immutable.ImmutableList):
+    __im_compact__ = True
+
+
+class CompactImmutableListTest(unittest.TestCase):
+
+    def test_finalize(self):
+        with CompactImmutableList.__im_create__() as factory:
+            im_list = factory([41, 42])
+        self.assertEqual(im_list.data, (41, 42))
+        self.assertIn(42, im_list)
+        self.assertEqual(list(im_list), [41, 42])
+        self.assertEqual(im_list[1:], [42])
+        self.assertEqual(repr(im_list), '[41, 42]')
+
+    def test_transient(self):
+        with CompactImmutableList.__im_create__(finalize=False) as factory:
+            im_list = factory([41])
+        self.assertIsInstance(im_list.data, list)
+        im_list.__im_set_state__(interfaces.IM_STATE_LOCKED)
+        im_list.__im_set_state__(interfaces.IM_STATE_TRANSIENT)
+        self.assertIsInstance(im_list.data, list)
+        im_list.append(42)
+        self.assertListEqual(im_list.data, [41, 42])
+
+    def test_update(self):
+        with CompactImmutableList.__im_create__() as factory:
+            im_list = factory([41])
+        with im_list.__im_update__() as im_list2:
+            im_list2.append(42)
+        self.assertEqual(im_list.data, (41,))
+        self.assertEqual(im_list2.data, (41, 42))
+
+    def test_compare(self):
+        with CompactImmutableList.__im_create__() as factory:
+            im_list = factory([41, 42])
+        self.assertEqual(im_list, [41, 42])
+        self.assertEqual(im_list, immutable.ImmutableList([41, 42]))
+        self.assertEqual(immutable.ImmutableList([41, 42]), im_list)
+        self.assertNotEqual(im_list, (41, 42))
+        self.assertLess(im_list, [43])
+        self.assertLessEqual(im_list, [41, 42])
+        self.assertGreater(im_list, [40])
+        self.assertGreaterEqual(im_list, [41, 42])
+
+    def test_compare_withCompactList(self):
+        with CompactImmutableList.__im_create__() as factory:
+            im_list = factory([41, 42])
+            im_list2 = factory([41, 43])
+        # The compacted data is compared as it is.
+        with mock.patch.object(
+                CompactImmutableList, '_ImmutableList__data') as data:
+            self.assertEqual(im_list, im_list.copy())
+            self.assertLess(im_list, im_list2)
+            self.assertLessEqual(im_list, im_list2)
+            self.assertGreater(im_list2, im_list)
+            self.assertGreaterEqual(im_list2, im_list)
+        self.assertEqual(data.call_count, 0)
+
+    def test_add(self):
+        with CompactImmutableList.__im_create__() as factory:
+            im_list = factory([41])
+        self.assertListEqual((im_list + [42]).data, [41, 42])
+        self.assertListEqual(([40] + im_list).data, [40, 41])
+
+    def test_copy(self):
+        with CompactImmutableList.__im_create__() as factory:
+            im_list = factory([41, 42])
+        im_list_copy = im_list.copy()
+        self.assertIs(im_list_copy.data, im_list.data)
@@ -0,0 +1,132 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Memoization Tests."""
+import gc
+import unittest
+
+from shoobx.immutable import immutable, memoize
+
+
+def createDict(**kw):
+    with immutable.ImmutableDict.__im_create__() as factory:
+        return factory(kw)
+
+
+class LRUMemoizedFunctionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        @memoize.lruMemoize(maxsize=2)
+        def total(dct, factor=1):
+            """Total of all values."""
+            self.calls.append(dct)
+            return sum(dct.values()) * factor
+
+        self.total = total
+
+    def test_wrapper(self):
+        self.assertIsInstance(self.total, memoize.LRUMemoizedFunction)
+        self.assertEqual(self.total.__name__, 'total')
+        self.assertEqual(self.total.__doc__, 'Total of all values.')
+
+    def test_call(self):
+        dct = createDict(one=1, two=2)
+        self.assertEqual(self.total(dct), 3)
+        self.assertEqual(self.total(dct), 3)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.total.cacheInfo(), (1, 1, 2, 1))
+
+    def test_call_withEqualDicts(self):
+        # Keys are based on identity, not on the content.
+        dct = createDict(one=1)
+        dct2 = createDict(one=1)
+        self.assertEqual(self.total(dct), 1)
+        self.assertEqual(self.total(dct2), 1)
+        self.assertEqual(self.total.cacheInfo(), (0, 2, 2, 2))
+
+    def test_call_withKeywords(self):
+        dct = createDict(one=1)
+        self.assertEqual(self.total(dct, factor=2), 2)
+        self.assertEqual(self.total(dct, factor=2), 2)
+        self.assertEqual(self.total(dct, factor=3), 3)
+        self.assertEqual(self.total.cacheInfo(), (1, 2, 2, 2))
+
+    def test_call_withTransient(self):
+        with immutable.ImmutableDict.__im_create__(finalize=False) as factory:
+            dct = factory(one=1)
+        self.assertEqual(self.total(dct), 1)
+        dct['two'] = 2
+        self.assertEqual(self.total(dct), 3)
+        self.assertEqual(self.total.cacheInfo(), (0, 0, 2, 0))
+
+    def test_call_withUnhashable(self):
+        self.assertEqual(self.total({'one': 1}), 1)
+        self.assertEqual(self.total({'one': 1}), 1)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.total.cacheInfo(), (0, 0, 2, 0))
+
+    def test_lru(self):
+        dct1 = createDict(one=1)
+        dct2 = createDict(two=2)
+        dct3 = createDict(three=3)
+        self.total(dct1)
+        self.total(dct2)
+        # Use the first dict, so that the second one gets evicted.
+        self.total(dct1)
+        self.total(dct3)
+        self.assertEqual(self.total.cacheInfo(), (1, 3, 2, 2))
+        self.assertNotIn(id(dct2), self.total.refs)
+        self.total(dct1)
+        self.total(dct2)
+        self.assertEqual(self.total.cacheInfo(), (2, 4, 2, 2))
+
+    def test_gc(self):
+        dct = createDict(one=1)
+        self.total(dct)
+        self.assertEqual(self.total.cacheInfo().currsize, 1)
+        del dct
+        del self.calls[:]
+        gc.collect()
+        self.assertEqual(self.total.cacheInfo().currsize, 0)
+        self.assertEqual(self.total.refs, {})
+
+    def test_gc_withMultipleImmutables(self):
+
+        @memoize.lruMemoize()
+        def merge(dct1, dct2):
+            return {**dct1, **dct2}
+
+        dct1 = createDict(one=1)
+        dct2 = createDict(two=2)
+        merge(dct1, dct2)
+        del dct2
+        gc.collect()
+        self.assertEqual(merge.cacheInfo().currsize, 0)
+        self.assertEqual(merge.refs, {})
+
+    def test_cacheClear(self):
+        dct = createDict(one=1)
+        self.total(dct)
+        self.total(dct)
+        self.total.cacheClear()
+        self.assertEqual(self.total.cacheInfo(), (0, 0, 2, 0))
+        self.assertEqual(self.total.refs, {})
+
+    def test_method(self):
+
+        class Rules:
+
+            @memoize.lruMemoize(maxsize=None)
+            def apply(self, dct):
+                return dict(dct)
+
+        rules = Rules()
+        dct = createDict(one=1)
+        self.assertEqual(rules.apply(dct), {'one': 1})
+        self.assertEqual(rules.apply(dct), {'one': 1})
+        self.assertIsInstance(Rules.apply, memoize.LRUMemoizedFunction)
+        self.assertEqual(Rules.apply.cacheInfo(), (1, 1, None, 1))
@@ -5,8 +5,10 @@
 ###############################################################################
 """shoobx.app revisioned immutables.
 """
+import asyncio
 import datetime
 import mock
+import pickle
 import pjpersist.interfaces as pjinterfaces
 import pjpersist.sqlbuilder as sb
 import psycopg2
@@ -18,7 +20,8 @@ import zope.schema
 from pjpersist import datamanager, serialize, testing
 from zope.interface import verify
 
-from shoobx.immutable import pjpersist, immutable, interfaces
+from shoobx.immutable import pjpersist, immutable, interfaces, retention
+from shoobx.immutable import feed, revisioned
 
 
 class IQuestion(zope.interface.Interface):
@@ -168,6 +171,12 @@ class ImmutableTest(unittest.TestCase):
                 'answer': 42,
             })
 
+    def test_getstate_withCache(self):
+        with pjpersist.Immutable.__im_create__() as factory:
+            im = factory()
+        immutable.getCache(im)['answer'] = 42
+        self.assertNotIn('__im_cache__', im.__getstate__())
+
     def test_setstate(self):
         with pjpersist.Immutable.__im_create__(finalize=False) as factory:
             im = factory()
@@ -216,6 +225,50 @@ class ImmutableContainerTest(unittest.TestCase):
     def test_p_pj_table(self):
         self.assertEqual(self.cont._p_pj_table, 'table')
 
+    def test_getIndexStatements(self):
+        statements = pjpersist.getIndexStatements('questions')
+        self.assertEqual(len(statements), 3)
+        self.assertIn(
+            'ALTER TABLE questions ADD CONSTRAINT questions_name_current\n'
+            '                EXCLUDE USING btree (name WITH =) '
+            'WHERE (endOn IS NULL)\n'
+            '                DEFERRABLE INITIALLY DEFERRED;',
+            statements[0])
+        self.assertEqual(
+            statements[1:],
+            ['CREATE INDEX IF NOT EXISTS questions_name_version '
+             'ON questions (name, version)',
+             'CREATE INDEX IF NOT EXISTS questions_name_startOn '
+             'ON questions (name, startOn)'])
+
+    def test_getIndexStatements_withTrigram(self):
+        statements = pjpersist.getIndexStatements('questions', trigram=True)
+        self.assertEqual(
+            statements[3:],
+            ['CREATE EXTENSION IF NOT EXISTS pg_trgm',
+             'CREATE INDEX IF NOT EXISTS questions_comment_trgm '
+             'ON questions USING GIN (comment gin_trgm_ops)'])
+
+    def test_getIndexStatements_withFactory(self):
+
+        class Named(pjpersist.Immutable):
+            _pj_name = 'key'
+            _pj_column_fields = (
+                (zope.schema.TextLine(__name__='key'),) +
+                pjpersist.Immutable._pj_column_fields[1:])
+
+        statements = pjpersist.getIndexStatements('named', factory=Named)
+        self.assertIn('EXCLUDE USING btree (key WITH =)', statements[0])
+        self.assertIn('ON named (key, version)', statements[1])
+
+    def test_getIndexStatements_withMissingColumn(self):
+
+        class Unversioned(pjpersist.Immutable):
+            _pj_column_fields = pjpersist.Immutable._pj_column_fields[:1]
+
+        with self.assertRaises(AssertionError):
+            pjpersist.getIndexStatements('questions', factory=Unversioned)
+
     def test_pj_get_resolve_filter(self):
         flt = self.cont._pj_get_resolve_filter()
         self.assertEqual(
@@ -315,6 +368,36 @@ class ImmutableDatabaseTest(testing.PJTestCase):
             self.questions.getRevision(q.__name__, 0), q)
         self.assertEqual(
             self.questions.getRevision(q.__name__, 1), q2)
+        self.assertEqual(
+            self.questions.getRevisionByVersion(1, q), q2)
+
+    def test_aupdate(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+
+        async def update():
+            async with q.__im_aupdate__() as q2:
+                q2.answer = 42
+
+        asyncio.run(update())
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 2)
+        self.assertEqual(self.questions[q.__name__].answer, 42)
+
+    def test_getRevisionAt(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.now = lambda: datetime.datetime(2020, 1, 1)
+        self.questions.add(q)
+        self.questions.now = lambda: datetime.datetime(2020, 1, 3)
+        with q.__im_update__() as q2:
+            pass
+        self.assertIsNone(self.questions.getRevisionAt(
+            datetime.datetime(2019, 12, 31), q))
+        self.assertEqual(self.questions.getRevisionAt(
+            datetime.datetime(2020, 1, 2), q), q)
+        self.assertEqual(self.questions.getRevisionAt(
+            datetime.datetime(2020, 1, 3), q), q2)
 
     def test_getNumberOfRevisions(self):
         with Question.__im_create__() as factory:
@@ -452,13 +535,151 @@ class ImmutableDatabaseTest(testing.PJTestCase):
         with self.assertRaises(KeyError):
             self.questions.getCurrentRevision(q1)
 
-    def test_addRevision(self):
+    def test_compact(self):
         with Question.__im_create__() as factory:
             q1 = factory('What is the answer')
         self.questions.add(q1)
+        with q1.__im_update__() as q2:
+            q2.answer = 41
+        with q2.__im_update__() as q3:
+            q3.answer = 42
+        with Question.__im_create__() as factory:
+            other = factory('Another trivia')
+        self.questions.add(other)
+        transaction.commit()
+
+        self.assertEqual(
+            self.questions.compact(retention.KeepLast(1), q1), 2)
+        transaction.commit()
+        self.assertEqual(self.questions.getNumberOfRevisions(q1), 1)
+        self.assertEqual(
+            self.questions.getCurrentRevision(q1).__im_version__, 2)
+        self.assertEqual(self.questions.getNumberOfRevisions(other), 1)
 
+    def test_compact_extendsRevisions(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        revisions = [q]
+        for answer in range(4):
+            with revisions[-1].__im_update__() as q:
+                q.answer = answer
+            revisions.append(q)
+        transaction.commit()
+        policy = mock.Mock(getDropped=mock.Mock(return_value=[1, 3]))
+        with mock.patch.object(
+                self.questions, 'getRevision') as getRevision:
+            self.assertEqual(self.questions.compact(policy, q), 2)
+        # The kept revisions are not loaded.
+        self.assertEqual(getRevision.call_count, 0)
+        transaction.commit()
+        history = list(self.questions.getRevisionHistory(q))
+        self.assertEqual([rev.__im_version__ for rev in history], [0, 2, 4])
+        # The revisions before the dropped ones now end when the next kept
+        # revision starts, in the document and in the column.
+        for rev, nextRev in zip(history, history[1:]):
+            self.assertEqual(rev.__im_end_on__, nextRev.__im_start_on__)
+        with self.conn.cursor() as cur:
+            cur.execute(
+                'SELECT version, endOn FROM questions ORDER BY version')
+            rows = [(version, endOn and endOn.replace(tzinfo=None))
+                    for version, endOn in cur.fetchall()]
+            self.assertEqual(
+                rows,
+                [(0, history[1].__im_start_on__),
+                 (2, history[2].__im_start_on__),
+                 (4, None)])
+
+    def test_compact_allObjects(self):
+        with Question.__im_create__() as factory:
+            q1 = factory('What is the answer')
+        self.questions.add(q1)
         with q1.__im_update__() as q2:
-            q2.answer = 42
+            q2.answer = 41
+        with q2.__im_update__() as q3:
+            q3.answer = 42
+        transaction.commit()
+        policy = mock.Mock(getDropped=mock.Mock(return_value=[1]))
+        self.assertEqual(self.questions.compact(policy), 1)
+        transaction.commit()
+        history = list(self.questions.getRevisionHistory(q1))
+        self.assertEqual(
+            [rev.__im_version__ for rev in history], [0, 2])
+        # The first revision now ends when the second one starts.
+        self.assertEqual(history[0].__im_end_on__, history[1].__im_start_on__)
+
+    def createDatedHistory(self, *timestamps):
+        self.questions.now = lambda: timestamps[0]
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        for answer, timestamp in enumerate(timestamps[1:]):
+            self.questions.now = lambda: timestamp
+            with q.__im_update__() as q:
+                q.answer = answer
+        transaction.commit()
+        return q
+
+    def test_compact_dropOlderThan(self):
+        q = self.createDatedHistory(
+            datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 2),
+            datetime.datetime(2020, 1, 3), datetime.datetime(2020, 2, 10))
+        self.questions.now = lambda: datetime.datetime(2020, 2, 15)
+        policy = retention.DropOlderThan(datetime.timedelta(days=30))
+        self.assertEqual(self.questions.compact(policy, q), 2)
+        transaction.commit()
+        history = list(self.questions.getRevisionHistory(q))
+        self.assertEqual([rev.__im_version__ for rev in history], [2, 3])
+        self.assertEqual(
+            history[0].__im_end_on__, datetime.datetime(2020, 2, 10))
+
+    def test_compact_keepDaily(self):
+        q = self.createDatedHistory(
+            datetime.datetime(2020, 1, 1, 10),
+            datetime.datetime(2020, 1, 1, 12),
+            datetime.datetime(2020, 1, 1, 14), datetime.datetime(2020, 1, 2),
+            datetime.datetime(2020, 2, 20))
+        self.questions.now = lambda: datetime.datetime(2020, 3, 1)
+        policy = retention.KeepDaily(datetime.timedelta(days=30))
+        self.assertEqual(self.questions.compact(policy, q), 2)
+        transaction.commit()
+        history = list(self.questions.getRevisionHistory(q))
+        self.assertEqual([rev.__im_version__ for rev in history], [2, 3, 4])
+        # The stubs read the same date/times from the columns.
+        stubs = list(self.questions.getRevisionStubs(q))
+        self.assertEqual(
+            [(stub.__im_start_on__, stub.__im_end_on__) for stub in stubs],
+            [(rev.__im_start_on__, rev.__im_end_on__) for rev in history])
+
+    def test_compact_combinedPolicy(self):
+        q = self.createDatedHistory(
+            datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 10),
+            datetime.datetime(2020, 2, 1, 10),
+            datetime.datetime(2020, 2, 1, 12), datetime.datetime(2020, 2, 5))
+        self.questions.now = lambda: datetime.datetime(2020, 2, 20)
+        policy = retention.CombinedPolicy(
+            retention.DropOlderThan(datetime.timedelta(days=30)),
+            retention.KeepDaily(datetime.timedelta(days=10)))
+        self.assertEqual(self.questions.compact(policy, q), 2)
+        transaction.commit()
+        history = list(self.questions.getRevisionHistory(q))
+        self.assertEqual([rev.__im_version__ for rev in history], [1, 3, 4])
+        # The revision before the dropped one ends where the dropped one
+        # ended.
+        self.assertEqual(
+            [rev.__im_end_on__ for rev in history],
+            [datetime.datetime(2020, 2, 1, 12), datetime.datetime(2020, 2, 5),
+             None])
+
+    def test_addRevision(self):
+        with Question.__im_create__() as factory:
+            q1 = factory('What is the answer')
+        self.questions.add(q1)
+
+        q2 = q1.__im_clone__()
+        q2.answer = 42
+        q2.__im_version__ = 1
+        q2.__im_finalize__()
 
         self.questions.addRevision(q2, old=q1)
 
@@ -467,6 +688,308 @@ class ImmutableDatabaseTest(testing.PJTestCase):
         self.assertEqual(q2.__im_state__, interfaces.IM_STATE_LOCKED)
         self.assertIsNone(q2.__im_end_on__)
 
+    def createConcurrentUpdate(self):
+        # Update a question based on a revision that is no longer current.
+        with Question.__im_create__() as factory:
+            q1 = factory('What is the answer', category='general')
+        self.questions.add(q1)
+        with q1.__im_update__() as q2:
+            q2.answer = 42
+        q3 = q1.__im_clone__()
+        q3.__im_version__ = 1
+        return q1, q2, q3
+
+    def test_addRevision_withConflict(self):
+        q1, q2, q3 = self.createConcurrentUpdate()
+        q3.category = 'math'
+        q3.__im_finalize__()
+        with self.assertRaises(revisioned.RevisionConflictError):
+            self.questions.addRevision(q3, old=q1)
+        self.assertEqual(self.questions.getNumberOfRevisions(q1), 2)
+        self.assertEqual(self.questions[q1.__name__].answer, 42)
+
+    def test_addRevision_withRebase(self):
+        self.questions.rebaseOnConflict = True
+        q1, q2, q3 = self.createConcurrentUpdate()
+        q3.category = 'math'
+        q3.__im_finalize__()
+        self.questions.addRevision(q3, old=q1)
+        self.assertEqual(q3.__im_version__, 2)
+        self.assertEqual(q3.answer, 42)
+        self.assertEqual(q3.category, 'math')
+        self.assertEqual(q2.__im_state__, interfaces.IM_STATE_RETIRED)
+        self.assertEqual(self.questions.getNumberOfRevisions(q1), 3)
+
+    def test_getRevisionStubs(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        with q.__im_update__(creator='arthur', comment='answer') as q2:
+            q2.answer = 42
+        transaction.commit()
+        stubs = list(self.questions.getRevisionStubs(q, reversed=True))
+        self.assertEqual(
+            [(stub.__name__, stub.__im_version__, stub.__im_state__,
+              stub.__im_creator__, stub.__im_comment__) for stub in stubs],
+            [(q.__name__, 1, interfaces.IM_STATE_LOCKED, 'arthur', 'answer'),
+             (q.__name__, 0, interfaces.IM_STATE_RETIRED, None, None)])
+        self.assertIsNone(stubs[0].__im_revision__)
+        self.assertEqual(stubs[0].answer, 42)
+        self.assertEqual(
+            len(list(self.questions.getRevisionStubs(q, creator='arthur'))),
+            1)
+
+    def test_getRevisionStubs_pickle(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        with q.__im_update__() as q2:
+            q2.answer = 42
+        transaction.commit()
+        stub = list(self.questions.getRevisionStubs(q))[1]
+        stub2 = pickle.loads(pickle.dumps(stub))
+        self.assertEqual(stub2.__im_version__, 1)
+        self.assertIsNone(stub2.__im_loader__.manager)
+        stub2.__im_loader__.manager = self.questions
+        self.assertEqual(stub2.answer, 42)
+
+    def test_getRevisionHistory_withVersions(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        for answer in range(4):
+            with self.questions[q.__name__].__im_update__() as q2:
+                q2.answer = answer
+        transaction.commit()
+
+        def versions(**kw):
+            return [rev.__im_version__
+                    for rev in self.questions.getRevisionHistory(q, **kw)]
+
+        self.assertEqual(versions(afterVersion=2), [3, 4])
+        self.assertEqual(
+            versions(beforeVersion=3, reversed=True, batchSize=2), [2, 1])
+        stubs = self.questions.getRevisionStubs(
+            q, afterVersion=0, beforeVersion=3)
+        self.assertEqual([stub.__im_version__ for stub in stubs], [1, 2])
+
+    def test_getRevisions(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        with q.__im_update__() as q2:
+            q2.answer = 42
+        with Question.__im_create__() as factory:
+            other = factory('Who')
+        self.questions.add(other)
+        transaction.commit()
+        revisions = self.questions.getRevisions(
+            [(q.__name__, 0), (q.__name__, 1), (other.__name__, 0),
+             (other.__name__, 1)])
+        self.assertEqual(
+            sorted(revisions),
+            sorted([(q.__name__, 0), (q.__name__, 1), (other.__name__, 0)]))
+        self.assertEqual(revisions[(q.__name__, 1)].answer, 42)
+        self.assertEqual(revisions[(other.__name__, 0)].question, 'Who')
+        self.assertEqual(self.questions.getRevisions([]), {})
+
+    def test_getRevisions_withManyKeys(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        with q.__im_update__() as q2:
+            q2.answer = 42
+        transaction.commit()
+        keys = [(q.__name__, 1)] + [
+            (f'q{idx}', version)
+            for idx in range(500) for version in range(10)]
+        revisions = self.questions.getRevisions(keys)
+        self.assertEqual(list(revisions), [(q.__name__, 1)])
+        self.assertEqual(revisions[(q.__name__, 1)].answer, 42)
+
+    def test_getRevisions_usesIndex(self):
+        self.fillTable()
+        transaction.commit()
+        self.questions.createIndexes()
+        transaction.commit()
+        qry = self.questions._getRevisionsQuery(
+            [('q1', 2), ('q2', 3), ('q3', 4)])
+        self.assertIn(
+            'questions_name_version',
+            self.explain(sb.sqlrepr(
+                sb.Select([sb.Field('questions', 'id')], qry),
+                'postgres')))
+
+    def test_getNumberOfRevisionsMany(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        with q.__im_update__() as q2:
+            q2.answer = 42
+        with Question.__im_create__() as factory:
+            other = factory('Who')
+        self.questions.add(other)
+        transaction.commit()
+        self.assertEqual(
+            self.questions.getNumberOfRevisionsMany(
+                [q.__name__, other.__name__, 'unknown']),
+            {q.__name__: 2, other.__name__: 1, 'unknown': 0})
+        self.assertEqual(self.questions.getNumberOfRevisionsMany([]), {})
+
+    def explain(self, qry):
+        with self.dm.getCursor() as cur:
+            cur.execute('SET enable_seqscan = off')
+            cur.execute('EXPLAIN ' + qry)
+            return ' '.join(row[0] for row in cur.fetchall())
+
+    def fillTable(self, names=200, versions=10):
+        # Revisions of `names` names, one version per day.
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        # Adding the first question creates the table.
+        self.questions.add(q)
+        with self.dm.getCursor() as cur:
+            cur.execute(
+                "INSERT INTO questions (id, name, version, startOn, endOn) "
+                "SELECT 'id' || i, 'q' || (i %% %(names)s), i / %(names)s, "
+                "  timestamptz '2020-01-01' + (i / %(names)s) * interval '1d', "
+                "  CASE WHEN i / %(names)s < %(last)s THEN "
+                "    timestamptz '2020-01-02' + (i / %(names)s) * "
+                "    interval '1d' "
+                "  END "
+                "FROM generate_series(0, %(count)s) i",
+                {'names': names, 'last': versions - 1,
+                 'count': names * versions - 1})
+            cur.execute('ANALYZE questions')
+
+    def test_createIndexes(self):
+        self.fillTable()
+        transaction.commit()
+        self.questions.createIndexes()
+        # Creating them again does nothing.
+        self.questions.createIndexes()
+        transaction.commit()
+
+        self.assertIn(
+            'Index Scan using questions_name_current',
+            self.explain(
+                "SELECT * FROM questions "
+                "WHERE name = 'q1' AND endOn IS NULL"))
+        self.assertIn(
+            'Index Scan Backward using questions_name_version',
+            self.explain(
+                "SELECT * FROM questions WHERE name = 'q1' "
+                "AND version < 10 ORDER BY version DESC LIMIT 5"))
+        self.assertIn(
+            'using questions_name_starton',
+            self.explain(
+                "SELECT * FROM questions WHERE name = 'q1' "
+                "AND startOn > '2020-01-09'"))
+
+    def test_createIndexes_withSeveralCurrentRevisions(self):
+        # Two current revisions of the same name violate the constraint.
+        self.fillTable(names=2, versions=1)
+        with self.dm.getCursor() as cur:
+            cur.execute(
+                "INSERT INTO questions (id, name, version) "
+                "VALUES ('other', 'q1', 1)")
+        transaction.commit()
+        with self.assertRaises(psycopg2.IntegrityError):
+            self.questions.createIndexes()
+        transaction.abort()
+        # Once the extra revision is retired, the constraint is added.
+        with self.dm.getCursor() as cur:
+            cur.execute(
+                "UPDATE questions SET endOn = now() WHERE id = 'id1'")
+        transaction.commit()
+        self.questions.createIndexes()
+        transaction.commit()
+        with self.dm.getCursor() as cur:
+            cur.execute(
+                "SELECT conname FROM pg_constraint "
+                "WHERE conrelid = 'questions'::regclass")
+            self.assertIn(
+                'questions_name_current', [row[0] for row in cur.fetchall()])
+
+    def test_createIndexes_withTrigram(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        transaction.commit()
+        try:
+            self.questions.createIndexes(trigram=True)
+        except psycopg2.Error:
+            self.skipTest('The pg_trgm extension is not available.')
+        transaction.commit()
+        self.assertIn(
+            'questions_comment_trgm',
+            self.explain(
+                "SELECT * FROM questions WHERE comment LIKE '%answer%'"))
+
+    def test_createIndexes_withUpdates(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        transaction.commit()
+        self.questions.createIndexes()
+        transaction.commit()
+        # The old revision might be retired after the new one is written.
+        for answer in range(3):
+            with self.questions[q.__name__].__im_update__() as q2:
+                q2.answer = answer
+            transaction.commit()
+        self.assertEqual(self.questions[q.__name__].answer, 2)
+
+    def test_createIndexes_withTwoCurrentRevisions(self):
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        transaction.commit()
+        self.questions.createIndexes()
+        transaction.commit()
+        q = self.questions[q.__name__]
+        q2 = q.__im_clone__()
+        q2.__im_version__ = 1
+        q2.__im_finalize__()
+        self.questions._pj_jar.register(q2)
+        with self.assertRaises(psycopg2.IntegrityError):
+            transaction.commit()
+        transaction.abort()
+
+    def test_addRevision_withChangeFeed(self):
+        self.questions.changeFeed = feed.ChangeFeed()
+        sub = self.questions.changeFeed.subscribe(feed.QueueSubscriber())
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        with q.__im_update__(creator='arthur') as q2:
+            q2.answer = 42
+        # Nothing is published before the commit.
+        self.assertEqual(sub.getBatch(timeout=0), [])
+        name = q.__name__
+        transaction.commit()
+        self.assertEqual(
+            [(rec.name, rec.oldVersion, rec.newVersion, rec.creator)
+             for rec in sub.getBatch(timeout=0)],
+            [(name, None, 0, None), (name, 0, 1, 'arthur')])
+
+    def test_addRevision_withChangeFeedAndAbort(self):
+        self.questions.changeFeed = feed.ChangeFeed()
+        sub = self.questions.changeFeed.subscribe(feed.QueueSubscriber())
+        with Question.__im_create__() as factory:
+            q = factory('What is the answer')
+        self.questions.add(q)
+        transaction.abort()
+        self.assertEqual(sub.getBatch(timeout=0), [])
+
+    def test_addRevision_withRebaseConflict(self):
+        self.questions.rebaseOnConflict = True
+        q1, q2, q3 = self.createConcurrentUpdate()
+        q3.answer = 41
+        q3.__im_finalize__()
+        with self.assertRaises(revisioned.RevisionConflictError):
+            self.questions.addRevision(q3, old=q1)
+
     def test_addRevision_withTransientObject(self):
         with Question.__im_create__() as factory:
             q1 = factory('What is the answer')
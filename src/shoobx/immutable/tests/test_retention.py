@@ -0,0 +1,101 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Revision Retention Policies Tests."""
+import datetime
+import unittest
+from zope.interface import verify
+
+from shoobx.immutable import interfaces, retention, revisioned
+
+NOW = datetime.datetime(2020, 3, 1)
+
+
+def createInfos(*starts):
+    infos = []
+    for version, start in enumerate(starts):
+        if infos:
+            infos[-1].__im_end_on__ = start
+        infos.append(revisioned.RevisionInfo(version, start))
+    return infos
+
+
+class KeepLastTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyClass(
+                interfaces.IRevisionRetentionPolicy, retention.KeepLast))
+
+    def test_getDropped(self):
+        infos = createInfos(*[NOW] * 5)
+        self.assertEqual(
+            list(retention.KeepLast(2).getDropped(infos, NOW)), [0, 1, 2])
+        self.assertEqual(
+            list(retention.KeepLast(10).getDropped(infos, NOW)), [])
+
+
+class KeepDailyTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyClass(
+                interfaces.IRevisionRetentionPolicy, retention.KeepDaily))
+
+    def test_getDropped(self):
+        infos = createInfos(
+            datetime.datetime(2020, 1, 1, 8),
+            datetime.datetime(2020, 1, 1, 9),
+            datetime.datetime(2020, 1, 1, 10),
+            datetime.datetime(2020, 1, 2, 8),
+            datetime.datetime(2020, 2, 28, 8),
+            datetime.datetime(2020, 2, 28, 9),
+        )
+        policy = retention.KeepDaily(after=datetime.timedelta(days=30))
+        # Only the last revision of January 1st is kept, revisions of the
+        # last 30 days are all kept.
+        self.assertEqual(policy.getDropped(infos, NOW), [0, 1])
+
+
+class DropOlderThanTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyClass(
+                interfaces.IRevisionRetentionPolicy, retention.DropOlderThan))
+
+    def test_getDropped(self):
+        infos = createInfos(
+            datetime.datetime(2020, 1, 1),
+            datetime.datetime(2020, 1, 15),
+            datetime.datetime(2020, 2, 15),
+        )
+        policy = retention.DropOlderThan(datetime.timedelta(days=30))
+        self.assertEqual(policy.getDropped(infos, NOW), [0])
+
+
+class CombinedPolicyTest(unittest.TestCase):
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyClass(
+                interfaces.IRevisionRetentionPolicy,
+                retention.CombinedPolicy))
+
+    def test_getDropped(self):
+        infos = createInfos(
+            datetime.datetime(2020, 1, 1),
+            datetime.datetime(2020, 1, 15),
+            datetime.datetime(2020, 2, 15),
+            datetime.datetime(2020, 2, 16),
+        )
+        policy = retention.CombinedPolicy(
+            retention.DropOlderThan(datetime.timedelta(days=30)),
+            retention.KeepLast(3))
+        self.assertEqual(policy.getDropped(infos, NOW), [0])
+        policy = retention.CombinedPolicy(
+            retention.DropOlderThan(datetime.timedelta(days=30)),
+            retention.KeepLast(2))
+        self.assertEqual(policy.getDropped(infos, NOW), [0, 1])
@@ -5,12 +5,18 @@
 ###############################################################################
 """Revisioned Immutable Objects Tests."""
 
+import asyncio
+import collections.abc
+import copy
 import datetime
 import mock
+import pickle
+import threading
 import unittest
+import zope.interface
 from zope.interface import verify
 
-from shoobx.immutable import interfaces, revisioned
+from shoobx.immutable import immutable, interfaces, retention, revisioned
 
 
 class DefaultRevisionInfoTest(unittest.TestCase):
@@ -53,6 +59,57 @@ class DefaultRevisionInfoTest(unittest.TestCase):
             self.assertEqual(info.creator, 'arthur')
             self.assertEqual(info.comment, 'question')
 
+    def test_defaultInfo_reused(self):
+        info = revisioned.defaultInfo('arthur')
+        with info:
+            with revisioned.defaultInfo('computer'):
+                with info:
+                    self.assertEqual(
+                        revisioned.DEFAULT_REVISION_INFO.creator, 'arthur')
+                self.assertEqual(
+                    revisioned.DEFAULT_REVISION_INFO.creator, 'computer')
+        self.assertIsNone(revisioned.DEFAULT_REVISION_INFO.creator)
+
+    def test_defaultInfo_asDecorator(self):
+
+        @revisioned.defaultInfo('arthur', 'answer')
+        def getInfo():
+            return revisioned.DEFAULT_REVISION_INFO.get()
+
+        self.assertEqual(getInfo(), ('arthur', 'answer'))
+        self.assertEqual(
+            revisioned.DEFAULT_REVISION_INFO.get(), (None, None))
+
+    def test_defaultInfo_async(self):
+
+        async def update(creator, started, other):
+            async with revisioned.defaultInfo(creator) as info:
+                # Let the other task set its info in the meantime.
+                started.set()
+                await other.wait()
+                return info.creator
+
+        async def main():
+            started1, started2 = asyncio.Event(), asyncio.Event()
+            return await asyncio.gather(
+                update('arthur', started1, started2),
+                update('computer', started2, started1))
+
+        self.assertEqual(asyncio.run(main()), ['arthur', 'computer'])
+        self.assertIsNone(revisioned.DEFAULT_REVISION_INFO.creator)
+
+    def test_defaultInfo_withThreads(self):
+        results = []
+
+        def getCreator():
+            results.append(revisioned.DEFAULT_REVISION_INFO.creator)
+
+        with revisioned.defaultInfo('arthur'):
+            thread = threading.Thread(target=getCreator)
+            thread.start()
+            thread.join()
+        self.assertListEqual(results, [None])
+
 
 class RevisionedImmutableBaseTest(unittest.TestCase):
 
@@ -148,6 +205,17 @@ class RevisionedImmutableTest(unittest.TestCase):
                 interfaces.IRevisionedImmutable,
                 revisioned.RevisionedImmutable))
 
+    def test_getstate(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+            rim.answer = 42
+        rimm.addRevision(rim)
+        rim2 = pickle.loads(pickle.dumps(rim))
+        self.assertEqual(rim2.answer, 42)
+        self.assertEqual(rim2.__im_start_on__, rim.__im_start_on__)
+        self.assertIsNone(rim2.__im_manager__)
+
     def test_new(self):
         im = revisioned.RevisionedImmutable.__new__(
             revisioned.RevisionedImmutable)
@@ -236,6 +304,25 @@ class SimpleRevisionedImmutableManagerTest(unittest.TestCase):
         rimm.addRevision(rim)
         self.assertListEqual(list(rimm.getRevisionHistory()), [rim])
 
+    def test_getRevisionStubs(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        with rim.__im_update__(creator='someone', comment='Update') as rim2:
+            rim2.title = 'Title'
+        stubs = list(rimm.getRevisionStubs(reversed=True))
+        self.assertEqual(
+            [(stub.__im_version__, stub.__im_state__, stub.__im_creator__,
+              stub.__im_comment__) for stub in stubs],
+            [(1, interfaces.IM_STATE_LOCKED, 'someone', 'Update'),
+             (0, interfaces.IM_STATE_RETIRED, None, None)])
+        self.assertEqual(stubs[0].__im_start_on__, rim2.__im_start_on__)
+        self.assertEqual(stubs[1].__im_end_on__, rim.__im_end_on__)
+        self.assertEqual(
+            [stub.__im_version__
+             for stub in rimm.getRevisionStubs(creator='someone')], [1])
+
     def test_getRevisionHistory_withCreator(self):
         rimm = revisioned.SimpleRevisionedImmutableManager()
         with revisioned.RevisionedImmutable.__im_create__() as factory:
@@ -310,6 +397,283 @@ class SimpleRevisionedImmutableManagerTest(unittest.TestCase):
             list(rimm.getRevisionHistory(batchStart=2, batchSize=2)),
             [rim3, rim4])
 
+    def createHistory(self, rimm, creators):
+        # Create a revision per creator, one day apart.
+        revisions = []
+        rim = None
+        for day, creator in enumerate(creators, 1):
+            rimm.now = lambda day=day: datetime.datetime(2020, 1, day)
+            if rim is None:
+                with revisioned.RevisionedImmutable.__im_create__(
+                        creator=creator) as factory:
+                    rim = factory()
+                rimm.addRevision(rim)
+            else:
+                with rim.__im_update__(
+                        creator=creator, comment=f'update {day}') as rim:
+                    pass
+            revisions.append(rim)
+        return revisions
+
+    def test_getRevisionHistory_isLazy(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        self.createHistory(rimm, ['a', 'b'])
+        result = rimm.getRevisionHistory()
+        self.assertNotIsInstance(result, list)
+        self.assertEqual(len(list(result)), 2)
+
+    def test_getRevisionHistory_withCreatorAndStart(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b', 'a', 'a'])
+        self.assertDictEqual(
+            rimm.__index__.creators, {'a': [0, 2, 4, 5], 'b': [1, 3]})
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                creator='a',
+                startAfter=datetime.datetime(2020, 1, 1),
+                startBefore=datetime.datetime(2020, 1, 6))),
+            [revs[2], revs[4]])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                creator='a', reversed=True, batchStart=1, batchSize=2)),
+            [revs[4], revs[2]])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(creator='c')), [])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                startAfter=datetime.datetime(2020, 1, 5),
+                startBefore=datetime.datetime(2020, 1, 2))),
+            [])
+
+    def test_getRevisionHistory_withCommentAndBatching(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b', 'a'])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                comment='update', reversed=True, batchStart=1, batchSize=2)),
+            [revs[3], revs[2]])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                comment='update', creator='b', batchStart=1)),
+            [revs[3]])
+
+    def test_getRevisionHistory_withUnsortedStart(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a'])
+        rimm.now = lambda: datetime.datetime(2019, 1, 1)
+        with revs[-1].__im_update__(creator='b') as rim:
+            pass
+        self.assertFalse(rimm.__index__.sorted)
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                startBefore=datetime.datetime(2020, 1, 2))),
+            [revs[0], rim])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                creator='b', startAfter=datetime.datetime(2019, 6, 1))),
+            [revs[1]])
+
+    def test_getRevisionHistory_withVersions(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b', 'a'])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(afterVersion=2)), revs[3:])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(beforeVersion=2)), revs[:2])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(afterVersion=0, beforeVersion=4)),
+            revs[1:4])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(creator='a', afterVersion=0)),
+            [revs[2], revs[4]])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(
+                comment='update', beforeVersion=3, reversed=True)),
+            [revs[2], revs[1]])
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(afterVersion=4)), [])
+
+    def test_getRevisionHistory_withKeysetPagination(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        self.createHistory(rimm, ['a'] * 7)
+        pages = []
+        beforeVersion = None
+        while True:
+            page = list(rimm.getRevisionHistory(
+                reversed=True, batchSize=3, beforeVersion=beforeVersion))
+            if not page:
+                break
+            pages.append([rim.__im_version__ for rim in page])
+            beforeVersion = page[-1].__im_version__
+        self.assertListEqual(pages, [[6, 5, 4], [3, 2, 1], [0]])
+
+    def test_getRevisionHistory_withVersionsAndDroppedRevisions(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a'] * 6)
+        rimm.dropRevisions([1, 2, 3])
+        # The cursor versions no longer exist.
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(afterVersion=2)), revs[4:])
+        self.assertListEqual(
+            [rev.__im_version__
+             for rev in rimm.getRevisionHistory(beforeVersion=3)], [0])
+
+    def test_findVersion(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        self.createHistory(rimm, ['a'] * 6)
+        rimm.dropRevisions([1, 2])
+        self.assertEqual(rimm.findVersion(0), 0)
+        self.assertEqual(rimm.findVersion(2), 1)
+        self.assertEqual(rimm.findVersion(3), 1)
+        self.assertEqual(rimm.findVersion(5), 3)
+        self.assertEqual(rimm.findVersion(6), 4)
+
+    def test_getRevisionAt(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'c'])
+        self.assertIsNone(
+            rimm.getRevisionAt(datetime.datetime(2019, 12, 31)))
+        self.assertIs(
+            rimm.getRevisionAt(datetime.datetime(2020, 1, 1)), revs[0])
+        self.assertIs(
+            rimm.getRevisionAt(datetime.datetime(2020, 1, 2, 12)), revs[1])
+        self.assertIs(
+            rimm.getRevisionAt(datetime.datetime(2021, 1, 1)), revs[2])
+
+    def test_getRevisionAt_withEndedRevision(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b'])
+        revs[-1].__im_end_on__ = datetime.datetime(2020, 1, 3)
+        self.assertIs(
+            rimm.getRevisionAt(datetime.datetime(2020, 1, 2)), revs[1])
+        self.assertIsNone(
+            rimm.getRevisionAt(datetime.datetime(2020, 1, 3)))
+
+    def test_getRevisionAt_withUnsortedStart(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b'])
+        rimm.now = lambda: datetime.datetime(2019, 1, 1)
+        with revs[-1].__im_update__() as rim3:
+            pass
+        # The latest revision active at the time wins.
+        self.assertIs(
+            rimm.getRevisionAt(datetime.datetime(2020, 1, 1)), rim3)
+        self.assertIsNone(
+            rimm.getRevisionAt(datetime.datetime(2018, 1, 1)))
+
+    def test_compact(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b', 'a'])
+        self.assertEqual(rimm.compact(retention.KeepLast(2)), 3)
+        self.assertListEqual(rimm.__data__, revs[3:])
+        self.assertIs(rimm.getRevision(4), revs[4])
+        with self.assertRaises(KeyError):
+            rimm.getRevision(0)
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(creator='a')), [revs[4]])
+        self.assertEqual(rimm.compact(retention.KeepLast(2)), 0)
+
+    def test_compact_keepsContinuity(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b'])
+        policy = mock.Mock(getDropped=mock.Mock(return_value=[1, 2, 3]))
+        # The latest revision is never dropped.
+        self.assertEqual(rimm.compact(policy), 2)
+        first, last = rimm.__data__
+        self.assertIs(last, revs[3])
+        self.assertEqual(first.__im_end_on__, revs[3].__im_start_on__)
+        self.assertEqual(
+            [rev.__im_version__ for rev in rimm.getRevisionHistory()], [0, 3])
+
+    def test_compact_replacesExtendedRevisions(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a'])
+        end = revs[0].__im_end_on__
+        index = rimm.__index__
+        rimm.compact(mock.Mock(getDropped=mock.Mock(return_value=[1])))
+        # The extended revision is a copy, readers keep the original.
+        first = rimm.getRevision(0)
+        self.assertIsNot(first, revs[0])
+        self.assertEqual(first.__im_end_on__, revs[1].__im_end_on__)
+        self.assertEqual(first.__im_state__, interfaces.IM_STATE_RETIRED)
+        self.assertEqual(first.__im_creator__, 'a')
+        self.assertIs(first.__im_manager__, rimm)
+        self.assertEqual(revs[0].__im_end_on__, end)
+        self.assertIs(index.data[0], revs[0])
+
+    def test_addRevision_withRetentionPolicy(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.retentionPolicy = retention.KeepLast(2)
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b'])
+        self.assertListEqual(rimm.__data__, revs[2:])
+
+    def test_compact_keepsIndexOfReaders(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b'])
+        index = rimm.__index__
+        history = rimm.getRevisionHistory(creator='a')
+        rimm.compact(retention.KeepLast(1))
+        # The compacted history is published as a new index.
+        self.assertIsNot(rimm.__index__, index)
+        self.assertListEqual(rimm.__data__, revs[3:])
+        self.assertDictEqual(rimm.__index__.versions, {3: 0})
+        # Readers which started before keep their consistent view.
+        self.assertListEqual(index.data, revs)
+        self.assertDictEqual(index.versions, {0: 0, 1: 1, 2: 2, 3: 3})
+        self.assertListEqual(list(history), [revs[0], revs[2]])
+
+    def test_rollbackToRevision_keepsIndexOfReaders(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b'])
+        index = rimm.__index__
+        rimm.rollbackToRevision(revs[1])
+        with revs[1].__im_update__(creator='a'):
+            pass
+        self.assertListEqual(index.data, revs)
+        self.assertDictEqual(index.creators, {'a': [0, 2], 'b': [1, 3]})
+        self.assertDictEqual(rimm.__index__.creators, {'a': [0, 2], 'b': [1]})
+
+    def test_rollbackToRevision_sharesIndex(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b'])
+        index = rimm.__index__
+        history = rimm.getRevisionHistory()
+        rimm.rollbackToRevision(revs[1])
+        # Rolling back does not copy the history.
+        self.assertIs(rimm.__index__.data, index.data)
+        self.assertEqual(rimm.__index__.length, 2)
+        self.assertIs(rimm.getCurrentRevision(), revs[1])
+        self.assertIs(
+            rimm.getCommittedRevision(revisioned.COMMIT_SEQUENCE.current()),
+            revs[1])
+        # The next revision copies it, so that readers keep their view.
+        with revs[1].__im_update__() as rim:
+            pass
+        self.assertIsNot(rimm.__index__.data, index.data)
+        self.assertEqual(index.length, 4)
+        self.assertListEqual(list(history), revs)
+        self.assertIs(rimm.getCurrentRevision(), rim)
+
+    def test_rollbackToRevision_updatesIndexes(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'a', 'b'])
+        rimm.rollbackToRevision(revs[1])
+        self.assertListEqual(rimm.__data__, revs[:2])
+        self.assertEqual(rimm.getNumberOfRevisions(), 2)
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(creator='a')), [revs[0]])
+        with self.assertRaises(KeyError):
+            rimm.getRevision(2)
+        with revs[1].__im_update__(creator='c') as rim:
+            pass
+        self.assertListEqual(rimm.__data__, revs[:2] + [rim])
+        self.assertDictEqual(
+            rimm.__index__.creators, {'a': [0], 'b': [1], 'c': [2]})
+        self.assertDictEqual(rimm.__index__.versions, {0: 0, 1: 1, 2: 2})
+        self.assertIs(rimm.getRevision(2), rim)
+        self.assertListEqual(
+            list(rimm.getRevisionHistory(creator='c')), [rim])
+
     def test_rollbackToRevision(self):
         rimm = revisioned.SimpleRevisionedImmutableManager()
         with revisioned.RevisionedImmutable.__im_create__() as factory:
@@ -332,6 +696,31 @@ class SimpleRevisionedImmutableManagerTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             rimm.rollbackToRevision(rim)
 
+    def test_rollbackToRevision_withOtherRevision(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b'])
+        # A different revision with the same version.
+        rim = revs[1].__im_clone__()
+        rim.__im_finalize__()
+        with self.assertRaises(ValueError):
+            rimm.rollbackToRevision(rim)
+        self.assertListEqual(rimm.__data__, revs)
+
+    def test_rollbackToRevision_withLatest(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b'])
+        rimm.rollbackToRevision(revs[1])
+        self.assertListEqual(rimm.__data__, revs)
+
+    def test_getRevision(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b', 'c'])
+        self.assertIs(rimm.getRevision(0), revs[0])
+        self.assertIs(rimm.getRevision(2), revs[2])
+        self.assertIs(rimm.getRevisionByVersion(2, revs[0]), revs[2])
+        with self.assertRaises(KeyError):
+            rimm.getRevision(3)
+
     def test_rollbackToRevision_noActivation(self):
         rimm = revisioned.SimpleRevisionedImmutableManager()
         with revisioned.RevisionedImmutable.__im_create__() as factory:
@@ -370,6 +759,157 @@ class SimpleRevisionedImmutableManagerTest(unittest.TestCase):
         self.assertIsNotNone(rim2.__im_end_on__)
         self.assertEqual(rim2.__im_state__, interfaces.IM_STATE_RETIRED)
 
+    def test_addRevision_withOutdatedOld(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        with rim.__im_update__() as rim2:
+            pass
+        rim3 = rim.__im_clone__()
+        rim3.__im_set_state__(interfaces.IM_STATE_LOCKED)
+        with self.assertRaises(revisioned.RevisionConflictError):
+            rimm.addRevision(rim3, old=rim)
+        self.assertListEqual(rimm.__data__, [rim, rim2])
+        self.assertIsNone(rim2.__im_end_on__)
+
+    def test_addRevision_withConcurrentUpdates(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        barrier = threading.Barrier(4)
+        results = []
+
+        def update():
+            try:
+                with rim.__im_update__() as rim2:
+                    # Make sure all threads update the same revision.
+                    barrier.wait()
+            except revisioned.RevisionConflictError:
+                results.append(None)
+            else:
+                results.append(rim2)
+
+        threads = [threading.Thread(target=update) for idx in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        updated = [result for result in results if result is not None]
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(updated), 1)
+        self.assertListEqual(rimm.__data__, [rim, updated[0]])
+        self.assertListEqual(
+            [rev.__im_version__ for rev in rimm.__data__], [0, 1])
+
+    def createConcurrentUpdate(self, rimm):
+        # Update a revision that was updated by someone else in the meantime.
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+            rim.title = 'Doc'
+            rim.body = {'count': 0, 'tags': ['a']}
+        rimm.addRevision(rim)
+        with rim.__im_update__(creator='a') as rim2:
+            rim2.title = 'Title'
+        rim3 = rim.__im_clone__()
+        rim3.__im_version__ = 1
+        rim3.__im_creator__ = 'b'
+        return rim, rim2, rim3
+
+    def test_addRevision_withRebase(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.rebaseOnConflict = True
+        rim, rim2, rim3 = self.createConcurrentUpdate(rimm)
+        rim3.body['count'] = 1
+        rim3.__im_finalize__()
+        rimm.addRevision(rim3, old=rim)
+        self.assertListEqual(rimm.__data__, [rim, rim2, rim3])
+        self.assertEqual(rim3.__im_version__, 2)
+        self.assertEqual(rim3.__im_creator__, 'b')
+        self.assertEqual(rim3.title, 'Title')
+        self.assertEqual(rim3.body, {'count': 1, 'tags': ['a']})
+        self.assertEqual(rim3.__im_state__, interfaces.IM_STATE_LOCKED)
+        self.assertEqual(rim2.__im_state__, interfaces.IM_STATE_RETIRED)
+        self.assertEqual(rim2.__im_end_on__, rim3.__im_start_on__)
+
+    def test_addRevision_withRebaseAndNoChanges(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.rebaseOnConflict = True
+        rim, rim2, rim3 = self.createConcurrentUpdate(rimm)
+        rim3.__im_finalize__()
+        self.assertIs(immutable.getOrigin(rim3), rim)
+        rimm.addRevision(rim3, old=rim)
+        self.assertEqual(rim3.title, 'Title')
+        # The rebased revision is no unchanged clone of `rim` anymore.
+        self.assertIsNone(immutable.getOrigin(rim3))
+        self.assertIs(immutable.getOrigin(rim3.body), rim.body)
+
+    def test_addRevision_withRebaseConflict(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.rebaseOnConflict = True
+        rim, rim2, rim3 = self.createConcurrentUpdate(rimm)
+        rim3.title = 'Other Title'
+        rim3.__im_finalize__()
+        with self.assertRaises(revisioned.RevisionConflictError):
+            rimm.addRevision(rim3, old=rim)
+        self.assertListEqual(rimm.__data__, [rim, rim2])
+
+    def test_addRevision_withRebaseAndSameChange(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.rebaseOnConflict = True
+        rim, rim2, rim3 = self.createConcurrentUpdate(rimm)
+        rim3.title = 'Title'
+        rim3.__im_finalize__()
+        rimm.addRevision(rim3, old=rim)
+        self.assertEqual(rim3.title, 'Title')
+
+    def test_addRevision_withConcurrentRebasedUpdates(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rimm.rebaseOnConflict = True
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        rimm.addRevision(rim)
+        barrier = threading.Barrier(4)
+
+        def update(idx):
+            with rim.__im_update__() as rim2:
+                setattr(rim2, f'attr{idx}', idx)
+                barrier.wait()
+
+        threads = [
+            threading.Thread(target=update, args=(idx,)) for idx in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # All non-overlapping changes were merged.
+        current = rimm.getCurrentRevision()
+        self.assertEqual(current.__im_version__, 4)
+        for idx in range(4):
+            self.assertEqual(getattr(current, f'attr{idx}'), idx)
+
+    def test_getCommittedRevision(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a', 'b'])
+        first, second = rimm.__index__.commits
+        self.assertLess(first, second)
+        self.assertIsNone(rimm.getCommittedRevision(first - 1))
+        self.assertIs(rimm.getCommittedRevision(first), revs[0])
+        self.assertIs(rimm.getCommittedRevision(second), revs[1])
+        self.assertIs(
+            rimm.getCommittedRevision(
+                revisioned.COMMIT_SEQUENCE.current()), revs[1])
+
+    def test_getCommittedRevision_withEndedRevision(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        revs = self.createHistory(rimm, ['a'])
+        revs[0].__im_end_on__ = datetime.datetime(2020, 1, 2)
+        self.assertIsNone(
+            rimm.getCommittedRevision(revisioned.COMMIT_SEQUENCE.current()))
+
     def test_addRevision_inTransientState(self):
         rimm = revisioned.SimpleRevisionedImmutableManager()
         rim = revisioned.RevisionedImmutable()
@@ -379,6 +919,531 @@ class SimpleRevisionedImmutableManagerTest(unittest.TestCase):
         with self.assertRaises(AssertionError):
             rimm.addRevision(rim)
 
+    def test_addRevision_unchecked(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        rim = revisioned.RevisionedImmutable()
+        with immutable.checks(interfaces.IM_CHECKS_UNCHECKED):
+            rimm.addRevision(rim)
+        self.assertListEqual(rimm.__data__, [rim])
+
+
+def loadTitle():
+    with revisioned.RevisionedImmutable.__im_create__() as factory:
+        rim = factory()
+        rim.title = 'Title'
+    return rim
+
+
+class RevisionStubTest(unittest.TestCase):
+
+    def setUp(self):
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            self.rim = factory()
+            self.rim.title = 'Title'
+        self.loads = 0
+        self.stub = revisioned.RevisionStub(
+            self.load, 'doc', 3, interfaces.IM_STATE_LOCKED,
+            datetime.datetime(2020, 1, 1), creator='arthur')
+
+    def load(self):
+        self.loads += 1
+        return self.rim
+
+    def test_metadata(self):
+        self.assertEqual(self.stub.__name__, 'doc')
+        self.assertEqual(self.stub.__im_version__, 3)
+        self.assertEqual(self.stub.__im_state__, interfaces.IM_STATE_LOCKED)
+        self.assertEqual(
+            self.stub.__im_start_on__, datetime.datetime(2020, 1, 1))
+        self.assertIsNone(self.stub.__im_end_on__)
+        self.assertEqual(self.stub.__im_creator__, 'arthur')
+        self.assertIsNone(self.stub.__im_comment__)
+        self.assertEqual(self.loads, 0)
+
+    def test_getattr(self):
+        self.assertEqual(self.stub.title, 'Title')
+        self.assertEqual(self.stub.title, 'Title')
+        self.assertEqual(self.loads, 1)
+        with self.assertRaises(AttributeError):
+            self.stub.unknown
+
+    def test_im_load(self):
+        self.assertIs(self.stub.__im_load__(), self.rim)
+        self.assertIs(self.stub.__im_load__(), self.rim)
+        self.assertEqual(self.loads, 1)
+
+    def test_repr(self):
+        self.assertEqual(repr(self.stub), "<RevisionStub 'doc' version 3>")
+
+    def test_getattr_withSpecialName(self):
+        self.assertFalse(hasattr(self.stub, '__len__'))
+        self.assertFalse(hasattr(self.stub, '__getnewargs_ex__'))
+        self.assertEqual(self.loads, 0)
+        self.assertEqual(self.stub.__im_manager__, None)
+        self.assertEqual(self.loads, 1)
+
+    def test_copy(self):
+        for func in (copy.copy, copy.deepcopy):
+            stub = func(self.stub)
+            self.assertIsInstance(stub, revisioned.RevisionStub)
+            self.assertIsNot(stub, self.stub)
+            self.assertEqual(repr(stub), repr(self.stub))
+            self.assertEqual(stub.__im_creator__, 'arthur')
+            self.assertEqual(self.loads, 0)
+        self.assertIs(self.stub.__im_load__(), self.rim)
+        self.assertIs(copy.deepcopy(self.stub).__im_load__(), self.rim)
+        self.assertEqual(self.loads, 1)
+
+    def test_pickle(self):
+        stub = revisioned.RevisionStub(
+            loadTitle, 'doc', 3, interfaces.IM_STATE_LOCKED,
+            datetime.datetime(2020, 1, 1), creator='arthur')
+        self.assertEqual(stub.title, 'Title')
+        stub2 = pickle.loads(pickle.dumps(stub))
+        self.assertIsInstance(stub2, revisioned.RevisionStub)
+        self.assertEqual(stub2.__im_creator__, 'arthur')
+        self.assertEqual(
+            stub2.__im_start_on__, datetime.datetime(2020, 1, 1))
+        # The revision is loaded anew.
+        self.assertIsNone(stub2.__im_revision__)
+        self.assertEqual(stub2.title, 'Title')
+
+    def test_pickle_withManager(self):
+        rimm = revisioned.SimpleRevisionedImmutableManager()
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+            rim.title = 'Title'
+        rimm.addRevision(rim)
+        stub, = rimm.getRevisionStubs()
+        stub2 = pickle.loads(pickle.dumps(stub))
+        self.assertEqual(stub2.__im_version__, 0)
+        self.assertEqual(stub2.__im_start_on__, rim.__im_start_on__)
+        # The manager is not pickled, the stub has to be bound again.
+        self.assertIsNone(stub2.__im_loader__.manager)
+        with self.assertRaises(ValueError):
+            stub2.title
+        stub2.__im_loader__.manager = rimm
+        self.assertEqual(stub2.title, 'Title')
+        self.assertIs(stub2.__im_load__(), rim)
+
+
+class DeltaRevisionedImmutableManagerTest(unittest.TestCase):
+
+    def createHistory(self, rimm, count=7):
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+            rim.title = 'Doc'
+            rim.body = {'count': 0, 'meta': {'tags': ['a']}}
+        rimm.addRevision(rim)
+        revisions = [rim]
+        for idx in range(1, count):
+            with rim.__im_update__(creator=f'user{idx}') as rim:
+                rim.body['count'] = idx
+                if idx == 2:
+                    rim.body['meta']['tags'].append('b')
+                if idx == 4:
+                    del rim.body['meta']
+                    rim.note = 'Note'
+                if idx == 5:
+                    del rim.__dict__['note']
+            revisions.append(rim)
+        return revisions
+
+    def assertRevisionEqual(self, rim, orig):
+        self.assertIsNot(rim, orig)
+        self.assertEqual(rim.__class__, orig.__class__)
+        for name in ('title', 'note'):
+            self.assertEqual(
+                getattr(rim, name, None), getattr(orig, name, None))
+        self.assertEqual(rim.body, orig.body)
+        for name in ('__im_version__', '__im_start_on__', '__im_end_on__',
+                     '__im_creator__', '__im_comment__', '__im_state__'):
+            self.assertEqual(getattr(rim, name), getattr(orig, name))
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyClass(
+                interfaces.IRevisionedImmutableManager,
+                revisioned.DeltaRevisionedImmutableManager))
+
+    def test_addRevision(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=3)
+        revs = self.createHistory(rimm)
+        self.assertEqual(
+            [type(rec).__name__ for rec in rimm.__data__],
+            ['RevisionedImmutable', 'RevisionDelta', 'RevisionDelta',
+             'RevisionedImmutable', 'RevisionDelta', 'RevisionDelta',
+             'RevisionedImmutable'])
+        self.assertIs(rimm.__data__[0], revs[0])
+        self.assertIs(rimm.getCurrentRevision(), revs[-1])
+        delta = rimm.__data__[2]
+        self.assertEqual(delta.__im_creator__, 'user2')
+        self.assertEqual(delta.__im_end_on__, revs[2].__im_end_on__)
+        self.assertEqual(list(delta.changes), ['body'])
+        self.assertEqual(
+            delta.changes['body'].changes['meta'].changes['tags'], ['a', 'b'])
+        self.assertEqual(rimm.getNumberOfRevisions(), 7)
+
+    def test_loadRevision(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=4)
+        revs = self.createHistory(rimm)
+        for pos, orig in enumerate(revs[:-1]):
+            if isinstance(rimm.__data__[pos], revisioned.RevisionDelta):
+                self.assertRevisionEqual(rimm.loadRevision(pos), orig)
+        rim = rimm.getRevision(2)
+        self.assertIs(rim.__im_manager__, rimm)
+        self.assertEqual(rim.__im_state__, interfaces.IM_STATE_RETIRED)
+        self.assertEqual(rim.body['meta'].__im_state__,
+                         interfaces.IM_STATE_LOCKED)
+
+    def test_loadRevision_withCache(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=10, cacheSize=2)
+        self.createHistory(rimm)
+        rim = rimm.loadRevision(3)
+        self.assertIs(rimm.loadRevision(3), rim)
+        # Revision 4 is reconstructed from the cached revision 3.
+        rim4 = rimm.loadRevision(4)
+        self.assertEqual(rim4.body['count'], 4)
+        rimm.loadRevision(5)
+        self.assertEqual(list(rimm.__cache__), [4, 5])
+        self.assertIsNot(rimm.loadRevision(3), rim)
+
+    def test_loadRevision_withOrigins(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(cacheSize=0)
+        revs = self.createHistory(rimm, 3)
+        rim = rimm.loadRevision(1)
+        # Only the unchanged parts of the base revision are its origins.
+        self.assertIsNone(immutable.getOrigin(rim))
+        self.assertIsNone(immutable.getOrigin(rim.body))
+        self.assertIs(immutable.getOrigin(rim.body['meta']),
+                      revs[0].body['meta'])
+
+    def test_loadRevision_withoutCache(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(cacheSize=0)
+        self.createHistory(rimm, 3)
+        self.assertEqual(rimm.loadRevision(1).body['count'], 1)
+        self.assertEqual(len(rimm.__cache__), 0)
+
+    def test_addRevision_withIncomparableRevision(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager()
+        revs = self.createHistory(rimm, 2)
+
+        class Other(revisioned.RevisionedImmutable):
+            pass
+
+        with Other.__im_create__() as factory:
+            other = factory()
+        other.__im_version__ = 2
+        rimm.addRevision(other, old=revs[-1])
+        self.assertIs(rimm.__data__[2], other)
+        self.assertIs(rimm.getRevision(2), other)
+
+    def test_addRevision_withOutdatedOld(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager()
+        revs = self.createHistory(rimm, 3)
+        rim = revs[1].__im_clone__()
+        rim.__im_set_state__(interfaces.IM_STATE_LOCKED)
+        with self.assertRaises(revisioned.RevisionConflictError):
+            rimm.addRevision(rim, old=revs[1])
+        self.assertEqual(rimm.getNumberOfRevisions(), 3)
+
+    def test_addRevision_withRebase(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager()
+        rimm.rebaseOnConflict = True
+        revs = self.createHistory(rimm, 3)
+        rim = revs[1].__im_clone__()
+        rim.__im_version__ = 2
+        rim.body['meta']['lang'] = 'en'
+        rim.__im_finalize__()
+        rimm.addRevision(rim, old=revs[1])
+        self.assertEqual(rim.__im_version__, 3)
+        self.assertEqual(rim.body['count'], 2)
+        self.assertEqual(
+            rim.body['meta'], {'tags': ['a', 'b'], 'lang': 'en'})
+        self.assertRevisionEqual(rimm.loadRevision(2), revs[2])
+        self.assertEqual(rimm.getRevision(3).body['count'], 2)
+
+    def test_getRevisionHistory(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=3)
+        revs = self.createHistory(rimm)
+        history = list(rimm.getRevisionHistory(creator='user4'))
+        self.assertEqual(len(history), 1)
+        self.assertRevisionEqual(history[0], revs[4])
+
+    def test_getRevisionStubs(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=3)
+        revs = self.createHistory(rimm)
+        stubs = list(rimm.getRevisionStubs())
+        # No revision was reconstructed.
+        self.assertEqual(len(rimm.__cache__), 0)
+        self.assertEqual(
+            [stub.__im_creator__ for stub in stubs],
+            [rev.__im_creator__ for rev in revs])
+        self.assertEqual(
+            [stub.__im_state__ for stub in stubs],
+            [interfaces.IM_STATE_RETIRED] * 6 + [interfaces.IM_STATE_LOCKED])
+        self.assertEqual(stubs[4].body['count'], 4)
+        self.assertEqual(list(rimm.__cache__), [4])
+
+    def test_rollbackToRevision(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=3)
+        self.createHistory(rimm)
+        rim = rimm.getRevision(4)
+        rimm.rollbackToRevision(rim)
+        self.assertEqual(rimm.getNumberOfRevisions(), 5)
+        self.assertIs(rimm.getCurrentRevision(), rim)
+        self.assertIsNone(rimm.__data__[4].__im_end_on__)
+        with rim.__im_update__() as rim5:
+            rim5.title = 'Doc 5'
+        self.assertIs(rimm.getCurrentRevision(), rim5)
+        self.assertEqual(rimm.getRevision(4).note, 'Note')
+        self.assertEqual(rimm.__data__[5].changes, {'title': 'Doc 5'})
+
+    def test_compact(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=3)
+        revs = self.createHistory(rimm)
+        policy = mock.Mock(getDropped=mock.Mock(return_value=[1, 3]))
+        self.assertEqual(rimm.compact(policy), 2)
+        # Revisions 2 and 4 were reconstructed from dropped revisions, so
+        # they are now stored in full.
+        self.assertEqual(
+            [type(rec).__name__ for rec in rimm.__data__],
+            ['RevisionedImmutable', 'RevisionedImmutable',
+             'RevisionedImmutable', 'RevisionDelta', 'RevisionedImmutable'])
+        self.assertEqual(
+            [rev.__im_version__ for rev in rimm.getRevisionHistory()],
+            [0, 2, 4, 5, 6])
+        for version in (4, 5):
+            self.assertRevisionEqual(
+                rimm.getRevision(version), revs[version])
+        self.assertIs(rimm.getCurrentRevision(), revs[6])
+        # The revisions before the dropped ones now end when those ended.
+        self.assertEqual(
+            rimm.getRevision(0).__im_end_on__, revs[1].__im_end_on__)
+        self.assertLess(revs[0].__im_end_on__, revs[1].__im_end_on__)
+        rim2 = rimm.getRevision(2)
+        self.assertEqual(rim2.body, revs[2].body)
+        self.assertEqual(rim2.__im_end_on__, revs[3].__im_end_on__)
+
+    def test_compact_extendsDelta(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=3)
+        revs = self.createHistory(rimm)
+        delta = rimm.__data__[1]
+        end = delta.__im_end_on__
+        rimm.compact(mock.Mock(getDropped=mock.Mock(return_value=[2])))
+        # The delta before the dropped revision is replaced, not changed.
+        record = rimm.__data__[1]
+        self.assertIsInstance(record, revisioned.RevisionDelta)
+        self.assertIsNot(record, delta)
+        self.assertIs(record.changes, delta.changes)
+        self.assertEqual(record.__im_end_on__, revs[2].__im_end_on__)
+        self.assertEqual(delta.__im_end_on__, end)
+        rim1 = rimm.getRevision(1)
+        self.assertEqual(rim1.body, revs[1].body)
+        self.assertEqual(rim1.__im_end_on__, revs[2].__im_end_on__)
+
+    def test_compact_withHead(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager()
+        revs = self.createHistory(rimm, 3)
+        self.assertEqual(rimm.compact(retention.KeepLast(1)), 2)
+        self.assertListEqual(rimm.__data__, [revs[2]])
+        with revs[2].__im_update__() as rim:
+            rim.title = 'Doc 3'
+        self.assertEqual(rimm.getRevision(2).title, 'Doc')
+
+    def test_getRevisionAt(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager(
+            checkpointInterval=4)
+        revs = self.createHistory(rimm)
+        self.assertRevisionEqual(
+            rimm.getRevisionAt(revs[3].__im_start_on__), revs[3])
+        self.assertIs(rimm.getRevisionAt(revs[-1].__im_start_on__), revs[-1])
+
+    def test_rollbackToRevision_unknownRevision(self):
+        rimm = revisioned.DeltaRevisionedImmutableManager()
+        self.createHistory(rimm, 3)
+        other = revisioned.DeltaRevisionedImmutableManager()
+        revs = self.createHistory(other, 3)
+        with self.assertRaises(ValueError):
+            rimm.rollbackToRevision(revs[1])
+
+
+class AsyncRevisionedImmutableManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rimm = revisioned.SimpleRevisionedImmutableManager()
+        self.amanager = revisioned.AsyncRevisionedImmutableManager(self.rimm)
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            self.rim = factory()
+        self.rimm.addRevision(self.rim)
+
+    def test_verifyInterface(self):
+        self.assertTrue(
+            verify.verifyObject(
+                interfaces.IAsyncRevisionedImmutableManager, self.amanager))
+
+    def test_interface_coversManager(self):
+        self.assertEqual(
+            set(interfaces.IAsyncRevisionedImmutableManager),
+            set(interfaces.IRevisionedImmutableManager))
+
+    def test_asyncManager(self):
+        self.assertIs(revisioned.asyncManager(self.amanager), self.amanager)
+        amanager = revisioned.asyncManager(self.rimm)
+        self.assertIsInstance(
+            amanager, revisioned.AsyncRevisionedImmutableManager)
+        self.assertIs(amanager.manager, self.rimm)
+
+    def test_run(self):
+        threads = []
+
+        def func():
+            threads.append(threading.current_thread())
+            return revisioned.DEFAULT_REVISION_INFO.creator
+
+        async def run():
+            async with revisioned.defaultInfo('arthur'):
+                return await self.amanager.run(func)
+
+        # The function runs in the executor with the current context.
+        self.assertEqual(asyncio.run(run()), 'arthur')
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_getCurrentRevision(self):
+        self.assertIs(
+            asyncio.run(self.amanager.getCurrentRevision()), self.rim)
+
+    def test_getNumberOfRevisions(self):
+        self.assertEqual(asyncio.run(self.amanager.getNumberOfRevisions()), 1)
+
+    def test_getRevisionByVersion(self):
+        self.assertIs(
+            asyncio.run(self.amanager.getRevisionByVersion(0)), self.rim)
+
+    def test_getRevisionAt(self):
+        start = self.rim.__im_start_on__
+        self.assertIs(
+            asyncio.run(self.amanager.getRevisionAt(start)), self.rim)
+        self.assertIsNone(
+            asyncio.run(self.amanager.getRevisionAt(
+                start - datetime.timedelta(days=1))))
+
+    def test_addRevision(self):
+        rim2 = self.rim.__im_clone__()
+        rim2.__im_version__ = 1
+        rim2.__im_finalize__()
+        asyncio.run(self.amanager.addRevision(rim2, old=self.rim))
+        self.assertListEqual(self.rimm.__data__, [self.rim, rim2])
+        self.assertIs(rim2.__im_manager__, self.rimm)
+
+    def test_rollbackToRevision(self):
+        with self.rim.__im_update__():
+            pass
+        asyncio.run(self.amanager.rollbackToRevision(self.rim))
+        self.assertListEqual(self.rimm.__data__, [self.rim])
+
+    def test_getRevisionHistory(self):
+        self.amanager.fetchSize = 2
+        revisions = [self.rim]
+        for idx in range(4):
+            with revisions[-1].__im_update__(creator=f'user{idx % 2}') as rim:
+                pass
+            revisions.append(rim)
+
+        async def getHistory(**kw):
+            return [
+                rim async for rim in self.amanager.getRevisionHistory(**kw)]
+
+        self.assertListEqual(asyncio.run(getHistory()), revisions)
+        self.assertListEqual(
+            asyncio.run(getHistory(creator='user1', reversed=True)),
+            [revisions[4], revisions[2]])
+
+    def test_getRevisionStubs(self):
+        self.amanager.fetchSize = 2
+        for idx in range(4):
+            with self.rimm.getCurrentRevision().__im_update__():
+                pass
+
+        async def getStubs(**kw):
+            return [
+                stub.__im_version__
+                async for stub in self.amanager.getRevisionStubs(**kw)]
+
+        self.assertListEqual(asyncio.run(getStubs()), [0, 1, 2, 3, 4])
+        self.assertListEqual(
+            asyncio.run(getStubs(batchStart=1, batchSize=2)), [1, 2])
+        self.assertListEqual(
+            asyncio.run(getStubs(reversed=True, beforeVersion=3)), [2, 1, 0])
+
+    def test_im_aupdate(self):
+
+        async def update():
+            async with self.rim.__im_aupdate__(creator='arthur') as rim2:
+                rim2.answer = 42
+            return rim2
+
+        rim2 = asyncio.run(update())
+        self.assertListEqual(self.rimm.__data__, [self.rim, rim2])
+        self.assertEqual(rim2.__im_creator__, 'arthur')
+        self.assertEqual(rim2.__im_version__, 1)
+        self.assertEqual(self.rim.__im_state__, interfaces.IM_STATE_RETIRED)
+
+    def test_im_aupdate_withAsyncManager(self):
+        manager = mock.Mock()
+        zope.interface.alsoProvides(
+            manager, interfaces.IAsyncRevisionedImmutableManager)
+        manager.addRevision = mock.AsyncMock()
+        self.rim.__dict__['__im_manager__'] = manager
+
+        async def update():
+            async with self.rim.__im_aupdate__() as rim2:
+                pass
+            return rim2
+
+        rim2 = asyncio.run(update())
+        manager.addRevision.assert_awaited_once_with(rim2, old=self.rim)
+
+
+class RebaseChangesTest(unittest.TestCase):
+
+    def test_rebaseChanges(self):
+        self.assertDictEqual(
+            revisioned.rebaseChanges({'a': 1}, {'b': 2}), {'a': 1})
+
+    def test_rebaseChanges_withSameChange(self):
+        self.assertDictEqual(
+            revisioned.rebaseChanges(
+                {'a': 1, 'b': revisioned.DELETED},
+                {'a': 1, 'b': revisioned.DELETED}),
+            {})
+
+    def test_rebaseChanges_withConflict(self):
+        with self.assertRaises(revisioned.RevisionConflictError):
+            revisioned.rebaseChanges({'a': 1}, {'a': 2})
+        with self.assertRaises(revisioned.RevisionConflictError):
+            revisioned.rebaseChanges({'a': 1}, {'a': revisioned.DELETED})
+
+    def test_rebaseChanges_withNestedChanges(self):
+        ours = {'a': revisioned.DictDelta({'x': 1, 'y': 2})}
+        theirs = {'a': revisioned.DictDelta({'y': 2, 'z': 3})}
+        changes = revisioned.rebaseChanges(ours, theirs)
+        self.assertDictEqual(changes['a'].changes, {'x': 1})
+
+    def test_rebaseChanges_withNestedConflict(self):
+        ours = {'a': revisioned.DictDelta({'x': 1})}
+        theirs = {'a': {'x': 2}}
+        with self.assertRaises(revisioned.RevisionConflictError):
+            revisioned.rebaseChanges(ours, theirs)
+
 
 class RevisionedMappingTest(unittest.TestCase):
 
@@ -433,6 +1498,84 @@ class RevisionedMappingTest(unittest.TestCase):
         del map['q1']
         self.assertNotIn('q1', map.__data__)
 
+    def createMapping(self):
+        map = revisioned.RevisionedMapping()
+        for key in ('q1', 'q2'):
+            with revisioned.RevisionedImmutable.__im_create__() as factory:
+                rim = factory()
+            rimm = map.__data__[key] = \
+                revisioned.SimpleRevisionedImmutableManager()
+            rimm.now = lambda day=int(key[1]): datetime.datetime(2020, 1, day)
+            rimm.addRevision(rim)
+            rimm.now = lambda: datetime.datetime(2020, 1, 3)
+            with rim.__im_update__():
+                pass
+        return map
+
+    def test_asOf(self):
+        map = self.createMapping()
+        snapshot = map.asOf(datetime.datetime(2020, 1, 2))
+        self.assertIsInstance(snapshot, collections.abc.Mapping)
+        self.assertEqual(len(snapshot), 2)
+        self.assertListEqual(list(snapshot), ['q1', 'q2'])
+        self.assertEqual(snapshot['q1'].__im_version__, 0)
+        self.assertEqual(snapshot['q2'].__im_version__, 0)
+        snapshot = map.asOf(datetime.datetime(2020, 1, 3))
+        self.assertIs(snapshot['q1'], map['q1'])
+
+    def test_asOf_withInactiveKey(self):
+        map = self.createMapping()
+        snapshot = map.asOf(datetime.datetime(2020, 1, 1))
+        self.assertListEqual(list(snapshot), ['q1'])
+        self.assertNotIn('q2', snapshot)
+        with self.assertRaises(KeyError):
+            snapshot['q2']
+        with self.assertRaises(KeyError):
+            snapshot['q3']
+
+    def test_asOf_isLazy(self):
+        map = self.createMapping()
+        snapshot = map.asOf(datetime.datetime(2020, 1, 2))
+        snapshot['q2']
+        self.assertListEqual(list(snapshot.__resolved__), ['q2'])
+
+    def test_snapshot(self):
+        map = self.createMapping()
+        q1, q2 = map['q1'], map['q2']
+        snapshot = map.snapshot()
+        with q1.__im_update__() as q1b:
+            pass
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            q3 = factory()
+        map['q3'] = q3
+        # The snapshot is not affected by later writes.
+        self.assertIsInstance(
+            snapshot, revisioned.CommittedRevisionedMappingSnapshot)
+        self.assertDictEqual(dict(snapshot), {'q1': q1, 'q2': q2})
+        self.assertDictEqual(
+            dict(map.snapshot()), {'q1': q1b, 'q2': q2, 'q3': q3})
+
+    def test_snapshot_withReplacedKey(self):
+        map = self.createMapping()
+        q1 = map['q1']
+        snapshot = map.snapshot()
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        map['q1'] = rim
+        del map['q2']
+        self.assertIs(snapshot['q1'], q1)
+        self.assertIn('q2', snapshot)
+
+    def test_asOf_isReadOnly(self):
+        map = self.createMapping()
+        snapshot = map.asOf(datetime.datetime(2020, 1, 2))
+        with revisioned.RevisionedImmutable.__im_create__() as factory:
+            rim = factory()
+        map['q3'] = rim
+        self.assertNotIn('q3', snapshot)
+        with self.assertRaises(TypeError):
+            snapshot['q3'] = rim
+
 
 class RevisionedFunctionalTest(unittest.TestCase):
 
@@ -0,0 +1,159 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""SQLite-backed Revisioned Immutable Container Tests."""
+import datetime
+import sqlite3
+import unittest
+
+from shoobx.immutable import feed, interfaces, revisioned, sqlite
+from shoobx.immutable.tests.container import ContainerTests, createQuestion
+
+
+class SQLiteRevisionedImmutableContainerTest(
+        ContainerTests, unittest.TestCase):
+
+    filename = 'questions.db'
+
+    def createContainer(self, path, **kw):
+        return sqlite.SQLiteRevisionedImmutableContainer(path, **kw)
+
+    def test_schema(self):
+        mode, = self.questions.execute('PRAGMA journal_mode')[0]
+        self.assertEqual(mode, 'wal')
+        indexes = {
+            row[1] for row in self.questions.execute(
+                'PRAGMA index_list({table})')}
+        self.assertEqual(
+            indexes, {'immutables_name_version', 'immutables_name_endOn'})
+
+    def test_schema_usesIndex(self):
+        plan = self.questions.execute(
+            'EXPLAIN QUERY PLAN SELECT version FROM {table} '
+            'WHERE name = ? AND endOn IS NULL', ['everything'])
+        self.assertIn('immutables_name_endOn', plan[0][-1])
+
+    def test_getitem_loadsRevision(self):
+        q, q2, q3 = self.createHistory()
+        rev = self.questions['everything']
+        self.assertIsNot(rev, q3)
+        self.assertEqual(rev.answer, 43)
+
+    def test_addRevision_withConcurrentReaders(self):
+        self.createHistory()
+        # Two readers loaded the same current revision.
+        q = self.questions['everything']
+        other = self.questions['everything']
+        with other.__im_update__() as q2:
+            q2.answer = 44
+        with self.assertRaises(revisioned.RevisionConflictError):
+            with q.__im_update__() as q3:
+                q3.answer = 45
+        self.assertEqual(self.questions['everything'].answer, 44)
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 4)
+
+    def test_addRevision_withRebase(self):
+        self.questions.rebaseOnConflict = True
+        self.createHistory()
+        q = self.questions['everything']
+        other = self.questions['everything']
+        with other.__im_update__() as q2:
+            q2.answer = 44
+        with q.__im_update__() as q3:
+            q3.question = 'What is the question'
+        rev = self.questions['everything']
+        self.assertEqual(rev.__im_version__, 4)
+        self.assertEqual(rev.question, 'What is the question')
+        self.assertEqual(rev.answer, 44)
+
+    def test_addRevision_withFailingInsert(self):
+        q, q2, q3 = self.createHistory()
+        # The version of the new revision exists already.
+        q4 = q3.__im_clone__()
+        q4.answer = 44
+        q4.__im_finalize__()
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.questions.addRevision(q4, old=q3)
+        # The old revision is still current, in memory and in the database.
+        self.assertIsNone(q3.__im_end_on__)
+        self.assertEqual(q3.__im_state__, interfaces.IM_STATE_LOCKED)
+        rev = self.questions['everything']
+        self.assertEqual(rev.answer, 43)
+        self.assertIsNone(rev.__im_end_on__)
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 3)
+
+    def test_delitem_removesDocuments(self):
+        q, q2, q3 = self.createHistory()
+        del self.questions['everything']
+        self.assertNotIn('everything', self.questions)
+        self.assertEqual(len(self.questions), 0)
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 0)
+
+    def test_delitem_withoutRemoveDocuments(self):
+        self.questions.removeDocuments = False
+        q, q2, q3 = self.createHistory()
+        del self.questions['everything']
+        self.assertNotIn('everything', self.questions)
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 3)
+
+        questions = self.questions.withDeletedItems()
+        self.assertEqual(list(questions), ['everything'])
+        rev = questions['everything']
+        self.assertEqual(rev.__im_state__, interfaces.IM_STATE_DELETED)
+        self.assertEqual(rev.__im_end_on__, datetime.datetime(2020, 1, 4))
+
+    def test_transaction_withError(self):
+        q, q2, q3 = self.createHistory()
+        with self.assertRaises(RuntimeError):
+            with self.questions.transaction():
+                self.questions.execute('DELETE FROM {table}')
+                raise RuntimeError()
+        self.assertEqual(self.questions.getNumberOfRevisions(q), 3)
+
+    def test_table(self):
+        self.createHistory()
+        other = sqlite.SQLiteRevisionedImmutableContainer(
+            self.path, table='other')
+        self.addCleanup(other.close)
+        self.assertEqual(len(other), 0)
+        self.assertEqual(len(self.questions), 1)
+
+    def test_changeFeed_withConcurrentReaders(self):
+        self.questions.changeFeed = feed.ChangeFeed()
+        sub = self.questions.changeFeed.subscribe(feed.QueueSubscriber())
+        q = createQuestion('What is the answer')
+        self.questions['everything'] = q
+        other = self.questions['everything']
+        with other.__im_update__():
+            pass
+        with self.assertRaises(revisioned.RevisionConflictError):
+            with q.__im_update__():
+                pass
+        self.assertEqual(len(sub.getBatch()), 2)
+
+    def test_getRevisionHistory_withVersionsUsesIndex(self):
+        q, q2, q3 = self.createHistory()
+        where, params, suffix = self.questions.getHistoryQuery(
+            q, batchSize=10, reversed=True, beforeVersion=100)
+        plan = self.questions.execute(
+            'EXPLAIN QUERY PLAN SELECT version FROM {table} WHERE ' +
+            where + suffix, params)
+        details = ' '.join(row[-1] for row in plan)
+        self.assertIn('immutables_name_version', details)
+        self.assertNotIn('TEMP B-TREE', details)
+
+    def test_getRevisions_withManyKeys(self):
+        q, q2, q3 = self.createHistory()
+        keys = [('everything', version) for version in range(1000)]
+        revisions = self.questions.getRevisions(keys)
+        self.assertEqual(len(revisions), 3)
+
+    def test_getNumberOfRevisionsMany_withManyNames(self):
+        self.createHistory()
+        names = ['everything'] + [f'q{idx}' for idx in range(1500)]
+        counts = self.questions.getNumberOfRevisionsMany(names)
+        self.assertEqual(len(counts), 1501)
+        self.assertEqual(counts['everything'], 3)
+        self.assertEqual(sum(counts.values()), 3)
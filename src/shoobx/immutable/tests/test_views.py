@@ -0,0 +1,193 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Incremental Views Tests."""
+import unittest
+
+from shoobx.immutable import immutable, views
+
+
+def count(node, results):
+    # Count all immutable nodes.
+    return 1 + sum(results.values())
+
+
+def total(node, results):
+    # Sum all int leaves.
+    result = sum(results.values())
+    for key, value in views.iterItems(node):
+        if isinstance(value, int):
+            result += value
+    return result
+
+
+class Person(immutable.Immutable):
+    pass
+
+
+class IterItemsTest(unittest.TestCase):
+
+    def test_dict(self):
+        with immutable.ImmutableDict.__im_create__() as factory:
+            dct = factory(one=1)
+        self.assertEqual(list(views.iterItems(dct)), [('one', 1)])
+
+    def test_list(self):
+        with immutable.ImmutableList.__im_create__() as factory:
+            im_list = factory([1, 2])
+        self.assertEqual(list(views.iterItems(im_list)), [(0, 1), (1, 2)])
+
+    def test_set(self):
+        with immutable.ImmutableSet.__im_create__() as factory:
+            im_set = factory({1, 2})
+        self.assertEqual(list(views.iterItems(im_set)), [])
+
+    def test_immutable(self):
+        with Person.__im_create__() as factory:
+            person = factory()
+            person.name = 'Stephan'
+        self.assertEqual(
+            list(views.iterItems(person)), [('name', 'Stephan')])
+
+
+class IncrementalViewTest(unittest.TestCase):
+
+    def doc(self):
+        with immutable.ImmutableDict.__im_create__() as factory:
+            return factory({
+                'a': {'x': 1, 'y': [2, 3]},
+                'b': {'z': 4},
+                'c': {5, 6},
+                'd': 7,
+            })
+
+    def test_update(self):
+        view = views.IncrementalView(total)
+        self.assertIsNone(view.value)
+        self.assertEqual(view.update(self.doc()), 17)
+        self.assertEqual(view.value, 17)
+        self.assertEqual(view.computed, 5)
+
+    def test_update_withSameTree(self):
+        view = views.IncrementalView(count)
+        doc = self.doc()
+        view.update(doc)
+        self.assertEqual(view.update(doc), 5)
+        self.assertEqual(view.computed, 0)
+
+    def test_update_withChangedLeaf(self):
+        view = views.IncrementalView(total)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            doc2['a']['x'] = 11
+        self.assertEqual(view.update(doc2), 27)
+        # Only `a` and the root were visited and recomputed.
+        self.assertEqual(view.visited, 2)
+        self.assertEqual(view.computed, 2)
+        # Unchanged nodes keep the entries of their origins.
+        self.assertIs(view.entry.children['b'].node, doc['b'])
+        self.assertIs(view.entry.node, doc2)
+
+    def test_update_withManyUpdates(self):
+        view = views.IncrementalView(total)
+        with immutable.ImmutableDict.__im_create__() as factory:
+            doc = factory({
+                str(idx): {'x': idx, 'y': [idx]} for idx in range(100)})
+        self.assertEqual(view.update(doc), 9900)
+        self.assertEqual(view.visited, 201)
+        for idx in range(3):
+            with doc.__im_update__() as doc:
+                doc[str(idx)]['y'].append(1)
+            self.assertEqual(view.update(doc), 9901 + idx)
+            # Only the changed path is walked.
+            self.assertEqual(view.visited, 3)
+            self.assertEqual(view.computed, 3)
+
+    def test_update_withBool(self):
+        view = views.IncrementalView(total)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            doc2['a']['x'] = True
+        self.assertEqual(view.update(doc2), 17)
+        # `True == 1`, but the value changed.
+        self.assertEqual(view.computed, 2)
+
+    def test_update_withBoolInSet(self):
+        view = views.IncrementalView(count)
+        with immutable.ImmutableDict.__im_create__() as factory:
+            doc = factory({'c': {0, 1}})
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            doc2['c'] = {False, True}
+        view.update(doc2)
+        self.assertEqual(view.computed, 2)
+
+    def test_update_withEqualSubtree(self):
+        view = views.IncrementalView(count)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            doc2['b'] = {'z': 4}
+        self.assertEqual(view.update(doc2), 5)
+        # The new `b` is no clone, so it is compared with the old one, and
+        # nothing needs to be recomputed.
+        self.assertEqual(view.visited, 2)
+        self.assertEqual(view.computed, 0)
+
+    def test_update_withChangedList(self):
+        view = views.IncrementalView(total)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            doc2['a']['y'].append(10)
+        self.assertEqual(view.update(doc2), 27)
+        self.assertEqual(view.visited, 3)
+        self.assertEqual(view.computed, 3)
+
+    def test_update_withChangedSet(self):
+        view = views.IncrementalView(count)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            doc2['c'].add(8)
+        self.assertEqual(view.update(doc2), 5)
+        self.assertEqual(view.computed, 2)
+
+    def test_update_withRemovedChild(self):
+        view = views.IncrementalView(count)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            del doc2['b']
+        self.assertEqual(view.update(doc2), 4)
+        self.assertEqual(view.computed, 1)
+
+    def test_update_withReplacedChildType(self):
+        view = views.IncrementalView(count)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            doc2['b'] = ['z', 4]
+        self.assertEqual(view.update(doc2), 5)
+        self.assertEqual(view.computed, 2)
+
+    def test_update_withUnchangedUpdate(self):
+        view = views.IncrementalView(count)
+        doc = self.doc()
+        view.update(doc)
+        with doc.__im_update__() as doc2:
+            pass
+        self.assertEqual(view.update(doc2), 5)
+        self.assertEqual(view.visited, 0)
+        self.assertEqual(view.computed, 0)
+
+    def test_update_withTransient(self):
+        view = views.IncrementalView(count)
+        with immutable.ImmutableDict.__im_create__(finalize=False) as factory:
+            doc = factory()
+        with self.assertRaises(ValueError):
+            view.update(doc)
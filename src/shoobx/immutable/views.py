@@ -0,0 +1,157 @@
+###############################################################################
+#
+# Copyright 2013-2019 by Shoobx, Inc.
+#
+###############################################################################
+"""Incremental Views on Immutables.
+
+An incremental view derives a value from an immutable tree, for example an
+index or an aggregate, by computing a result for every immutable node from
+the results of its immutable children. After an update, only the nodes that
+changed are visited and recomputed::
+
+  def count(node, results):
+      return 1 + sum(results.values())
+
+  view = IncrementalView(count)
+  view.update(doc)
+  with doc.__im_update__() as doc2:
+      doc2['a']['b'] = 1
+  view.update(doc2)  # Only `doc2['a']` and `doc2` are recomputed.
+
+Unchanged nodes are found using the origins of clones, see
+`immutable.getOrigin()`, so that their subtrees are not walked.
+"""
+import collections.abc
+
+from shoobx.immutable import immutable, interfaces
+
+
+def iterItems(node):
+    """Iterate over all `(key, value)` pairs of an immutable node.
+
+    Keys are dict keys, list indices or attribute names. Sets have no
+    addressable items and are treated as leaves.
+    """
+    if isinstance(node, immutable.ImmutableSet):
+        return iter(())
+    if isinstance(node, collections.abc.Mapping):
+        return iter(node.items())
+    if isinstance(node, immutable.ImmutableList):
+        return enumerate(node)
+    return (
+        (name, value)
+        for name, value in node.__dict__.items()
+        if not immutable.isInternalAttr(node, name))
+
+
+def isSame(value, other):
+    """Whether two leaves are equal and of the same type.
+
+    Unlike `==`, this tells apart for example `1` and `True`.
+    """
+    return type(value) is type(other) and value == other
+
+
+def isSameSet(im_set, other):
+    """Whether two sets have the same values of the same types."""
+    return len(im_set) == len(other) and \
+        {(type(value), value) for value in im_set} == \
+        {(type(value), value) for value in other}
+
+
+class ViewEntry:
+    """Result of a node together with the state it was computed from.
+
+    The node is the origin of the node the result was computed for, if it
+    has one, so that all unchanged clones of it match the entry.
+    """
+
+    __slots__ = ('node', 'result', 'children', 'leaves')
+
+    def __init__(self, node, result, children, leaves):
+        self.node = node
+        self.result = result
+        # Entries of all immutable children by key.
+        self.children = children
+        # All other values by key.
+        self.leaves = leaves
+
+
+class IncrementalView:
+    """Derived value of an immutable tree, recomputed incrementally.
+
+    `compute(node, results)` is called for every immutable node of the tree
+    with the results of its immutable children by key and returns the result
+    of the node. The result of the root is the value of the view.
+
+    Nodes that are (unchanged clones of) the node they were last computed
+    from are not visited. Other nodes are only recomputed if their values or
+    the results of their children changed. Values are compared by type and
+    equality, so that changing `1` to `True` is a change.
+    """
+
+    def __init__(self, compute):
+        self.compute = compute
+        self.entry = None
+        # Number of nodes visited by the last update.
+        self.visited = 0
+        # Number of nodes computed by the last update.
+        self.computed = 0
+
+    @property
+    def value(self):
+        return self.entry.result if self.entry is not None else None
+
+    def update(self, root):
+        if root.__im_state__ == interfaces.IM_STATE_TRANSIENT:
+            raise ValueError(
+                'Only locked immutables can have incremental views.', root)
+        self.visited = 0
+        self.computed = 0
+        self.entry = self.reconcile(root, self.entry)
+        return self.entry.result
+
+    def reconcile(self, node, entry):
+        origin = immutable.getOrigin(node)
+        if origin is None:
+            origin = node
+        if entry is not None and entry.node is origin:
+            return entry
+
+        self.visited += 1
+        children = {}
+        leaves = {}
+        for key, value in iterItems(node):
+            if interfaces.IImmutable.providedBy(value):
+                old = entry.children.get(key) if entry is not None else None
+                children[key] = self.reconcile(value, old)
+            else:
+                leaves[key] = value
+
+        if self.isUnchanged(node, entry, children, leaves):
+            # Reuse the previous result for the new node.
+            entry.node = origin
+            return entry
+
+        self.computed += 1
+        result = self.compute(
+            node, {key: child.result for key, child in children.items()})
+        return ViewEntry(origin, result, children, leaves)
+
+    def isUnchanged(self, node, entry, children, leaves):
+        if entry is None or type(node) is not type(entry.node):
+            return False
+        if isinstance(node, immutable.ImmutableSet):
+            return isSameSet(node, entry.node)
+        if children.keys() != entry.children.keys():
+            return False
+        for key, child in children.items():
+            if child is not entry.children[key]:
+                return False
+        if leaves.keys() != entry.leaves.keys():
+            return False
+        for key, value in leaves.items():
+            if not isSame(value, entry.leaves[key]):
+                return False
+        return True